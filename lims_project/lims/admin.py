@@ -1,12 +1,16 @@
 from __future__ import print_function
 import sys
+from collections import defaultdict
+from io import BytesIO
 
+from django import forms
 from django.contrib import admin, messages
 from django.contrib.admin.models import LogEntry, DELETION
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.contenttypes import generic
-from django.contrib.contenttypes.models import ContentType
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect
+from django.db import models
+from django.http import HttpResponse, HttpResponseRedirect
 from django.utils.html import escape
 from django.utils.translation import ugettext_lazy as _
 from django.template import Context, Template
@@ -16,9 +20,14 @@ from import_export.admin import ImportExportModelAdmin
 from lims.models import Apparatus, ApparatusSubdivision, Collaborator, Sample, SampleType, SampleLocation, \
     Protocol, ExtractedCell, ExtractedDNA, QPCR, RTMDA, SAGPlate, \
     SAGPlateDilution, DNALibrary, SequencingRun, Metagenome, Primer, \
-    Amplicon, SAG, DNAFromPureCulture, ReadFile, Container, ContainerType, BarcodePrinter, BarcodeToModel, BarcodeTemplate
+    Amplicon, SAG, DNAFromPureCulture, ReadFile, Container, ContainerType, BarcodePrinter, BarcodeToModel, BarcodeTemplate, \
+    parse_barcode, unicode_select_related
 
 from lims.import_export_resources import SampleResource, ContainerResource
+from lims.lineage import resolve_ancestry
+from lims.metadata import model_metadata
+from lims.storage import in_apparatus, resolve_storage_paths
+from lims import exports, refcache, samplesheet
 
 try:
     from sh import lpr
@@ -29,12 +38,89 @@ except ImportError:
     pass
 
 
+class StoragePathChangeList(ChangeList):
+    """ChangeList that resolves the storage paths of all objects on the page
+    at once, for the storage_path column"""
+    def get_results(self, request):
+        super(StoragePathChangeList, self).get_results(request)
+        # Resolves the objects cached in the result_list queryset
+        resolve_storage_paths(self.result_list)
+
+
+class SequencingRunChangeList(ChangeList):
+    """ChangeList that resolves the ancestry of the DNA libraries of all
+    sequencing runs on the page at once"""
+    def get_results(self, request):
+        super(SequencingRunChangeList, self).get_results(request)
+        runs = list(self.result_list)
+        through = SequencingRun.dna_library.through
+        library_ids = defaultdict(list)
+        for run_id, library_id in through.objects.filter(sequencingrun__in=runs) \
+                .values_list('sequencingrun_id', 'dnalibrary_id'):
+            library_ids[run_id].append(library_id)
+        ancestry = resolve_ancestry(DNALibrary.objects.filter(
+            sequencingrun__in=runs).distinct())
+        for run in runs:
+            run._ancestry = [ancestry[library_id] for library_id
+                             in library_ids[run.pk]]
+
+
+class LIMSModelAdmin(admin.ModelAdmin):
+    """ModelAdmin that follows every foreign key in list_display, and the
+    relations their __unicode__ uses, in the changelist query. Relations used
+    by other list_display columns can be given in list_prefetch_related. This
+    keeps the number of queries of a changelist independent of the number of
+    rows. A storage_path column is resolved for the whole page with
+    lims.storage.resolve_storage_paths."""
+    list_prefetch_related = ()
+
+    def __init__(self, model, admin_site):
+        super(LIMSModelAdmin, self).__init__(model, admin_site)
+        if self.list_select_related is False:
+            self.list_select_related = tuple(self.get_list_select_related())
+
+    def get_list_select_related(self):
+        paths = []
+        for name in self.list_display:
+            if name in ('__str__', '__unicode__'):
+                paths += unicode_select_related(self.model)
+                continue
+            try:
+                field = self.model._meta.get_field(name)
+            except models.FieldDoesNotExist:
+                continue
+            if isinstance(field.rel, models.ManyToOneRel):
+                paths.append(name)
+                paths += unicode_select_related(field.rel.to, name + "__")
+        return paths
+
+    def get_changelist(self, request, **kwargs):
+        if 'storage_path' in self.list_display:
+            return StoragePathChangeList
+        return super(LIMSModelAdmin, self).get_changelist(request, **kwargs)
+
+    def get_queryset(self, request):
+        qs = super(LIMSModelAdmin, self).get_queryset(request)
+        if self.list_prefetch_related:
+            qs = qs.prefetch_related(*self.list_prefetch_related)
+        return qs
+
+    def get_search_results(self, request, queryset, search_term):
+        """A barcode of this model, e.g. SA:10Y31, is looked up exactly instead
+        of searching search_fields."""
+        parsed = parse_barcode(search_term)
+        if parsed is not None and parsed[0] is self.model:
+            return queryset.filter(**parsed[1]), False
+        return super(LIMSModelAdmin, self).get_search_results(request, queryset,
+                                                              search_term)
+
+
 def generate_all_fields_admin(classname):
     """Generate an Admin class which adds all fields to list_display except for
     notes."""
     #TODO: extend this for IndexByGroup models with read_only_fields/uid
     #TODO: show ForeignKeyFields that are not reversely related
-    return type(classname.__name__ + "Admin", (admin.ModelAdmin,),
+    return type(classname.__name__ + "Admin", (LIMSModelAdmin,),
                 {'list_display': ([f.name for (f, model) in
                                    classname._meta.get_fields_with_model() if
                                    model is None and f.name not in
@@ -46,25 +132,30 @@ for model in standard_models:
     admin.site.register(model, generate_all_fields_admin(model))
 
 
+def barcode_label_template(btm):
+    """Returns the django Template of the label of a barcode-to-template
+    object. It only depends on btm, so it can be rendered for many objects."""
+    fields = ["{{{{ o.{f} }}}}".format(f=f) for f in btm.barcode_fields.split()]
+    # Shorten dates
+    #fields = [f.isoformat().split("T")[0] if isinstance(f, datetime.datetime) else f for f in fields]
+    #print("len: %d" % len(fields), file=sys.stderr)
+    # throw error if not enough fields are given
+    if len(fields) < btm.template.nr_fields:
+        print("Not enough fields given", file=sys.stderr)
+
+    # change template to work for python2.6, replace {} with {0}, {1} etc
+    templ = str(btm.template.template)
+    for i in range(btm.template.nr_fields):
+        templ = templ.replace("{}", "{{{0}}}".format(i), 1)
+
+    return Template(templ.format(*fields))
+
+
 def generate_barcode_print_action(btm):
     """Generates a single print_barcode action function for a given barcode-to-template object"""
     def print_barcode(modeladmin, request, queryset):
+        t = barcode_label_template(btm)
         for q in queryset:
-            fields = ["{{{{ o.{f} }}}}".format(f=f) for f in btm.barcode_fields.split()]
-            # Shorten dates
-            #fields = [f.isoformat().split("T")[0] if isinstance(f, datetime.datetime) else f for f in fields]
-            #print("len: %d" % len(fields), file=sys.stderr)
-            # throw error if not enough fields are given
-            if len(fields) < btm.template.nr_fields:
-                print("Not enough fields given", file=sys.stderr)
-
-            # change template to work for python2.6, replace {} with {0}, {1} etc
-            templ = str(btm.template.template)
-            for i in range(btm.template.nr_fields):
-                templ = templ.replace("{}", "{{{0}}}".format(i), 1)
-
-            out = templ.format(*fields)
-            t = Template(out)
             c = Context({"o": q})
             if LIMS_LPR:
                 lpr("-P", btm.printer.name, '-o', 'raw', _in=t.render(c))
@@ -78,8 +169,9 @@ def generate_barcode_print_action(btm):
 def generate_barcode_print_actions(model):
     """Generates all print_barcode action functions for each printer/template
     combination for a given model."""
-    ct = ContentType.objects.get_for_model(model)
-    btms = BarcodeToModel.objects.filter(content_type=ct)
+    btms = BarcodeToModel.objects.filter(
+        content_type=model_metadata(model).content_type_id).select_related(
+            *unicode_select_related(BarcodeToModel))
 
     action_functions = [(unicode(btm.template),
                             (generate_barcode_print_action(btm),
@@ -95,7 +187,7 @@ class ContainerInline(generic.GenericTabularInline):
     extra = 0
 
 
-class AmpliconAdmin(admin.ModelAdmin):
+class AmpliconAdmin(LIMSModelAdmin):
     list_display = [
         'id',
         'uid',
@@ -104,8 +196,10 @@ class AmpliconAdmin(admin.ModelAdmin):
         'index_by_group',
         'diversity_report',
         'buffer',
+        'storage_path',
         'notes',
     ]
+    search_fields = ('uid', )
     readonly_fields = ('index_by_group', 'uid')
     inlines = [
         ContainerInline,
@@ -129,13 +223,12 @@ class ContainerApparatusFilter(admin.SimpleListFilter):
 
     def lookups(self, request, model_admin):
         """The options are the different Apparatus objects"""
-        return [(ap.id, _(str(ap))) for ap in Apparatus.objects.all()]
+        return [(ap.id, _(str(ap))) for ap in refcache.cache.all(Apparatus)]
 
     def queryset(self, request, queryset):
         """Only return containers where the apparatus root is set to given value"""
         if self.value():
-            con_ids = [c.id for c in queryset if c.root_apparatus.id == int(self.value())]
-            return queryset.filter(id__in=con_ids)
+            return in_apparatus(queryset, self.value())
 
 
 class ContainerIsEmptyFilter(admin.SimpleListFilter):
@@ -153,11 +246,10 @@ class ContainerIsEmptyFilter(admin.SimpleListFilter):
     def queryset(self, request, queryset):
         """If a value is specified only return is_empty with the same value"""
         if self.value():
-            empty_ids = [c.id for c in queryset if c.is_empty == (self.value() == "True")]
-            return queryset.filter(id__in=empty_ids)
+            return queryset.filter(object_id__isnull=(self.value() == "True"))
 
 
-class ContainerAdmin(ImportExportModelAdmin, admin.ModelAdmin):
+class ContainerAdmin(ImportExportModelAdmin, LIMSModelAdmin):
     resource_class = ContainerResource
     list_filter = [
         'date',
@@ -181,6 +273,16 @@ class ContainerAdmin(ImportExportModelAdmin, admin.ModelAdmin):
     ]
     #search_fields = ("parent",)
     raw_id_fields = ("parent",)
+    # The root columns follow the parents up to an apparatus_subdivision,
+    # which is joined for up to three levels of nesting
+    list_select_related = (
+        'type',
+        'parent__type',
+        'apparatus_subdivision__apparatus',
+        'parent__apparatus_subdivision__apparatus',
+        'parent__parent__apparatus_subdivision__apparatus',
+    )
+    list_prefetch_related = ('child__child', )
     list_per_page = 10
     # import_export change template to include csv
     import_template_name = 'import_export/lims_import.html'
@@ -196,7 +298,7 @@ class ContainerAdmin(ImportExportModelAdmin, admin.ModelAdmin):
 admin.site.register(Container, ContainerAdmin)
 
 
-class SampleAdmin(ImportExportModelAdmin, admin.ModelAdmin):
+class SampleAdmin(ImportExportModelAdmin, LIMSModelAdmin):
     resource_class = SampleResource
     editables = [
         'collaborator',
@@ -209,10 +311,12 @@ class SampleAdmin(ImportExportModelAdmin, admin.ModelAdmin):
         'shipping_method',
         'status',
     ]
+    search_fields = ('uid', )
     list_display = [
         'id',
         'uid',
         'barcode',
+        'storage_path',
     ] + editables
     # import_export change template to include csv
     import_template_name = 'import_export/lims_import.html'
@@ -250,7 +354,7 @@ class SampleAdmin(ImportExportModelAdmin, admin.ModelAdmin):
 admin.site.register(Sample, SampleAdmin)
 
 
-class CollaboratorAdmin(admin.ModelAdmin):
+class CollaboratorAdmin(LIMSModelAdmin):
     list_display = [
         'id',
         'first_name',
@@ -262,7 +366,7 @@ class CollaboratorAdmin(admin.ModelAdmin):
 admin.site.register(Collaborator, CollaboratorAdmin)
 
 
-class ExtractedCellAdmin(admin.ModelAdmin):
+class ExtractedCellAdmin(LIMSModelAdmin):
     list_display = [
         'id',
         'uid',
@@ -271,8 +375,10 @@ class ExtractedCellAdmin(admin.ModelAdmin):
         'protocol',
         'index_by_group',
         'protocol',
+        'storage_path',
         'notes'
     ]
+    search_fields = ('uid', )
     inlines = [
         ContainerInline,
     ]
@@ -286,7 +392,7 @@ class ExtractedCellAdmin(admin.ModelAdmin):
 admin.site.register(ExtractedCell, ExtractedCellAdmin)
 
 
-class ExtractedDNAAdmin(admin.ModelAdmin):
+class ExtractedDNAAdmin(LIMSModelAdmin):
     list_display = [
         'id',
         'uid',
@@ -297,8 +403,10 @@ class ExtractedDNAAdmin(admin.ModelAdmin):
         'protocol',
         'concentration',
         'buffer',
+        'storage_path',
         'notes',
     ]
+    search_fields = ('uid', )
     inlines = [
         ContainerInline,
     ]
@@ -312,7 +420,7 @@ class ExtractedDNAAdmin(admin.ModelAdmin):
 admin.site.register(ExtractedDNA, ExtractedDNAAdmin)
 
 
-class SAGPlateAdmin(admin.ModelAdmin):
+class SAGPlateAdmin(LIMSModelAdmin):
     list_display = [
         'id',
         'uid',
@@ -325,6 +433,7 @@ class SAGPlateAdmin(admin.ModelAdmin):
         'rt_mda',
         'notes',
     ]
+    search_fields = ('uid', )
     readonly_fields = ('index_by_group', 'uid')
     raw_id_fields = ("extracted_cell",)
 
@@ -335,7 +444,7 @@ class SAGPlateAdmin(admin.ModelAdmin):
 admin.site.register(SAGPlate, SAGPlateAdmin)
 
 
-class SAGPlateDilutionAdmin(admin.ModelAdmin):
+class SAGPlateDilutionAdmin(LIMSModelAdmin):
     list_display = [
         'id',
         'uid',
@@ -344,6 +453,7 @@ class SAGPlateDilutionAdmin(admin.ModelAdmin):
         'qpcr',
         'dilution',
     ]
+    search_fields = ('uid', )
     readonly_fields = ('index_by_group', 'uid')
     raw_id_fields = ("sag_plate",)
 
@@ -354,7 +464,7 @@ class SAGPlateDilutionAdmin(admin.ModelAdmin):
 admin.site.register(SAGPlateDilution, SAGPlateDilutionAdmin)
 
 
-class DNALibraryAdmin(admin.ModelAdmin):
+class DNALibraryAdmin(LIMSModelAdmin):
     list_display = [
         'id',
         'uid',
@@ -366,7 +476,9 @@ class DNALibraryAdmin(admin.ModelAdmin):
         'i7',
         'i5',
         'sample_name_on_platform',
+        'storage_path',
     ]
+    search_fields = ('uid', 'sample_name_on_platform')
     inlines = [
         ContainerInline,
     ]
@@ -380,12 +492,13 @@ class DNALibraryAdmin(admin.ModelAdmin):
 admin.site.register(DNALibrary, DNALibraryAdmin)
 
 
-class PrimerAdmin(admin.ModelAdmin):
+class PrimerAdmin(LIMSModelAdmin):
     list_display = [
         'id',
         'concentration',
         'tmelt',
         'stock',
+        'storage_path',
     ]
     inlines = [
         ContainerInline,
@@ -398,18 +511,19 @@ class PrimerAdmin(admin.ModelAdmin):
 admin.site.register(Primer, PrimerAdmin)
 
 
-class MetagenomeAdmin(admin.ModelAdmin):
+class MetagenomeAdmin(LIMSModelAdmin):
     list_display = [
         'id',
         'uid',
         'extracted_dna',
         'diversity_report',
     ]
+    search_fields = ('uid', )
     readonly_fields = ('index_by_group', 'uid')
 admin.site.register(Metagenome, MetagenomeAdmin)
 
 
-class SAGAdmin(admin.ModelAdmin):
+class SAGAdmin(LIMSModelAdmin):
     list_display = [
         'id',
         'uid',
@@ -418,10 +532,11 @@ class SAGAdmin(admin.ModelAdmin):
         'well',
         'concentration'
     ]
+    search_fields = ('uid', )
 admin.site.register(SAG, SAGAdmin)
 
 
-class DNAFromPureCultureAdmin(admin.ModelAdmin):
+class DNAFromPureCultureAdmin(LIMSModelAdmin):
     list_display = [
         'id',
         'uid',
@@ -432,7 +547,49 @@ class DNAFromPureCultureAdmin(admin.ModelAdmin):
 admin.site.register(DNAFromPureCulture, DNAFromPureCultureAdmin)
 
 
-class SequencingRunAdmin(admin.ModelAdmin):
+class SequencingRunForm(forms.ModelForm):
+    class Meta:
+        model = SequencingRun
+
+    def clean_dna_library(self):
+        """The indexes of the libraries added to a run should not collide
+        with those of the other libraries of the run. Collisions among the
+        libraries the run already has are reported by the
+        check_index_collisions action."""
+        libraries = self.cleaned_data['dna_library']
+        collisions = samplesheet.run_index_collisions(self.instance, libraries)
+        if collisions:
+            raise(forms.ValidationError(
+                [samplesheet.describe_collision(c) for c in collisions]))
+        return libraries
+
+
+def download_sample_sheet(modeladmin, request, queryset):
+    """Download the Illumina sample sheet of the selected SequencingRun"""
+    if queryset.count() != 1:
+        messages.error(request, "Select a single sequencing run to download its sample sheet")
+        return
+    run = queryset.get()
+    response = HttpResponse(content_type="text/csv")
+    response['Content-Disposition'] = 'attachment; filename="%s.csv"' % run.uid
+    samplesheet.write_sample_sheet(response, run)
+    return response
+download_sample_sheet.short_description = "Download sample sheet of selected sequencing run"
+
+
+def check_index_collisions(modeladmin, request, queryset):
+    """Reports the libraries with colliding indexes in the selected runs"""
+    for run in queryset:
+        collisions = samplesheet.find_index_collisions(samplesheet.run_libraries(run))
+        if collisions:
+            for c in collisions:
+                messages.error(request, "%s: %s" % (run, samplesheet.describe_collision(c)))
+        else:
+            messages.success(request, "%s: no index collisions" % run)
+check_index_collisions.short_description = "Check index collisions of selected sequencing runs"
+
+
+class SequencingRunAdmin(LIMSModelAdmin):
     list_display = [
         'id',
         'uid',
@@ -443,12 +600,46 @@ class SequencingRunAdmin(admin.ModelAdmin):
         'folder',
         'notes',
         'protocol',
+        'samples',
+        'collaborators',
+        'biosafety_level',
     ]
     filter_horizontal = ['dna_library']
+    form = SequencingRunForm
+    actions = [download_sample_sheet, check_index_collisions]
+
+    def get_changelist(self, request, **kwargs):
+        return SequencingRunChangeList
+
+    def samples(self, obj):
+        return ", ".join(sorted(set(a.sample.uid for a in obj._ancestry)))
+
+    def collaborators(self, obj):
+        return ", ".join(sorted(set(unicode(a.collaborator) for a in obj._ancestry)))
+
+    def biosafety_level(self, obj):
+        """The highest biosafety level of the samples"""
+        levels = [a.biosafety_level for a in obj._ancestry
+                  if a.biosafety_level is not None]
+        return max(levels) if levels else None
+    biosafety_level.short_description = "Biosafety level"
 admin.site.register(SequencingRun, SequencingRunAdmin)
 
 
-class ReadFileAdmin(admin.ModelAdmin):
+def export_lineage_parquet(modeladmin, request, queryset):
+    """Download the lineage of the selected ReadFiles as a Parquet file"""
+    if not exports.LIMS_PYARROW:
+        messages.error(request, "pyarrow could not be imported, Parquet export is unavailable")
+        return
+    out = BytesIO()
+    exports.write_lineage_parquet(out, queryset)
+    response = HttpResponse(out.getvalue(), content_type="application/octet-stream")
+    response['Content-Disposition'] = 'attachment; filename="lineage.parquet"'
+    return response
+export_lineage_parquet.short_description = "Export lineage of selected read files to Parquet"
+
+
+class ReadFileAdmin(LIMSModelAdmin):
     list_display = [
         'id',
         'filename',
@@ -458,10 +649,11 @@ class ReadFileAdmin(admin.ModelAdmin):
         'dna_library',
         'sequencing_run',
     ]
+    actions = [export_lineage_parquet]
 admin.site.register(ReadFile, ReadFileAdmin)
 
 
-class ProtocolAdmin(admin.ModelAdmin):
+class ProtocolAdmin(LIMSModelAdmin):
     list_display = [
         'name',
         'revision',
@@ -471,7 +663,7 @@ class ProtocolAdmin(admin.ModelAdmin):
 admin.site.register(Protocol, ProtocolAdmin)
 
 
-class LogEntryAdmin(admin.ModelAdmin):
+class LogEntryAdmin(LIMSModelAdmin):
     """From: https://djangosnippets.org/snippets/2484/"""
     date_hierarchy = 'action_time'
     readonly_fields = LogEntry._meta.get_all_field_names()
@@ -515,8 +707,4 @@ class LogEntryAdmin(admin.ModelAdmin):
     object_link.allow_tags = True
     object_link.admin_order_field = 'object_repr'
     object_link.short_description = u'object'
-
-    def queryset(self, request):
-        return super(LogEntryAdmin, self).queryset(request) \
-            .prefetch_related('content_type')
 admin.site.register(LogEntry, LogEntryAdmin)
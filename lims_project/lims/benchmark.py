@@ -0,0 +1,206 @@
+"""Benchmarks of the pages and operations that slow down with the size of the
+database. Each case is run a number of times, recording the wall clock time
+and the number of SQL queries. All cases run in a transaction that is rolled
+back, so the benchmark user, imports etc. leave no trace. Results are plain
+dictionaries that are stored as JSON, one file per run, so runs on different
+commits can be compared."""
+from __future__ import print_function
+import os
+import json
+import time
+import datetime
+import subprocess
+
+import tablib
+
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.template import Context
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+
+from lims.admin import barcode_label_template
+from lims.import_export_resources import SampleResource
+from lims.models import Apparatus, Container, DNALibrary, ReadFile, SAG, \
+    SAGPlate, Sample, BarcodeTemplate, BarcodeToModel, LINEAGE_MODELS
+from lims.labdata import sample_uid
+
+BENCHMARK_USER = "lims-benchmark"
+# Number of rows imported and labels rendered
+NR_IMPORT_ROWS = 100
+NR_LABELS = 384
+
+
+class Benchmark(object):
+    """Runs the benchmark cases against the current database"""
+    def __init__(self, repeat=3):
+        self.repeat = repeat
+        self.client = Client()
+
+    def setup(self):
+        """Picks the objects used by the cases, preferably a Sample with a
+        SAG plate, and logs in a superuser"""
+        plate = SAGPlate.objects.order_by('id').first()
+        self.sample = Sample.objects.get(pk=plate.root_sample_id) if plate \
+            else Sample.objects.order_by('id').first()
+        if self.sample is None:
+            raise(Exception("The database contains no samples, see the "
+                            "generate_lab_data command"))
+        self.apparatus = Apparatus.objects.order_by('id').first()
+        get_user_model().objects.create_superuser(BENCHMARK_USER,
+                                                  "benchmark@example.com",
+                                                  BENCHMARK_USER)
+        self.client.login(username=BENCHMARK_USER, password=BENCHMARK_USER)
+
+    def get(self, url, **params):
+        def case():
+            response = self.client.get(url, params)
+            if response.status_code != 200:
+                raise(Exception("GET %s returned %d" % (url, response.status_code)))
+        return case
+
+    def import_samples(self, new):
+        """Import NR_IMPORT_ROWS existing samples, as new samples if new"""
+        resource = SampleResource()
+        dataset = resource.export(Sample.objects.order_by('id')[:NR_IMPORT_ROWS])
+        del dataset['id']
+        if new:
+            # UIDs counting down from ZZZZZ, not used by generate_lab_data
+            column = dataset.headers.index('uid')
+            dataset = tablib.Dataset(*[
+                row[:column] + (sample_uid(36 ** 5 - 1 - i), ) + row[column + 1:]
+                for (i, row) in enumerate(dataset)], headers=dataset.headers)
+
+        def case():
+            result = resource.import_data(dataset, dry_run=True)
+            if result.has_errors():
+                raise(Exception("Import failed"))
+        return case
+
+    def render_labels(self):
+        btm = BarcodeToModel(template=BarcodeTemplate(
+            name="benchmark", template="^XA^FO50,50^BQN,2,4^FDMA,{}^FS"
+            "^FO200,50^A0N,30^FD{}^FS^FO200,90^A0N,20^FD{}^FS^XZ"),
+            barcode_fields="barcode uid sample")
+        sags = list(SAG.objects.filter(root_sample=self.sample)[:NR_LABELS])
+
+        def case():
+            t = barcode_label_template(btm)
+            for sag in sags:
+                t.render(Context({"o": sag}))
+        return case
+
+    def cases(self):
+        """Returns the ordered (name, function) benchmark cases"""
+        sample = self.sample
+        library = DNALibrary.objects.filter(root_sample=sample).order_by('id').first()
+        return [
+            ('browse_sample_list', self.get(reverse("lims.views.browse.sample"))),
+            ('browse_sample', self.get(reverse("lims.views.browse.sample",
+                                               args=[sample.pk]))),
+            ('browse_dnalibrary', self.get(reverse("lims.views.browse.dnalibrary",
+                                                   args=[library.pk]))),
+            ('sample_tree', self.get(reverse("sample_tree", args=[sample.pk]))),
+            ('sample_tree_children', self.get(reverse("tree_children",
+                                                      args=["sample", sample.pk]))),
+            ('barcode_search', self.get(reverse("barcode_search",
+                                                args=[sample.barcode]))),
+            ('global_search', self.get(reverse("global_search"), q=sample.uid)),
+            ('admin_sample_changelist', self.get(
+                reverse("admin:lims_sample_changelist"))),
+            ('admin_sample_search', self.get(
+                reverse("admin:lims_sample_changelist"), q=sample.uid[1:])),
+            ('admin_dnalibrary_changelist', self.get(
+                reverse("admin:lims_dnalibrary_changelist"))),
+            ('admin_readfile_changelist', self.get(
+                reverse("admin:lims_readfile_changelist"))),
+            ('admin_container_changelist', self.get(
+                reverse("admin:lims_container_changelist"))),
+            ('admin_container_apparatus_filter', self.get(
+                reverse("admin:lims_container_changelist"),
+                apparatus=self.apparatus.pk if self.apparatus else 0)),
+            ('admin_container_is_empty_filter', self.get(
+                reverse("admin:lims_container_changelist"), is_empty="False")),
+            ('import_new_samples', self.import_samples(True)),
+            ('import_unchanged_samples', self.import_samples(False)),
+            ('render_labels', self.render_labels()),
+        ]
+
+    def measure(self, function):
+        times = []
+        for i in range(self.repeat):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.time()
+                function()
+                times.append((time.time() - start) * 1000)
+        times.sort()
+        return {'min_ms': times[0], 'median_ms': times[len(times) // 2],
+                'max_ms': times[-1], 'queries': len(queries)}
+
+    def run(self, names=None, stdout=None):
+        """Runs the cases with the given names (all by default) and returns
+        the results"""
+        results = {}
+        with transaction.atomic():
+            self.setup()
+            for name, function in self.cases():
+                if names and name not in names:
+                    continue
+                results[name] = self.measure(function)
+                if stdout is not None:
+                    stdout.write(format_result(name, results[name]))
+            transaction.set_rollback(True)
+        return results
+
+
+def git_commit():
+    """Returns the hash of the checked out commit, None outside git"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(__file__),
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(repeat=3, names=None, stdout=None):
+    """Returns a dictionary with the environment, the number of rows of the
+    lineage tables and the results of the benchmark cases"""
+    counts = dict((m.__name__, m.objects.count()) for m in
+                  [Sample, Container] + LINEAGE_MODELS)
+    return {
+        'commit': git_commit(),
+        'date': datetime.datetime.now().isoformat(),
+        'database': connection.vendor,
+        'repeat': repeat,
+        'counts': counts,
+        'cases': Benchmark(repeat).run(names, stdout),
+    }
+
+
+def format_result(name, result, previous=None):
+    line = "%-36s %10.1f ms %6d queries" % (name, result['median_ms'],
+                                            result['queries'])
+    if previous is not None:
+        line += "  (was %.1f ms, %d queries)" % (previous['median_ms'],
+                                                 previous['queries'])
+    return line
+
+
+def save_results(results, directory):
+    """Writes the results to a new JSON file in directory, named after the
+    date and commit, and returns its path"""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, "benchmark-%s-%s.json" % (
+        results['date'][:19].replace(":", ""), (results['commit'] or "nogit")[:7]))
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    return path
+
+
+def compare_results(results, previous):
+    """Returns a line per case comparing the results to previous results"""
+    return [format_result(name, result, previous['cases'].get(name))
+            for (name, result) in sorted(results['cases'].items())]
@@ -0,0 +1,48 @@
+"""Set-based helpers for writing many rows at once. Django 1.6 only supports
+bulk_create, these fill the gap for updates."""
+from __future__ import print_function
+
+from django.db import connections, router, transaction
+
+
+def bulk_update(model, objs, fields, batch_size=500):
+    """Writes the given fields of objs (which must have a pk) to the database
+    with one UPDATE ... SET f = CASE pk WHEN .. THEN .. END statement per
+    batch_size objects. save() is not called and no signals are sent. Returns
+    the number of updated rows."""
+    objs = list(objs)
+    if not objs:
+        return 0
+    db = router.db_for_write(model)
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    opts = model._meta
+    pk_column = qn(opts.pk.column)
+    model_fields = [opts.get_field(f) for f in fields]
+
+    nr_updated = 0
+    with transaction.atomic(using=db, savepoint=False):
+        cursor = connection.cursor()
+        for i in range(0, len(objs), batch_size):
+            batch = objs[i:i + batch_size]
+            assignments = []
+            params = []
+            for field in model_fields:
+                whens = []
+                for obj in batch:
+                    whens.append("WHEN %s THEN %s")
+                    params += [obj.pk, field.get_db_prep_save(
+                        getattr(obj, field.attname), connection=connection)]
+                case = "CASE %s %s END" % (pk_column, " ".join(whens))
+                if connection.vendor == 'postgresql':
+                    # PostgreSQL can't infer the type of a CASE of NULLs. Drop
+                    # the CHECK constraint of positive integer fields.
+                    db_type = field.db_type(connection).split(" CHECK")[0]
+                    case = "CAST(%s AS %s)" % (case, db_type)
+                assignments.append("%s = %s" % (qn(field.column), case))
+            params += [obj.pk for obj in batch]
+            cursor.execute("UPDATE %s SET %s WHERE %s IN (%s)" % (
+                qn(opts.db_table), ", ".join(assignments), pk_column,
+                ", ".join(["%s"] * len(batch))), params)
+            nr_updated += cursor.rowcount
+    return nr_updated
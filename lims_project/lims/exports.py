@@ -0,0 +1,236 @@
+"""Denormalized exports of the sample lineage for downstream analysis. Every
+exported row describes a single ReadFile together with the DNALibrary it was
+sequenced from, the DNA source of that library and the ExtractedDNA,
+ExtractedCell, Sample and Collaborator it originates from."""
+from __future__ import print_function
+import os
+import json
+import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+
+from lims.lineage import resolve_ancestry
+from lims.models import ReadFile
+from lims.storage import resolve_storage_paths
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    LIMS_PYARROW = True
+except ImportError:
+    LIMS_PYARROW = False
+
+
+# Ordered (column name, arrow type name) pairs of the lineage table
+LINEAGE_COLUMNS = [
+    ('read_file_id', 'int64'),
+    ('read_file_folder', 'string'),
+    ('read_file_filename', 'string'),
+    ('read_file_pair', 'int64'),
+    ('read_file_lane', 'int64'),
+    ('read_file_read_count', 'int64'),
+    ('read_file_date', 'timestamp'),
+    ('sequencing_run_uid', 'string'),
+    ('sequencing_center', 'string'),
+    ('sequencing_machine', 'string'),
+    ('dna_library_id', 'int64'),
+    ('dna_library_uid', 'string'),
+    ('sample_name_on_platform', 'string'),
+    ('i7', 'string'),
+    ('i5', 'string'),
+    ('dna_library_concentration', 'float64'),
+    ('dna_library_storage_path', 'string'),
+    ('dna_source_type', 'string'),
+    ('dna_source_uid', 'string'),
+    ('sag_plate_uid', 'string'),
+    ('extracted_dna_uid', 'string'),
+    ('extracted_cell_uid', 'string'),
+    ('sample_id', 'int64'),
+    ('sample_uid', 'string'),
+    ('sample_type', 'string'),
+    ('sample_location', 'string'),
+    ('biosafety_level', 'int64'),
+    ('collaborator_name', 'string'),
+    ('collaborator_institution', 'string'),
+]
+
+WATERMARK_FILENAME = "_lineage_watermark.json"
+
+
+def lineage_queryset(queryset=None):
+    """Returns the given ReadFile queryset (all ReadFiles by default) with
+    their sequencing runs, ordered by date and id."""
+    if queryset is None:
+        queryset = ReadFile.objects.all()
+    return queryset.select_related('sequencing_run').order_by('date', 'id')
+
+
+def _uid(obj):
+    return obj.uid if obj is not None else None
+
+
+def lineage_row(read_file, ancestry):
+    """Returns a dictionary with all LINEAGE_COLUMNS for the given ReadFile
+    and its Ancestry from lims.lineage.resolve_ancestry. The storage path of
+    the DNALibrary should be resolved to avoid a query per row."""
+    library = ancestry.dna_library
+    sample = ancestry.sample
+    collaborator = ancestry.collaborator
+    run = read_file.sequencing_run
+
+    return {
+        'read_file_id': read_file.id,
+        'read_file_folder': read_file.folder,
+        'read_file_filename': read_file.filename,
+        'read_file_pair': read_file.pair,
+        'read_file_lane': read_file.lane,
+        'read_file_read_count': read_file.read_count,
+        'read_file_date': read_file.date,
+        'sequencing_run_uid': run.uid,
+        'sequencing_center': run.sequencing_center,
+        'sequencing_machine': run.machine,
+        'dna_library_id': library.id,
+        'dna_library_uid': library.uid,
+        'sample_name_on_platform': library.sample_name_on_platform,
+        'i7': library.i7,
+        'i5': library.i5,
+        'dna_library_concentration': library.concentration,
+        'dna_library_storage_path': library.storage_path,
+        'dna_source_type': library.dna_type,
+        'dna_source_uid': ancestry.dna_source.uid,
+        'sag_plate_uid': _uid(ancestry.sag_plate),
+        'extracted_dna_uid': _uid(ancestry.extracted_dna),
+        'extracted_cell_uid': _uid(ancestry.extracted_cell),
+        'sample_id': sample.id,
+        'sample_uid': sample.uid,
+        'sample_type': unicode(sample.sample_type),
+        'sample_location': unicode(sample.sample_location),
+        'biosafety_level': ancestry.biosafety_level,
+        'collaborator_name': unicode(collaborator),
+        'collaborator_institution': collaborator.institution,
+    }
+
+
+def iter_lineage_batches(queryset=None, batch_size=10000):
+    """Yields lists of at most batch_size lineage rows. Batches are fetched
+    with keyset pagination on (date, id) so memory use does not grow with the
+    size of the export."""
+    queryset = lineage_queryset(queryset)
+    last = None
+    while True:
+        batch_qs = queryset
+        if last is not None:
+            batch_qs = batch_qs.filter(Q(date__gt=last.date) |
+                                       Q(date=last.date, id__gt=last.id))
+        read_files = list(batch_qs[:batch_size])
+        if not read_files:
+            return
+        ancestry = resolve_ancestry(read_files)
+        # Read files of the same library share the DNALibrary object
+        resolve_storage_paths(set(a.dna_library for a in ancestry.values()))
+        yield [lineage_row(rf, ancestry[rf.pk]) for rf in read_files]
+        if len(read_files) < batch_size:
+            return
+        last = read_files[-1]
+
+
+def _arrow_type(type_name):
+    if type_name == 'timestamp':
+        return pyarrow.timestamp('us')
+    return getattr(pyarrow, type_name)()
+
+
+def lineage_schema():
+    """Returns the pyarrow schema of the lineage table"""
+    return pyarrow.schema([pyarrow.field(name, _arrow_type(type_name))
+                           for (name, type_name) in LINEAGE_COLUMNS])
+
+
+def _to_arrow_value(value, type_name):
+    if value is None:
+        return None
+    if type_name == 'timestamp':
+        # Parquet timestamps are stored as naive UTC
+        if timezone.is_aware(value):
+            value = timezone.make_naive(value, timezone.utc)
+        return value
+    if type_name == 'float64':
+        return float(value)
+    return value
+
+
+def lineage_record_batch(rows):
+    """Converts a list of lineage rows to a columnar pyarrow RecordBatch"""
+    arrays = [pyarrow.array([_to_arrow_value(r[name], type_name) for r in rows],
+                            type=_arrow_type(type_name))
+              for (name, type_name) in LINEAGE_COLUMNS]
+    return pyarrow.RecordBatch.from_arrays(arrays,
+                                           [name for (name, t) in LINEAGE_COLUMNS])
+
+
+def write_lineage_parquet(where, queryset=None, batch_size=10000):
+    """Writes the lineage table of the given ReadFiles to a Parquet file, one
+    row group per batch. where can be a path or a file-like object. Returns
+    the last exported ReadFile row or None if nothing was exported and the
+    number of rows written."""
+    if not LIMS_PYARROW:
+        raise(Exception("pyarrow is required to export Parquet files"))
+    writer = None
+    last_row = None
+    nr_rows = 0
+    try:
+        for rows in iter_lineage_batches(queryset, batch_size):
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(where, lineage_schema())
+            writer.write_table(pyarrow.Table.from_batches(
+                [lineage_record_batch(rows)]))
+            last_row = rows[-1]
+            nr_rows += len(rows)
+    finally:
+        if writer is not None:
+            writer.close()
+    return last_row, nr_rows
+
+
+def read_watermark(directory):
+    """Returns the (date, id) of the last ReadFile exported to directory or
+    None if nothing has been exported yet."""
+    path = os.path.join(directory, WATERMARK_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        wm = json.load(f)
+    date = datetime.datetime.strptime(wm['date'], "%Y-%m-%dT%H:%M:%S.%f")
+    return timezone.make_aware(date, timezone.utc), wm['id']
+
+
+def write_watermark(directory, date, read_file_id):
+    if timezone.is_aware(date):
+        date = timezone.make_naive(date, timezone.utc)
+    with open(os.path.join(directory, WATERMARK_FILENAME), 'w') as f:
+        json.dump({'date': date.strftime("%Y-%m-%dT%H:%M:%S.%f"),
+                   'id': read_file_id}, f)
+
+
+def export_lineage_incremental(directory, batch_size=10000):
+    """Appends all ReadFiles newer than the watermark stored in directory as a
+    new Parquet part file to directory, so the directory can be read as a
+    single dataset. Returns the path of the written part and the number of
+    rows, the path is None if there was nothing new to export."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    queryset = ReadFile.objects.all()
+    watermark = read_watermark(directory)
+    if watermark is not None:
+        date, read_file_id = watermark
+        queryset = queryset.filter(Q(date__gt=date) |
+                                   Q(date=date, id__gt=read_file_id))
+
+    path = os.path.join(directory, "lineage-%s.parquet" %
+                        timezone.now().strftime("%Y%m%dT%H%M%S%f"))
+    last_row, nr_rows = write_lineage_parquet(path, queryset, batch_size)
+    if last_row is None:
+        return None, 0
+    write_watermark(directory, last_row['read_file_date'], last_row['read_file_id'])
+    return path, nr_rows
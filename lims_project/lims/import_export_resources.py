@@ -1,11 +1,22 @@
 from __future__ import print_function
 import sys
+import traceback
+from copy import deepcopy
 
 import json
-from import_export import resources, fields
+from django.core.exceptions import ValidationError
+from django.db import models, transaction, DatabaseError
+from django.utils.encoding import force_text
+from import_export import resources, fields, widgets
+from import_export.results import Error, Result, RowResult
 from import_export.widgets import Widget
 
-from lims.models import Sample, Container
+from lims import refcache
+from lims.bulk import bulk_update
+from lims.models import Sample, Container, parse_barcode
+from lims.storage import IN_CHUNK_SIZE
+from lims.validation import SampleValidator, ContainerValidator, RowError, \
+    to_python
 
 
 class LIMSForeignKeyWidget(Widget):
@@ -22,7 +33,9 @@ class LIMSForeignKeyWidget(Widget):
 
     def clean(self, value):
         pk = super(LIMSForeignKeyWidget, self).clean(value)
-        return self.model.objects.get(pk=pk) if pk else None
+        if not pk:
+            return None
+        return refcache.cache.get(self.model, pk) or self.model.objects.get(pk=pk)
 
     def render(self, value):
         if value is None:
@@ -30,12 +43,238 @@ class LIMSForeignKeyWidget(Widget):
         return str(value) + " (HAHAHA id=%d)" % value.pk
 
 
-class ContainerResource(resources.ModelResource):
+class UpsertModelResource(resources.ModelResource):
+    """ModelResource that imports a dataset as an upsert keyed on the single
+    natural key in Meta.import_id_fields. All existing objects are fetched
+    with one query and compared with the incoming rows in memory. New rows are
+    inserted with bulk_create, changed rows are written with batched UPDATEs
+    of the changed columns only and unchanged rows are skipped. Foreign keys
+    are imported as ids, so the related objects are never fetched, only their
+    ids are checked with one query per related model. Since save() is not
+    called, the model's rules are checked over the whole dataset by the
+    lims.validation.BatchValidator in validator_class before anything is
+    written."""
+    upsert = True
+    validator_class = None
+
+    def get_model_field(self, field):
+        """Returns the model field the resource field is imported into, None
+        for fields that follow relationships or are not model fields."""
+        if field.attribute is None or '__' in field.attribute:
+            return None
+        try:
+            return self._meta.model._meta.get_field(field.attribute)
+        except models.FieldDoesNotExist:
+            return None
+
+    def import_field(self, field, obj, data):
+        model_field = self.get_model_field(field)
+        if isinstance(model_field, models.ForeignKey):
+            if not field.readonly and field.column_name in data:
+                setattr(obj, model_field.attname,
+                        to_python(model_field, data[field.column_name]))
+        else:
+            super(UpsertModelResource, self).import_field(field, obj, data)
+
+    def import_obj(self, obj, data, dry_run):
+        """Imports all fields except for the primary key of existing
+        objects"""
+        for field in self.get_fields():
+            model_field = self.get_model_field(field)
+            if isinstance(field.widget, widgets.ManyToManyWidget) or \
+                    (obj.pk is not None and model_field is not None and
+                     model_field.primary_key):
+                continue
+            self.import_field(field, obj, data)
+
+    def export_field(self, field, obj):
+        """Exports foreign keys as their id without fetching the related
+        object"""
+        model_field = self.get_model_field(field)
+        if isinstance(model_field, models.ForeignKey):
+            value = getattr(obj, model_field.attname)
+            return "" if value is None else force_text(value)
+        return super(UpsertModelResource, self).export_field(field, obj)
+
+    def get_upsert_key_field(self):
+        (key, ) = self.get_import_id_fields()
+        return self.fields[key]
+
+    def get_compared_fields(self, dataset):
+        """Returns the model fields set by the columns in dataset"""
+        headers = set(dataset.headers)
+        compared = []
+        for field in self.get_fields():
+            model_field = self.get_model_field(field)
+            if field.column_name in headers and not field.readonly and \
+                    model_field is not None and not model_field.primary_key:
+                compared.append(model_field)
+        return compared
+
+    def validate_dataset(self, dataset, key_field, existing):
+        """Returns the RowErrors of validator_class for dataset, columns
+        missing from dataset are taken from the existing objects by key"""
+        if self.validator_class is None:
+            return []
+        return self.validator_class(self.get_model_field(key_field).name,
+                                    existing).validate(dataset)
+
+    def check_foreign_keys(self, dataset):
+        """Returns RowErrors for the foreign key ids in dataset that don't
+        exist, with one query per related model (and IN_CHUNK_SIZE ids)"""
+        errors = []
+        for field in self.get_fields():
+            model_field = self.get_model_field(field)
+            if not isinstance(model_field, models.ForeignKey) or field.readonly \
+                    or field.column_name not in dataset.headers:
+                continue
+            values = [to_python(model_field, v) for v in dataset[field.column_name]]
+            ids = sorted(set(v for v in values if v is not None))
+            related = model_field.rel.to
+            to_field = model_field.rel.get_related_field().name
+            known = set()
+            for i in range(0, len(ids), IN_CHUNK_SIZE):
+                known.update(related._default_manager.filter(
+                    **{to_field + '__in': ids[i:i + IN_CHUNK_SIZE]})
+                    .values_list(to_field, flat=True))
+            errors += [RowError(i, (field.column_name, ), "No %s with id %s" % (
+                related._meta.verbose_name, v)) for (i, v) in enumerate(values)
+                if v is not None and v not in known]
+        return errors
+
+    def fetch_existing(self, key_field, keys):
+        """Returns a dictionary of existing objects by key with one query per
+        IN_CHUNK_SIZE keys"""
+        attname = self.get_model_field(key_field).attname
+        keys = sorted(keys)
+        existing = {}
+        for i in range(0, len(keys), IN_CHUNK_SIZE):
+            existing.update((getattr(o, attname), o) for o in
+                            self._meta.model.objects.filter(
+                                **{attname + '__in': keys[i:i + IN_CHUNK_SIZE]}))
+        return existing
+
+    def import_data(self, dataset, dry_run=False, raise_errors=False,
+                    use_transactions=None):
+        if not self.upsert:
+            return super(UpsertModelResource, self).import_data(
+                dataset, dry_run, raise_errors, use_transactions)
+
+        result = Result()
+        try:
+            self.before_import(dataset, dry_run)
+            key_field = self.get_upsert_key_field()
+            rows = list(dataset.dict)
+            keys = [key_field.clean(row) if key_field.column_name in row else None
+                    for row in rows]
+            existing = self.fetch_existing(key_field,
+                                           set(k for k in keys if k is not None))
+            compared = self.get_compared_fields(dataset)
+            validation_errors = sorted(self.validate_dataset(dataset, key_field, existing) +
+                                       self.check_foreign_keys(dataset))
+        except Exception as e:
+            result.base_errors.append(Error(repr(e), traceback.format_exc()))
+            if raise_errors:
+                raise
+            return result
+
+        if validation_errors:
+            # Report the errors on their line, nothing is imported
+            result.rows = [RowResult() for row in rows]
+            for e in validation_errors:
+                result.rows[e.row].errors.append(
+                    Error("%s: %s" % (", ".join(e.columns), e.message)))
+            if raise_errors:
+                raise(ValidationError([r.errors[0].error for r in result.rows
+                                       if r.errors]))
+            return result
+
+        to_create = []
+        to_update = {}
+        seen = set()
+        for row, key in zip(rows, keys):
+            row_result = RowResult()
+            try:
+                if key is not None and key in seen:
+                    raise(Exception("Duplicate %s %s in import" %
+                                    (key_field.column_name, key)))
+                seen.add(key)
+                original = existing.get(key) if key is not None else None
+                instance = self.init_instance(row) if original is None \
+                    else deepcopy(original)
+                self.import_obj(instance, row, dry_run)
+
+                if original is None:
+                    row_result.import_type = RowResult.IMPORT_TYPE_NEW
+                    to_create.append(instance)
+                else:
+                    changed = tuple(f.name for f in compared if
+                                    f.get_prep_value(getattr(original, f.attname)) !=
+                                    f.get_prep_value(getattr(instance, f.attname)))
+                    if changed:
+                        row_result.import_type = RowResult.IMPORT_TYPE_UPDATE
+                        to_update.setdefault(changed, []).append(instance)
+                    else:
+                        row_result.import_type = RowResult.IMPORT_TYPE_SKIP
+                row_result.diff = self.get_diff(original, instance, dry_run)
+            except Exception as e:
+                row_result.errors.append(Error(repr(e), traceback.format_exc()))
+                if raise_errors:
+                    raise
+            if row_result.import_type != RowResult.IMPORT_TYPE_SKIP or \
+                    self._meta.report_skipped:
+                result.rows.append(row_result)
+
+        if not dry_run and not result.has_errors():
+            try:
+                with transaction.atomic():
+                    self._meta.model.objects.bulk_create(to_create)
+                    for changed, instances in to_update.items():
+                        bulk_update(self._meta.model, instances, changed)
+            except DatabaseError as e:
+                result.base_errors.append(Error(repr(e), traceback.format_exc()))
+                if raise_errors:
+                    raise
+        return result
+
+
+class ContainerResource(UpsertModelResource):
+    """Containers are matched on id, which can also be given as a barcode
+    column (CO:000012)."""
+    validator_class = ContainerValidator
+
+    def before_import(self, dataset, dry_run):
+        self.barcode_errors = []
+        if 'barcode' in dataset.headers:
+            row_ids = dataset['id'] if 'id' in dataset.headers else \
+                [None] * dataset.height
+            ids = []
+            for i, (barcode, row_id) in enumerate(zip(dataset['barcode'], row_ids)):
+                if not barcode:
+                    ids.append(row_id)
+                    continue
+                parsed = parse_barcode(barcode)
+                if parsed is None or parsed[0] is not Container:
+                    self.barcode_errors.append(RowError(
+                        i, ('barcode', ), "%s is not a container barcode" % barcode))
+                    ids.append(None)
+                else:
+                    ids.append(parsed[1]['pk'])
+            if 'id' in dataset.headers:
+                del dataset['id']
+            del dataset['barcode']
+            dataset.append_col(ids, header='id')
+
+    def validate_dataset(self, dataset, key_field, existing):
+        return getattr(self, 'barcode_errors', []) + super(
+            ContainerResource, self).validate_dataset(dataset, key_field, existing)
+
     class Meta:
         model = Container
 
 
-class SampleResource(resources.ModelResource):
+class SampleResource(UpsertModelResource):
+    validator_class = SampleValidator
     #collaborator = fields.Field(attribute='collaborator', column_name='collaborator', widget=LIMSForeignKeyWidget(Collaborator))
 
     def before_import(self, dataset, dry_run):
@@ -55,3 +294,4 @@ class SampleResource(resources.ModelResource):
 
     class Meta:
         model = Sample
+        import_id_fields = ('uid', )
@@ -0,0 +1,96 @@
+"""Reports the lims tables that PostgreSQL reads with many sequential scans,
+and the statements that spend most time on them, as candidates for new
+indexes. Uses the statistics view pg_stat_user_tables and, when the
+pg_stat_statements extension is installed, pg_stat_statements. Statistics
+are cumulative since they were last reset with pg_stat_reset() and
+pg_stat_statements_reset()."""
+from __future__ import print_function
+from collections import namedtuple
+
+TableStats = namedtuple('TableStats', ['table', 'seq_scan', 'seq_tup_read',
+                                       'idx_scan', 'live_rows'])
+StatementStats = namedtuple('StatementStats', ['query', 'calls', 'total_ms',
+                                               'mean_ms', 'rows'])
+
+TABLE_PREFIX = "lims_"
+# Smaller tables are cheaper to scan than to look up through an index
+MIN_ROWS = 1000
+NR_STATEMENTS = 10
+
+
+def table_stats(cursor, prefix=TABLE_PREFIX):
+    """Returns the TableStats of the tables whose name starts with prefix"""
+    cursor.execute("SELECT relname, seq_scan, seq_tup_read, COALESCE(idx_scan, 0), "
+                   "n_live_tup FROM pg_stat_user_tables WHERE relname LIKE %s",
+                   [prefix.replace("_", "\\_") + "%"])
+    return [TableStats(*row) for row in cursor.fetchall()]
+
+
+def seq_scan_ratio(stats):
+    scans = stats.seq_scan + stats.idx_scan
+    return float(stats.seq_scan) / scans if scans else 0.0
+
+
+def hotspots(tables, min_rows=MIN_ROWS):
+    """Returns the tables of at least min_rows rows that are scanned
+    sequentially more often than through an index, the most rows read
+    sequentially first"""
+    return sorted([t for t in tables if t.live_rows >= min_rows and
+                   t.seq_scan > t.idx_scan],
+                  key=lambda t: -t.seq_tup_read)
+
+
+def has_pg_stat_statements(cursor):
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+    return cursor.fetchone() is not None
+
+
+def statement_stats(cursor, tables, limit=NR_STATEMENTS):
+    """Returns the StatementStats of the limit statements that took most
+    time in total and refer to any of the given tables"""
+    if not tables:
+        return []
+    cursor.execute("SHOW server_version_num")
+    # Renamed in PostgreSQL 13
+    time_column = "total_exec_time" if int(cursor.fetchone()[0]) >= 130000 \
+        else "total_time"
+    cursor.execute("SELECT query, calls, %(time)s, %(time)s / calls, rows "
+                   "FROM pg_stat_statements WHERE calls > 0 AND query LIKE ANY(%%s) "
+                   "ORDER BY %(time)s DESC LIMIT %%s" % {'time': time_column},
+                   [["%%%s%%" % t for t in tables], limit])
+    return [StatementStats(*row) for row in cursor.fetchall()]
+
+
+def format_report(tables, statements=None):
+    """Returns the lines of the report of the given hotspot TableStats and
+    StatementStats, statements is None if pg_stat_statements is missing"""
+    lines = []
+    if not tables:
+        lines.append("No sequential scan hotspots in the lims tables.")
+    else:
+        lines.append("%-32s %12s %16s %12s %10s %7s" % (
+            "table", "seq scans", "rows read", "index scans", "rows", "seq %"))
+        lines += ["%-32s %12d %16d %12d %10d %6.1f%%" % (
+            t.table, t.seq_scan, t.seq_tup_read, t.idx_scan, t.live_rows,
+            100 * seq_scan_ratio(t)) for t in tables]
+    if statements is None:
+        lines += ["", "Install the pg_stat_statements extension to see the "
+                  "statements scanning these tables."]
+    elif statements:
+        lines += ["", "Statements on these tables taking most time:"]
+        for s in statements:
+            lines.append("%10.1f ms total %8d calls %8.2f ms mean %10d rows" % (
+                s.total_ms, s.calls, s.mean_ms, s.rows))
+            lines.append("    " + " ".join(s.query.split()))
+    return lines
+
+
+def advise(connection, min_rows=MIN_ROWS, nr_statements=NR_STATEMENTS):
+    """Returns the lines of the report for a PostgreSQL connection"""
+    cursor = connection.cursor()
+    tables = hotspots(table_stats(cursor), min_rows)
+    statements = None
+    if has_pg_stat_statements(cursor):
+        statements = statement_stats(cursor, [t.table for t in tables],
+                                     nr_statements)
+    return format_report(tables, statements)
@@ -0,0 +1,256 @@
+"""Generator of a synthetic dataset of a large lab, used for benchmarking.
+Every Sample is stored in a well of a 96 well box in a rack of a freezer and
+gets an ExtractedCell, an ExtractedDNA, a Metagenome and a DNALibrary. Every
+sag_every-th Sample also gets a SAGPlate with sags_per_plate SAGs, each with
+its own DNALibrary. The libraries are sequenced in runs of up to
+LIBRARIES_PER_RUN libraries with a pair of ReadFiles each.
+
+Rows are written with bulk_create in chunks of samples. bulk_create doesn't
+return primary keys, so the keys of new rows are read back in id order, which
+assumes ids are assigned in insertion order (true for SQLite and PostgreSQL
+sequences) and that nothing else writes to the database meanwhile."""
+from __future__ import print_function
+import random
+import string
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Max
+
+from lims.bulk import bulk_update
+from lims.models import Apparatus, ApparatusSubdivision, Collaborator, \
+    SampleType, SampleLocation, Protocol, QPCR, RTMDA, ContainerType, \
+    Container, Sample, ExtractedCell, ExtractedDNA, Metagenome, SAGPlate, SAG, \
+    DNALibrary, SequencingRun, ReadFile
+
+RACKS_PER_FREEZER = 10
+BOXES_PER_RACK = 20
+BOX_ROWS, BOX_COLUMNS = 8, 12
+PLATE_ROWS, PLATE_COLUMNS = 16, 24
+LIBRARIES_PER_RUN = 384
+
+_UID_CHARACTERS = string.digits + string.ascii_uppercase
+
+
+def sample_uid(i):
+    """Returns the i-th five character sample UID"""
+    uid = ""
+    for _ in range(5):
+        i, r = divmod(i, len(_UID_CHARACTERS))
+        uid = _UID_CHARACTERS[r] + uid
+    return uid
+
+
+def plate_well(i, columns=PLATE_COLUMNS):
+    """Returns the name of the i-th well of a plate, e.g. A1 or P24"""
+    return "%s%d" % (chr(ord('A') + i // columns), i % columns + 1)
+
+
+def _max_id(model):
+    return model.objects.aggregate(Max('id'))['id__max'] or 0
+
+
+def bulk_insert(model, objs):
+    """bulk_create objs and set their pks"""
+    max_id = _max_id(model)
+    model.objects.bulk_create(objs)
+    pks = list(model.objects.filter(id__gt=max_id).order_by('id')
+               .values_list('id', flat=True))
+    if len(pks) != len(objs):
+        raise(Exception("Could not determine the ids of the new %s objects, "
+                        "was the database written to concurrently?" %
+                        model.__name__))
+    for obj, pk in zip(objs, pks):
+        obj.pk = pk
+    return objs
+
+
+class LabDataGenerator(object):
+    """Generates nr_samples Samples with their storage and lineage, see the
+    module documentation. UIDs are generated from start on, so later runs
+    with a different start add to an existing dataset."""
+    def __init__(self, nr_samples, start=0, sag_every=10, sags_per_plate=384,
+                 chunk_size=960, seed=0):
+        self.nr_samples = nr_samples
+        self.start = start
+        self.sag_every = sag_every
+        self.sags_per_plate = sags_per_plate
+        self.chunk_size = chunk_size
+        self.random = random.Random(seed)
+        self.counts = {}
+
+    def count(self, model, n):
+        self.counts[model.__name__] = self.counts.get(model.__name__, 0) + n
+
+    def index_sequence(self):
+        return "".join(self.random.choice("ACGT") for _ in range(8))
+
+    def create_reference_data(self):
+        """Creates the objects shared by all samples"""
+        self.collaborators = [Collaborator.objects.get_or_create(
+            first_name="Generated", last_name="Collaborator %d" % i,
+            defaults={'institution': "Lab data generator", 'address': "",
+                      'email': ""})[0] for i in range(5)]
+        self.sample_types = [SampleType.objects.get_or_create(name=n)[0]
+                             for n in ["Seawater", "Soil", "Sediment", "Biofilm"]]
+        self.locations = [SampleLocation.objects.get_or_create(name=n)[0]
+                          for n in ["Baltic Sea", "North Sea", "Lake Erken"]]
+        self.protocol = Protocol.objects.get_or_create(
+            name="Generated", revision="1", defaults={'link': ""})[0]
+        self.qpcr = QPCR.objects.get_or_create(report="generated")[0]
+        self.rt_mda = RTMDA.objects.get_or_create(report="generated")[0]
+        self.box_type = ContainerType.objects.get_or_create(
+            name="96 well box", defaults={'divisible': True})[0]
+        self.well_type = ContainerType.objects.get_or_create(
+            name="Well", defaults={'divisible': False})[0]
+        self.sample_content_type = ContentType.objects.get_for_model(Sample)
+
+        nr_boxes = (self.start + self.nr_samples - 1) // (BOX_ROWS * BOX_COLUMNS) + 1
+        nr_racks = (nr_boxes - 1) // BOXES_PER_RACK + 1
+        nr_freezers = (nr_racks - 1) // RACKS_PER_FREEZER + 1
+        freezers = [Apparatus.objects.get_or_create(
+            name="Generated freezer %d" % i,
+            defaults={'location': "Lab", 'temperature': -80})[0]
+            for i in range(nr_freezers)]
+        self.racks = [ApparatusSubdivision.objects.get_or_create(
+            name="Rack %d" % (i % RACKS_PER_FREEZER + 1),
+            apparatus=freezers[i // RACKS_PER_FREEZER])[0]
+            for i in range(nr_racks)]
+
+    def generate(self):
+        """Generates all data, returns a dictionary with the number of created
+        objects per model"""
+        self.create_reference_data()
+        for first in range(self.start, self.start + self.nr_samples,
+                           self.chunk_size):
+            last = min(first + self.chunk_size, self.start + self.nr_samples)
+            with transaction.atomic():
+                self.generate_chunk(range(first, last))
+        return self.counts
+
+    def generate_chunk(self, indexes):
+        uids = [sample_uid(i) for i in indexes]
+        if Sample.objects.filter(uid__in=uids[:1] + uids[-1:]).exists():
+            raise(Exception("Samples %s to %s already exist, use another start"
+                            % (uids[0], uids[-1])))
+        r = self.random
+        samples = bulk_insert(Sample, [Sample(
+            uid=uid, collaborator=r.choice(self.collaborators),
+            sample_type=r.choice(self.sample_types),
+            sample_location=r.choice(self.locations),
+            temperature=r.randint(-2, 30), ph=r.randint(60, 90) / 10.0,
+            depth=r.randint(0, 200), biosafety_level=1, status='new')
+            for uid in uids])
+        self.count(Sample, len(samples))
+        self.store(indexes, samples)
+
+        cells = bulk_insert(ExtractedCell, [ExtractedCell(
+            sample=s, root_sample=s, protocol=self.protocol, index_by_group=0,
+            uid="%s_1" % s.uid) for s in samples])
+        dnas = bulk_insert(ExtractedDNA, [ExtractedDNA(
+            sample=s, root_sample=s, protocol=self.protocol, index_by_group=0,
+            uid="%s_1" % s.uid, concentration=r.randint(1, 100) / 10.0,
+            buffer="TE") for s in samples])
+        metagenomes = bulk_insert(Metagenome, [Metagenome(
+            extracted_dna=d, root_sample_id=d.root_sample_id, index_by_group=0,
+            uid="%sA_X01" % d.root_sample.uid, diversity_report="")
+            for d in dnas])
+        self.count(ExtractedCell, len(cells))
+        self.count(ExtractedDNA, len(dnas))
+        self.count(Metagenome, len(metagenomes))
+
+        plates = bulk_insert(SAGPlate, [SAGPlate(
+            extracted_cell=c, root_sample_id=c.root_sample_id, index_by_group=0,
+            uid="%sA" % c.sample.uid, report="", protocol=self.protocol,
+            apparatus_subdivision=r.choice(self.racks), rt_mda=self.rt_mda,
+            qpcr=self.qpcr) for (i, c) in zip(indexes, cells)
+            if self.sag_every and i % self.sag_every == 0])
+        sags = bulk_insert(SAG, [SAG(
+            sag_plate=p, root_sample_id=p.root_sample_id,
+            well=plate_well(w), uid="%s_%s" % (p.uid, plate_well(w)),
+            concentration=r.randint(0, 100) / 100.0)
+            for p in plates for w in range(self.sags_per_plate)])
+        self.count(SAGPlate, len(plates))
+        self.count(SAG, len(sags))
+
+        libraries = [DNALibrary(metagenome=m, uid=m.uid + "A") for m in metagenomes] + \
+            [DNALibrary(sag=s, uid=s.uid + "A") for s in sags]
+        for library, source in zip(libraries, metagenomes + sags):
+            library.root_sample_id = source.root_sample_id
+            library.sample_name_on_platform = library.uid
+            library.index_by_group = 0
+            library.protocol = self.protocol
+            library.buffer = "EB"
+            library.i7 = self.index_sequence()
+            library.i5 = self.index_sequence()
+            library.concentration = r.randint(1, 100) / 10.0
+        bulk_insert(DNALibrary, libraries)
+        self.count(DNALibrary, len(libraries))
+        self.sequence(libraries)
+
+    def store(self, indexes, samples):
+        """Puts the samples in the wells of their box, creating boxes (with
+        all wells) when needed"""
+        per_box = BOX_ROWS * BOX_COLUMNS
+        box_nrs = sorted(set(i // per_box for i in indexes))
+        existing = dict((b.notes, b) for b in Container.objects.filter(
+            type=self.box_type, notes__in=["Box %d" % b for b in box_nrs]))
+        new_boxes = [Container(type=self.box_type, notes="Box %d" % b,
+                               apparatus_subdivision=self.racks[b // BOXES_PER_RACK])
+                     for b in box_nrs if "Box %d" % b not in existing]
+        bulk_insert(Container, new_boxes)
+        self.count(Container, len(new_boxes))
+        wells = [Container(type=self.well_type, parent=box, row=w // BOX_COLUMNS + 1,
+                           column=w % BOX_COLUMNS + 1)
+                 for box in new_boxes for w in range(per_box)]
+        bulk_insert(Container, wells)
+        self.count(Container, len(wells))
+
+        boxes = dict((b.notes, b) for b in new_boxes + existing.values())
+        by_position = dict(((w.parent_id, w.row, w.column), w.pk) for w in
+                           Container.objects.filter(parent__in=boxes.values())
+                           .only('id', 'parent', 'row', 'column'))
+        filled = []
+        for i, sample in zip(indexes, samples):
+            box = boxes["Box %d" % (i // per_box)]
+            w = i % per_box
+            filled.append(Container(
+                pk=by_position[(box.pk, w // BOX_COLUMNS + 1, w % BOX_COLUMNS + 1)],
+                content_type=self.sample_content_type, object_id=sample.pk))
+        bulk_update(Container, filled, ['content_type', 'object_id'])
+
+    def sequence(self, libraries):
+        """Sequences the libraries in runs, with a pair of ReadFiles each"""
+        runs = []
+        for first in range(0, len(libraries), LIBRARIES_PER_RUN):
+            nr = _max_id(SequencingRun) + len(runs) + 1
+            runs.append((SequencingRun(
+                uid="%06d_M00123_%04d_000000000-%s" % (140101, nr % 10000,
+                                                       sample_uid(nr)),
+                sequencing_center="Generated", machine="M00123", report="",
+                folder="/seq/generated/%d" % nr, notes="",
+                protocol=self.protocol),
+                libraries[first:first + LIBRARIES_PER_RUN]))
+        bulk_insert(SequencingRun, [run for (run, libs) in runs])
+        self.count(SequencingRun, len(runs))
+
+        Through = SequencingRun.dna_library.through
+        Through.objects.bulk_create([Through(sequencingrun_id=run.pk,
+                                             dnalibrary_id=l.pk)
+                                     for (run, libs) in runs for l in libs])
+        read_files = [ReadFile(folder=run.folder, dna_library=l,
+                               root_sample_id=l.root_sample_id,
+                               sequencing_run=run, lane=1, pair=pair,
+                               read_count=self.random.randint(10000, 1000000),
+                               filename="%s_S%d_L001_R%d_001.fastq.gz" % (
+                                   l.sample_name_on_platform, s + 1, pair))
+                      for (run, libs) in runs for (s, l) in enumerate(libs)
+                      for pair in (1, 2)]
+        ReadFile.objects.bulk_create(read_files)
+        self.count(ReadFile, len(read_files))
+
+
+def generate_lab_data(nr_samples, **kwargs):
+    """Generates a synthetic dataset, see LabDataGenerator. Returns a
+    dictionary with the number of created objects per model."""
+    return LabDataGenerator(nr_samples, **kwargs).generate()
@@ -0,0 +1,111 @@
+"""Ancestry of many DNALibraries or ReadFiles at once: the DNA source, SAG
+plate, ExtractedDNA, ExtractedCell, Sample and Collaborator each of them
+originates from. resolve_ancestry walks up the lineage one level at a time
+with a query per model and level, so the number of queries does not depend
+on the number of objects, unlike following DNALibrary.sample per object."""
+from __future__ import print_function
+from collections import namedtuple
+
+from lims.models import DNALibrary, ReadFile, Amplicon, Metagenome, \
+    DNAFromPureCulture, SAG, SAGPlate, SAGPlateDilution, ExtractedDNA, \
+    ExtractedCell, Sample
+from lims.storage import IN_CHUNK_SIZE
+
+Ancestry = namedtuple('Ancestry', ['dna_library', 'dna_source', 'sag_plate',
+                                   'extracted_dna', 'extracted_cell', 'sample',
+                                   'collaborator', 'biosafety_level'])
+
+_SOURCE_MODELS = {'amplicon': Amplicon,
+                  'metagenome': Metagenome,
+                  'pure_culture': DNAFromPureCulture,
+                  'sag': SAG}
+_SAMPLE_RELATED = ('collaborator', 'sample_type', 'sample_location')
+
+
+def _in_bulk(model, ids, *related):
+    """Returns a dictionary by id of the objects of model with the given ids,
+    with one query per IN_CHUNK_SIZE ids"""
+    ids = sorted(set(i for i in ids if i is not None))
+    objects = {}
+    for i in range(0, len(ids), IN_CHUNK_SIZE):
+        objects.update(model.objects.select_related(*related)
+                       .in_bulk(ids[i:i + IN_CHUNK_SIZE]))
+    return objects
+
+
+def _link(objects, field_name, parents):
+    """Sets the parents of objects in the cache of the foreign key
+    field_name, so following it needs no query"""
+    for obj in objects:
+        field = obj._meta.get_field(field_name)
+        parent = parents.get(getattr(obj, field.attname))
+        if parent is not None:
+            setattr(obj, field.get_cache_name(), parent)
+
+
+def resolve_ancestry(objects):
+    """Returns a dictionary by pk with the Ancestry of each of the given
+    DNALibraries or ReadFiles, e.g. the libraries of a SequencingRun. The
+    foreign keys along the way are cached on the objects, so e.g.
+    library.group needs no query afterwards. Uses at most ten queries (per
+    IN_CHUNK_SIZE objects of a level)."""
+    objects = list(objects)
+    if objects and isinstance(objects[0], ReadFile):
+        libraries = _in_bulk(DNALibrary, [rf.dna_library_id for rf in objects])
+        _link(objects, 'dna_library', libraries)
+        library_of = dict((rf.pk, libraries[rf.dna_library_id]) for rf in objects)
+    else:
+        libraries = dict((library.pk, library) for library in objects)
+        library_of = libraries
+
+    sources = {}
+    for field_name, model in _SOURCE_MODELS.items():
+        with_source = [library for library in libraries.values()
+                       if getattr(library, field_name + "_id") is not None]
+        sources[model] = _in_bulk(model, [getattr(library, field_name + "_id")
+                                          for library in with_source])
+        _link(with_source, field_name, sources[model])
+
+    sags = sources[SAG].values()
+    dilutions = _in_bulk(SAGPlateDilution, [s.sag_plate_dilution_id for s in sags])
+    _link(sags, 'sag_plate_dilution', dilutions)
+    plates = _in_bulk(SAGPlate, [s.sag_plate_id for s in sags] +
+                      [d.sag_plate_id for d in dilutions.values()])
+    _link(sags, 'sag_plate', plates)
+    _link(dilutions.values(), 'sag_plate', plates)
+
+    dna_sources = [s for model in (Amplicon, Metagenome, DNAFromPureCulture)
+                   for s in sources[model].values()]
+    dnas = _in_bulk(ExtractedDNA, [s.extracted_dna_id for s in dna_sources])
+    _link(dna_sources, 'extracted_dna', dnas)
+
+    cells = _in_bulk(ExtractedCell, [p.extracted_cell_id for p in plates.values()] +
+                     [d.extracted_cell_id for d in dnas.values()])
+    _link(plates.values(), 'extracted_cell', cells)
+    _link(dnas.values(), 'extracted_cell', cells)
+
+    samples = _in_bulk(Sample, [c.sample_id for c in cells.values()] +
+                       [d.sample_id for d in dnas.values()], *_SAMPLE_RELATED)
+    _link(cells.values(), 'sample', samples)
+    _link(dnas.values(), 'sample', samples)
+
+    ancestry = {}
+    for pk, library in library_of.items():
+        source = library.group
+        sag_plate = extracted_dna = extracted_cell = None
+        if library.sag_id is not None:
+            sag_plate = source.sag_plate if source.sag_plate_id is not None \
+                else source.sag_plate_dilution.sag_plate
+            extracted_cell = sag_plate.extracted_cell
+            sample = extracted_cell.sample
+        else:
+            extracted_dna = source.extracted_dna
+            if extracted_dna.sample_id is not None:
+                sample = extracted_dna.sample
+            else:
+                extracted_cell = extracted_dna.extracted_cell
+                sample = extracted_cell.sample
+        ancestry[pk] = Ancestry(library, source, sag_plate, extracted_dna,
+                                extracted_cell, sample, sample.collaborator,
+                                sample.biosafety_level)
+    return ancestry
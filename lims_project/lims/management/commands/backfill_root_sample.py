@@ -0,0 +1,13 @@
+from __future__ import print_function
+
+from django.core.management.base import BaseCommand
+
+from lims.models import backfill_root_samples
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized root_sample of all objects derived " \
+        "from a Sample, e.g. after adding the column to an existing database."
+
+    def handle(self, *args, **options):
+        self.stdout.write("Updated %d rows" % backfill_root_samples())
@@ -0,0 +1,35 @@
+from __future__ import print_function
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from lims.benchmark import run_benchmarks, save_results, compare_results
+
+
+class Command(BaseCommand):
+    args = "[<case> ...]"
+    help = "Measure latency and query counts of the browse views, sample " \
+        "tree, searches, admin listings and filters, imports and label " \
+        "rendering on the current database (default: all cases) and store " \
+        "the results as JSON."
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat', type='int', dest='repeat', default=3,
+                    help="Number of runs per case (default: 3)"),
+        make_option('--output-dir', dest='output_dir', default="benchmarks",
+                    help="Directory to write the JSON results to (default: "
+                    "benchmarks)"),
+        make_option('--compare', dest='compare', default=None,
+                    help="JSON results of a previous run to compare with"),
+    )
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(options['repeat'], args,
+                                 None if options['compare'] else self.stdout)
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)
+            for line in compare_results(results, previous):
+                self.stdout.write(line)
+        self.stdout.write("Results written to %s" %
+                          save_results(results, options['output_dir']))
@@ -0,0 +1,30 @@
+from __future__ import print_function
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lims import exports
+
+
+class Command(BaseCommand):
+    args = "<directory>"
+    help = "Export one row per ReadFile with its complete lineage to Parquet. " \
+        "Only ReadFiles newer than the previous export to the same directory " \
+        "are exported, so the command can be run nightly."
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=10000,
+                    help="Number of ReadFiles per query and Parquet row group"),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Specify the export directory")
+        if not exports.LIMS_PYARROW:
+            raise CommandError("pyarrow could not be imported")
+
+        path, nr_rows = exports.export_lineage_incremental(args[0],
+                                                           options['batch_size'])
+        if path is None:
+            self.stdout.write("No new ReadFiles to export")
+        else:
+            self.stdout.write("Exported %d ReadFiles to %s" % (nr_rows, path))
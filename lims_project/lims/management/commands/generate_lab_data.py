@@ -0,0 +1,41 @@
+from __future__ import print_function
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lims.labdata import generate_lab_data
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic dataset of a large lab for benchmarking: " \
+        "samples stored in freezers with their extracted cells and DNA, " \
+        "metagenomes, SAG plates with SAGs, DNA libraries, sequencing runs " \
+        "and read files."
+    option_list = BaseCommand.option_list + (
+        make_option('--samples', type='int', dest='samples', default=1000,
+                    help="Number of samples (default: 1000)"),
+        make_option('--start', type='int', dest='start', default=0,
+                    help="Number of the first sample, to add to a dataset "
+                    "generated before (default: 0)"),
+        make_option('--sag-every', type='int', dest='sag_every', default=10,
+                    help="Create a SAG plate for every n-th sample, 0 for none "
+                    "(default: 10)"),
+        make_option('--sags-per-plate', type='int', dest='sags_per_plate',
+                    default=384, help="Number of SAGs per SAG plate "
+                    "(default: 384)"),
+        make_option('--seed', type='int', dest='seed', default=0,
+                    help="Seed of the random generator (default: 0)"),
+    )
+
+    def handle(self, *args, **options):
+        if options['samples'] < 1:
+            raise CommandError("--samples should be at least 1")
+        try:
+            counts = generate_lab_data(options['samples'], start=options['start'],
+                                       sag_every=options['sag_every'],
+                                       sags_per_plate=options['sags_per_plate'],
+                                       seed=options['seed'])
+        except Exception as e:
+            raise CommandError(str(e))
+        for name, count in sorted(counts.items()):
+            self.stdout.write("%-16s %d" % (name, count))
@@ -0,0 +1,28 @@
+from __future__ import print_function
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from lims.index_advisor import advise, MIN_ROWS, NR_STATEMENTS
+
+
+class Command(BaseCommand):
+    help = "Report the lims tables that PostgreSQL scans sequentially more " \
+        "often than through an index, and the statements that take most " \
+        "time on them (requires the pg_stat_statements extension)."
+    option_list = BaseCommand.option_list + (
+        make_option('--min-rows', type='int', dest='min_rows', default=MIN_ROWS,
+                    help="Ignore tables with fewer rows (default: %d)" % MIN_ROWS),
+        make_option('--statements', type='int', dest='statements',
+                    default=NR_STATEMENTS, help="Number of statements to "
+                    "report (default: %d)" % NR_STATEMENTS),
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("The index advisor needs the PostgreSQL "
+                               "statistics views, the database is %s" %
+                               connection.vendor)
+        for line in advise(connection, options['min_rows'], options['statements']):
+            self.stdout.write(line)
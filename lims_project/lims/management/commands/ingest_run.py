@@ -0,0 +1,51 @@
+from __future__ import print_function
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lims.models import SequencingRun
+from lims.readstats import ReadStatsError
+from lims.samplesheet import IndexCollisionError
+from lims.sequencing import ingest_run
+
+
+class Command(BaseCommand):
+    args = "<SequencingRun uid> <directory>"
+    help = "Register all Illumina FASTQ files in a run folder as ReadFiles of " \
+        "the given SequencingRun. Libraries are matched on " \
+        "sample_name_on_platform."
+    option_list = BaseCommand.option_list + (
+        make_option('--count-reads', action='store_true', dest='count_reads',
+                    default=False, help="Count the reads in each FASTQ file"),
+        make_option('--processes', type='int', dest='processes', default=None,
+                    help="Number of processes used to count reads (default: "
+                    "number of CPUs)"),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False, help="Only report what would be added"),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Specify a SequencingRun uid and a directory")
+        uid, directory = args
+        try:
+            run = SequencingRun.objects.get_by_natural_key(uid)
+        except SequencingRun.DoesNotExist:
+            raise CommandError("SequencingRun %s does not exist" % uid)
+
+        try:
+            read_files, unmatched, ambiguous = ingest_run(
+                run, directory, count_reads=options['count_reads'],
+                processes=options['processes'], dry_run=options['dry_run'])
+        except IndexCollisionError as e:
+            raise CommandError("Index collisions, nothing is added: %s" % e)
+        except ReadStatsError as e:
+            raise CommandError("%s, nothing is added" % e)
+        for name in unmatched:
+            self.stderr.write("No DNALibrary with sample_name_on_platform %s" % name)
+        for name in ambiguous:
+            self.stderr.write("Several DNALibraries with sample_name_on_platform "
+                              "%s, none of them in the run, skipped" % name)
+        self.stdout.write("%s %d ReadFiles for SequencingRun %s" %
+                          ("Found" if options['dry_run'] else "Added",
+                           len(read_files), run))
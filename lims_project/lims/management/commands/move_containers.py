@@ -0,0 +1,64 @@
+from __future__ import print_function
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lims import moves
+from lims.models import ApparatusSubdivision, get_containers
+
+
+class Command(BaseCommand):
+    args = "<container barcode> [...]"
+    help = "Move containers with everything in them to another apparatus " \
+        "subdivision or parent container, or move the wells of 96 well " \
+        "plates into the quadrants of a 384 well plate and back."
+    option_list = BaseCommand.option_list + (
+        make_option('--subdivision', type='int', dest='subdivision',
+                    help="Id of the apparatus subdivision to move the "
+                    "containers to"),
+        make_option('--parent', dest='parent',
+                    help="Barcode of the container to move the containers into"),
+        make_option('--consolidate', dest='consolidate',
+                    help="Barcode of the 384 well plate to move the wells of "
+                    "the given (up to four) 96 well plates into, in quadrant "
+                    "order A01, A02, B01, B02"),
+        make_option('--split', dest='split',
+                    help="Comma separated barcodes of the (up to four) 96 well "
+                    "plates to move the quadrants of the given 384 well plate "
+                    "into, in quadrant order A01, A02, B01, B02"),
+    )
+
+    def handle(self, *args, **options):
+        targets = [o for o in ('subdivision', 'parent', 'consolidate', 'split')
+                   if options[o] is not None]
+        if len(targets) != 1:
+            raise CommandError("Specify one of --subdivision, --parent, "
+                               "--consolidate and --split")
+        if not args:
+            raise CommandError("Specify the barcodes of the containers to move")
+        try:
+            containers = get_containers(args)
+            if options['subdivision'] is not None:
+                try:
+                    subdivision = ApparatusSubdivision.objects.get(
+                        pk=options['subdivision'])
+                except ApparatusSubdivision.DoesNotExist:
+                    raise(Exception("No apparatus subdivision with id %d" %
+                                    options['subdivision']))
+                moved = moves.move_to_subdivision(containers, subdivision)
+            elif options['parent'] is not None:
+                parent = get_containers([options['parent']])[0]
+                moved = moves.reparent(containers, parent)
+            elif options['consolidate'] is not None:
+                destination = get_containers([options['consolidate']])[0]
+                moved = moves.consolidate_quadrants(containers, destination)
+            else:
+                if len(containers) != 1:
+                    raise(Exception("Specify one 384 well plate to split"))
+                destinations = get_containers(options['split'].split(","))
+                moved = moves.split_quadrants(containers[0], destinations)
+        except CommandError:
+            raise
+        except Exception as e:
+            raise CommandError(str(e))
+        self.stdout.write("Moved %d containers" % moved)
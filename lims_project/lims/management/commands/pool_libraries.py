@@ -0,0 +1,47 @@
+from __future__ import print_function
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lims import pooling, worklists
+from lims.models import SequencingRun
+
+
+class Command(BaseCommand):
+    args = "<sequencing run uid>"
+    help = "Compute the volumes to pool the DNA libraries of a sequencing run " \
+        "equimolarly and optionally write them as a liquid handler worklist."
+    option_list = BaseCommand.option_list + (
+        make_option('--molarity', type='float', dest='molarity',
+                    help="Molarity of the pool, in the unit of the library "
+                    "concentrations"),
+        make_option('--volume', type='float', dest='volume',
+                    help="Volume of the pool in ul"),
+        make_option('--min-volume', type='float', dest='min_volume',
+                    default=pooling.MIN_VOLUME, help="Smallest volume that can "
+                    "be pipetted in ul (default: %s)" % pooling.MIN_VOLUME),
+        make_option('--worklist', dest='worklist',
+                    help="Write the transfers to this CSV file, only if all "
+                    "libraries can be pooled"),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Specify the uid of the sequencing run")
+        if options['molarity'] is None or options['volume'] is None:
+            raise CommandError("Specify --molarity and --volume")
+        try:
+            run = SequencingRun.objects.get(uid=args[0])
+        except SequencingRun.DoesNotExist:
+            raise CommandError("No sequencing run with uid %s" % args[0])
+
+        pool = pooling.pool_libraries(run, options['molarity'], options['volume'],
+                                      options['min_volume'])
+        for line in pooling.format_report(pool):
+            self.stdout.write(line)
+        if not pooling.is_feasible(pool):
+            raise CommandError("Not all libraries can be pooled, no worklist is "
+                               "written")
+        if options['worklist']:
+            with open(options['worklist'], 'wb') as f:
+                worklists.write_csv(f, pooling.pool_worklist(pool))
@@ -0,0 +1,47 @@
+from __future__ import print_function
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lims.models import ReadFile, SequencingRun
+from lims.readstats import ReadStatsCache, default_cache, update_read_counts
+
+
+class Command(BaseCommand):
+    args = "[<SequencingRun uid> ...]"
+    help = "Compute read count, base count and MD5 of the FASTQ file of each " \
+        "ReadFile of the given SequencingRuns (default: all ReadFiles without " \
+        "a read count) and store the read counts."
+    option_list = BaseCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+                    help="Process all ReadFiles of the selected runs, not only "
+                    "the ones without a read count"),
+        make_option('--processes', type='int', dest='processes', default=None,
+                    help="Number of processes (default: number of CPUs)"),
+        make_option('--cache', dest='cache', default=None,
+                    help="Cache file (default: settings.LIMS_READSTATS_CACHE)"),
+    )
+
+    def handle(self, *args, **options):
+        read_files = ReadFile.objects.all()
+        if args:
+            runs = list(SequencingRun.objects.filter(uid__in=args))
+            missing = set(args) - set(r.uid for r in runs)
+            if missing:
+                raise CommandError("Unknown SequencingRun(s): %s" %
+                                   ", ".join(sorted(missing)))
+            read_files = read_files.filter(sequencing_run__in=runs)
+        if not options['all']:
+            read_files = read_files.filter(read_count=0)
+
+        cache = ReadStatsCache(options['cache']) if options['cache'] else \
+            default_cache()
+        errors = {}
+        for rf, stats in update_read_counts(read_files.order_by('id'),
+                                            options['processes'], cache, errors):
+            self.stdout.write("%s\t%d\t%d\t%s" % (rf.filename, stats.read_count,
+                                                  stats.base_count, stats.md5))
+        for path, error in sorted(errors.items()):
+            self.stderr.write("%s: %s" % (path, error))
+        if errors:
+            raise CommandError("Can't read %d file(s)" % len(errors))
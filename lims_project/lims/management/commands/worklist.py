@@ -0,0 +1,99 @@
+from __future__ import print_function
+import csv
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from lims import worklists
+from lims.models import get_containers
+
+RULES = {'one_to_one': worklists.one_to_one,
+         'quadrants': worklists.quadrants}
+
+
+class Command(BaseCommand):
+    args = "<source plate barcode> <destination plate barcode> [...]"
+    help = "Write the liquid handler worklist of the transfers from the wells " \
+        "of a source plate to the wells of destination plates and optionally " \
+        "move the transferred objects to the destination wells."
+    option_list = BaseCommand.option_list + (
+        make_option('--rule', dest='rule', default='one_to_one',
+                    choices=sorted(RULES.keys()) + ['cherry_pick'],
+                    help="How source wells map to destination wells: "
+                    "one_to_one, quadrants (384 to four 96 well plates) or "
+                    "cherry_pick (default: one_to_one)"),
+        make_option('--picks', dest='picks',
+                    help="CSV file of source well,destination well[,destination "
+                    "plate number] rows for --rule cherry_pick, plates are "
+                    "numbered from 1"),
+        make_option('--volume', type='float', dest='volume',
+                    help="Volume to transfer in ul"),
+        make_option('--format', dest='format', default='csv',
+                    choices=sorted(worklists.FORMATS.keys()),
+                    help="Worklist format: %s (default: csv)" %
+                    ", ".join(sorted(worklists.FORMATS.keys()))),
+        make_option('--output', dest='output',
+                    help="Write the worklist to this file instead of stdout"),
+        make_option('--apply', action='store_true', dest='apply', default=False,
+                    help="Move the objects of the source wells to the "
+                    "destination wells"),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) < 2:
+            raise CommandError("Specify the source and destination plate barcodes")
+        if options['volume'] is None:
+            raise CommandError("Specify --volume")
+        if options['rule'] == 'cherry_pick':
+            if not options['picks']:
+                raise CommandError("Specify the --picks file")
+            nr_destinations = len(args) - 1
+            picks = []
+            try:
+                with open(options['picks'], 'rb') as f:
+                    for row in csv.reader(f):
+                        if len(row) > 2:
+                            number = int(row[2])
+                            if not 1 <= number <= nr_destinations:
+                                raise(ValueError("plate number %d is not between "
+                                                 "1 and %d" % (number,
+                                                               nr_destinations)))
+                            row = row[:2] + [number - 1]
+                        if row:
+                            picks.append(row)
+                rule = worklists.cherry_pick(picks)
+            except ValueError as e:
+                raise CommandError("Invalid picks file: %s" % e)
+        else:
+            rule = RULES[options['rule']]
+
+        try:
+            plates = get_containers(args)
+        except Exception as e:
+            raise CommandError(str(e))
+        source, destinations = plates[0], plates[1:]
+        with transaction.atomic():
+            try:
+                pairs = worklists.plan_transfers(source, destinations, rule)
+            except IndexError:
+                raise CommandError("The mapping needs more destination plates")
+            except Exception as e:
+                raise CommandError(str(e))
+
+            # The worklist is written before the moves are applied, so a
+            # failed write changes nothing
+            transfers = worklists.transfers(pairs, options['volume'])
+            kwargs = {}
+            if options['format'] in worklists.POSITION_FORMATS:
+                kwargs['rows'] = worklists.plate_rows([source] + destinations)
+            write = worklists.FORMATS[options['format']]
+            if options['output']:
+                with open(options['output'], 'wb') as f:
+                    write(f, transfers, **kwargs)
+            else:
+                write(self.stdout, transfers, **kwargs)
+            if options['apply']:
+                worklists.apply_moves(pairs)
+        if options['apply']:
+            self.stderr.write("Moved %d objects to the destination wells" % len(pairs))
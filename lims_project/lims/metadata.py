@@ -0,0 +1,98 @@
+"""Registry of the metadata of the lims models that is the same for every
+request: names, the attributes shown on object pages, the relations followed
+by the sample tree, the barcode prefix and the content type id. It is built
+once, when the URLconf is loaded, so views, admin and templates don't
+recompute it per request. Content type ids are looked up on first use, as the
+content type table may not exist yet when the registry is built (e.g. during
+syncdb)."""
+from __future__ import print_function
+from collections import namedtuple
+from operator import attrgetter
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import get_models
+from django.template.defaultfilters import slugify
+from django.utils.text import capfirst
+
+# A foreign key of model to the model of the metadata
+RelatedObjects = namedtuple('RelatedObjects', ['model', 'field_name', 'attname'])
+
+_registry = {}
+
+
+class ModelMetadata(object):
+    """The metadata of a model, see the module documentation"""
+    def __init__(self, model):
+        from lims.models import BARCODE_PREFIXES, unicode_select_related
+
+        self.model = model
+        self.name = model.__name__
+        self.slug = slugify(model.__name__)
+        self.view_name = 'lims.views.browse.' + self.slug
+        self.verbose_name = unicode(capfirst(model._meta.verbose_name))
+        self.verbose_name_plural = unicode(capfirst(model._meta.verbose_name_plural))
+        # preferred_ordering is a property, it only depends on the model
+        self.preferred_ordering = tuple(model().preferred_ordering) \
+            if hasattr(model, 'preferred_ordering') else None
+        self.has_object_view = self.preferred_ordering is not None
+        self.attribute_getters = tuple((name, attrgetter(name)) for name in
+                                       self.preferred_ordering or ())
+        self.related_objects = tuple(
+            RelatedObjects(ro.model, ro.field.name, ro.field.attname)
+            for ro in model._meta.get_all_related_objects())
+        self.unicode_select_related = tuple(unicode_select_related(model))
+        self.barcode_prefix = dict((m, p) for (p, m) in
+                                   BARCODE_PREFIXES.items()).get(model)
+        self._content_type_id = None
+
+    def attribute_rows(self, obj):
+        """Returns the (attribute name, value) pairs of obj in preferred
+        ordering. Like the getattribute template filter, attributes obj
+        doesn't have get TEMPLATE_STRING_IF_INVALID."""
+        rows = []
+        for name, getter in self.attribute_getters:
+            try:
+                rows.append((name, getter(obj)))
+            except (AttributeError, ObjectDoesNotExist):
+                rows.append((name, settings.TEMPLATE_STRING_IF_INVALID))
+        return rows
+
+    @property
+    def content_type_id(self):
+        if self._content_type_id is None:
+            self._content_type_id = ContentType.objects.get_for_model(self.model).id
+        return self._content_type_id
+
+
+def build_registry():
+    """Builds the metadata of all lims models, returns them in the order of
+    the models module"""
+    import lims.models
+    models = get_models(app_mod=lims.models)
+    for model in models:
+        if model not in _registry:
+            _registry[model] = ModelMetadata(model)
+    return [_registry[m] for m in models]
+
+
+def model_metadata(model):
+    """Returns the ModelMetadata of a model or of a model instance"""
+    if not isinstance(model, type):
+        model = type(model)
+    try:
+        return _registry[model]
+    except KeyError:
+        # Models outside lims are added when first used
+        _registry[model] = ModelMetadata(model)
+        return _registry[model]
+
+
+def metadata_by_slug(slug):
+    """Returns the ModelMetadata of the lims model with the given slug, None
+    if there is none"""
+    for meta in build_registry():
+        if meta.slug == slug:
+            return meta
+    return None
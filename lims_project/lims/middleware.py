@@ -0,0 +1,139 @@
+"""Opt-in instrumentation of requests. Add
+'lims.middleware.QueryStatsMiddleware' to MIDDLEWARE_CLASSES to record per
+request the number of SQL queries, the total SQL time, repeated queries (the
+same SQL with different parameters executed many times usually means an N+1
+query pattern) and the total view time. These are added as X-LIMS-* response
+headers, logged to the lims.requests logger and aggregated per URL name,
+viewable by staff at /stats/requests/."""
+from __future__ import print_function
+import re
+import time
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('lims.requests')
+
+# Upper bounds in ms of the view time histogram buckets, the last bucket is
+# everything slower
+HISTOGRAM_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500]
+
+# Literals replaced to group queries that only differ in their parameters
+_SQL_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def normalize_sql(sql):
+    return _SQL_LITERAL_RE.sub("?", sql)
+
+
+class QueryStats(object):
+    """Statistics of the queries executed during a request"""
+    def __init__(self, queries):
+        self.nr_queries = len(queries)
+        self.sql_time = sum(float(q['time']) for q in queries) * 1000
+        counts = Counter(normalize_sql(q['sql']) for q in queries)
+        self.nr_duplicates = self.nr_queries - len(counts)
+        if counts:
+            self.most_repeated, self.most_repeated_count = counts.most_common(1)[0]
+        else:
+            self.most_repeated, self.most_repeated_count = None, 0
+
+
+class RequestHistogram(object):
+    """Thread safe, in process aggregation of request statistics per URL
+    name"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.entries = {}
+
+    def add(self, url_name, view_time, stats):
+        bucket = len([b for b in HISTOGRAM_BUCKETS if view_time > b])
+        with self.lock:
+            entry = self.entries.setdefault(url_name, {
+                'count': 0, 'view_time': 0.0, 'max_view_time': 0.0,
+                'nr_queries': 0, 'max_queries': 0, 'sql_time': 0.0,
+                'nr_duplicates': 0,
+                'buckets': [0] * (len(HISTOGRAM_BUCKETS) + 1)})
+            entry['count'] += 1
+            entry['view_time'] += view_time
+            entry['max_view_time'] = max(entry['max_view_time'], view_time)
+            entry['nr_queries'] += stats.nr_queries
+            entry['max_queries'] = max(entry['max_queries'], stats.nr_queries)
+            entry['sql_time'] += stats.sql_time
+            entry['nr_duplicates'] += stats.nr_duplicates
+            entry['buckets'][bucket] += 1
+
+    def summary(self):
+        """Returns a list of (url_name, entry) pairs sorted by total view
+        time, every entry has averages added"""
+        with self.lock:
+            entries = [(name, dict(e, buckets=list(e['buckets'])))
+                       for (name, e) in self.entries.items()]
+        for name, e in entries:
+            e['avg_view_time'] = e['view_time'] / e['count']
+            e['avg_queries'] = float(e['nr_queries']) / e['count']
+            e['avg_sql_time'] = e['sql_time'] / e['count']
+        return sorted(entries, key=lambda x: -x[1]['view_time'])
+
+
+histogram = RequestHistogram()
+
+
+def url_name(request):
+    """Returns the namespaced URL name of the request, e.g.
+    admin:lims_sample_changelist, or the path if the URL has no name"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None or not match.url_name:
+        return request.path
+    return ":".join(match.namespaces + [match.url_name])
+
+
+class QueryStatsMiddleware(object):
+    """Records query and timing statistics of each request, see the module
+    documentation. Repeated queries are logged as a warning once a query is
+    repeated LIMS_QUERY_STATS_REPEAT_WARNING (default 10) times."""
+    def process_request(self, request):
+        request._lims_query_stats = (time.time(), [
+            (c, c.use_debug_cursor, len(c.queries)) for c in connections.all()])
+        for c in connections.all():
+            c.use_debug_cursor = True
+
+    def process_response(self, request, response):
+        if not hasattr(request, '_lims_query_stats'):
+            return response
+        start, states = request._lims_query_stats
+        del request._lims_query_stats
+        view_time = (time.time() - start) * 1000
+        queries = []
+        for c, use_debug_cursor, nr_queries in states:
+            queries += c.queries[nr_queries:]
+            c.use_debug_cursor = use_debug_cursor
+            if not (use_debug_cursor or settings.DEBUG):
+                # Nobody else is collecting the queries
+                del c.queries[nr_queries:]
+        stats = QueryStats(queries)
+
+        response['X-LIMS-Query-Count'] = str(stats.nr_queries)
+        response['X-LIMS-Query-Time'] = "%.1f" % stats.sql_time
+        response['X-LIMS-Duplicate-Queries'] = str(stats.nr_duplicates)
+        response['X-LIMS-View-Time'] = "%.1f" % view_time
+
+        name = url_name(request)
+        histogram.add(name, view_time, stats)
+        logger.info("url_name=%s method=%s path=%s status=%d queries=%d "
+                    "sql_ms=%.1f duplicates=%d view_ms=%.1f", name,
+                    request.method, request.path, response.status_code,
+                    stats.nr_queries, stats.sql_time, stats.nr_duplicates,
+                    view_time)
+        threshold = getattr(settings, 'LIMS_QUERY_STATS_REPEAT_WARNING', 10)
+        if stats.most_repeated_count >= threshold:
+            logger.warning("url_name=%s repeated=%d sql=%s", name,
+                           stats.most_repeated_count, stats.most_repeated)
+        return response
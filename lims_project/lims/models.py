@@ -1,17 +1,22 @@
 from __future__ import print_function
+import os
 import sys
 import re
 
-from django.db import models
+from django.db import models, connection, transaction
+from django.db.models.signals import post_syncdb
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
+from django.contrib.admin import models as admin_models
 from django.contrib.admin.models import LogEntry
 from django.template.defaultfilters import slugify
 
+from lims.refcache import ReferenceForeignKey
+
 
 def property_verbose(description):
     """Make the function a property and give it a description. Normal property
@@ -22,6 +27,21 @@ def property_verbose(description):
     return property_verbose_inner
 
 
+def unicode_select_related(model, prefix=""):
+    """Returns the select_related paths needed to render model's __unicode__
+    without queries, as declared in Model.unicode_select_related."""
+    paths = []
+    for name in getattr(model, 'unicode_select_related', ()):
+        paths.append(prefix + name)
+        paths += unicode_select_related(model._meta.get_field(name).rel.to,
+                                        prefix + name + "__")
+    return paths
+
+
+# Sample UIDs consist of five alphanumeric capitals
+SAMPLE_UID_RE = re.compile("^[A-Z0-9]{5}$")
+
+
 class UIDManager(models.Manager):
     def get_by_natural_key(self, uid):
         return self.get(uid=uid)
@@ -30,8 +50,10 @@ class UIDManager(models.Manager):
 class CreatedByUser(object):
     @property
     def username(self):
-        ct = ContentType.objects.get_for_model(type(self))
-        first_log = LogEntry.objects.filter(content_type=ct, object_id=self.id).first()
+        from lims.metadata import model_metadata
+        first_log = LogEntry.objects.filter(
+            content_type=model_metadata(self).content_type_id,
+            object_id=self.id).select_related('user').first()
         if first_log:
             return first_log.user.username
         else:
@@ -46,6 +68,9 @@ class Apparatus(models.Model):
     location = models.CharField(max_length=100)
     date = models.DateTimeField(default=timezone.now, blank=True)
 
+    # Rarely changing, cached in memory by lims.refcache
+    reference_data = True
+
     def __unicode__(self):
         return unicode(self.name)
 
@@ -69,9 +94,15 @@ class ApparatusSubdivision(models.Model):
     one location to store things it should still have a record here, see
     Container documentation."""
     name = models.CharField(max_length=100)
-    apparatus = models.ForeignKey(Apparatus)
+    apparatus = ReferenceForeignKey(Apparatus)
     date = models.DateTimeField(default=timezone.now, blank=True)
 
+    # Rarely changing, cached in memory by lims.refcache
+    reference_data = True
+
+    # Relations used by __unicode__, see LIMSModelAdmin
+    unicode_select_related = ('apparatus', )
+
     def __unicode__(self):
         return unicode("{0} {1}".format(self.apparatus, self.name))
 
@@ -93,6 +124,9 @@ class BarcodePrinter(models.Model):
                             "selected printer should support ZPL programming "
                             "language.")
 
+    # Rarely changing, cached in memory by lims.refcache
+    reference_data = True
+
     def __unicode__(self):
         return unicode(self.name)
 
@@ -122,7 +156,7 @@ class BarcodeToModel(models.Model):
         models.Q(app_label="lims", model="dnalibrary") | \
         models.Q(app_label="lims", model="container")
     content_type = models.ForeignKey(ContentType, limit_choices_to=qlimit, null=True, blank=True)
-    printer = models.ForeignKey(BarcodePrinter)
+    printer = ReferenceForeignKey(BarcodePrinter)
     template = models.ForeignKey(BarcodeTemplate)
     barcode_fields = models.TextField(help_text="Specify "
             "space-separated list of fields. You are allowed "
@@ -131,6 +165,8 @@ class BarcodeToModel(models.Model):
     class Meta:
         unique_together = (("content_type", "printer", "template"),)
 
+    unicode_select_related = ('template', 'printer', 'content_type')
+
     def __unicode__(self):
         return unicode("{0} - {1} - {2}".format(self.template, self.printer, self.content_type))
 
@@ -142,7 +178,10 @@ class ContainerType(CreatedByUser, models.Model):
     notes = models.TextField(blank=True)
     date = models.DateTimeField(default=timezone.now, blank=True)
     divisible = models.BooleanField(default=False)
-    barcode = models.ForeignKey(BarcodePrinter, null=True, blank=True)
+    barcode = ReferenceForeignKey(BarcodePrinter, null=True, blank=True)
+
+    # Rarely changing, cached in memory by lims.refcache
+    reference_data = True
 
     def __unicode__(self):
         return unicode(self.name)
@@ -167,16 +206,16 @@ class Container(models.Model):
     The children Containers should leave the apparatus_subdivision field empty
     to avoid redundancy and inconsistencies between the root parent Container
     and its children."""
-    type = models.ForeignKey(ContainerType)
+    type = ReferenceForeignKey(ContainerType)
     row = models.IntegerField(blank=True, null=True)
     column = models.IntegerField(blank=True, null=True)
     parent = models.ForeignKey('self', blank=True, null=True,
                                help_text="Parent container",
                                related_name="child")
-    apparatus_subdivision = models.ForeignKey(ApparatusSubdivision, blank=True,
+    apparatus_subdivision = ReferenceForeignKey(ApparatusSubdivision, blank=True,
                                               null=True)
     notes = models.TextField(blank=True)
-    date = models.DateTimeField(default=timezone.now, blank=True)
+    date = models.DateTimeField(default=timezone.now, blank=True, db_index=True)
 
     # Generic relation
     qlimit = models.Q(app_label="lims", model="sample") | \
@@ -217,28 +256,31 @@ class Container(models.Model):
         """Saves and checks whether either parent or apparatus_subdivision is
         provided. Only the root Container with parent null should be linked to
         an apparatus_subdivision."""
-        if bool(self.parent) != bool(self.apparatus_subdivision):
+        if (self.parent_id is None) != (self.apparatus_subdivision_id is None):
             super(Container, self).save()
         else:
             raise(Exception("The root container should be linked to an "
             "apparatus_subdivision. Child containers not."))
 
+    unicode_select_related = ('type', )
+
     def __unicode__(self):
         return unicode("%s-%s") % (self.type, self.barcode)
 
     def clean(self):
-        if bool(self.parent) and bool(self.apparatus_subdivision):
+        if self.parent_id is not None and \
+                self.apparatus_subdivision_id is not None:
             error_msg = """A container with a parent can't be located at a
             different location than it's parent i.e. specify either parent or
             apparatus_subdivision."""
             raise ValidationError({"parent": [error_msg, ],
                                    "apparatus_subdivision": [error_msg, ]})
-        elif not bool(self.parent) and not bool(self.apparatus_subdivision):
+        elif self.parent_id is None and self.apparatus_subdivision_id is None:
             error_msg = """A container without a parent should be stored at an
             apparatus_subdivision."""
             raise ValidationError({"parent": [error_msg, ],
                                    "apparatus_subdivision": [error_msg, ]})
-        elif self.content_type and not self.object_id:
+        elif self.content_type_id is not None and not self.object_id:
             error_msg = """If content_type is set an object_id should also be set."""
             raise ValidationError({"content_type": [error_msg, ],
                                    "object_id": [error_msg, ]})
@@ -299,6 +341,8 @@ class Container(models.Model):
 
     class Meta:
         unique_together = (("row", "column", "parent"),)
+        # Lookups of the containers of an object, see StorablePhysicalObject
+        index_together = [('content_type', 'object_id')]
 
 
 class StorablePhysicalObject(models.Model):
@@ -310,6 +354,17 @@ class StorablePhysicalObject(models.Model):
                 raise(ValidationError({"containers": [error_msg, ]}))
         super(StorablePhysicalObject, self).clean()
 
+    @property_verbose("Storage path")
+    def storage_path(self):
+        """Where the object is stored, e.g.
+        Freezer A > Rack 2 > 96 well box-CO:000012 > B04, paths of multiple
+        containers are separated by a semicolon. Use
+        lims.storage.resolve_storage_paths to resolve many objects at once."""
+        if not hasattr(self, '_storage_paths'):
+            from lims.storage import resolve_storage_paths
+            resolve_storage_paths([self])
+        return "; ".join(self._storage_paths)
+
     class Meta:
         abstract = True
 
@@ -341,23 +396,37 @@ class StorablePhysicalObject(models.Model):
 
 class IndexByGroup(models.Model):
     """IndexByGroup allows one to group a model by another model and get the
-    index based on that. An attribute character_list can be given to support a
+    index based on that. group_field is the name of the foreign key to the
+    group, models should have an index_together on (group_field,
+    index_by_group). An attribute character_list can be given to support a
     naming scheme that converts the indexes to characters."""
+    group_field = None
+
+    def get_group_id(self):
+        """Returns the pk of the object's group, without fetching the group"""
+        return getattr(self, self._meta.get_field(self.group_field).attname)
+
+    def get_group_filter(self):
+        """Returns the filter arguments selecting the object's group"""
+        return {self.group_field: self.get_group_id()}
+
     def get_count_by_group(self):
         """Count the number of objects related to the object's group"""
-        return self.__class__.objects.filter(**{self.group_id_keyword: self.group.id}).count()
+        return self.__class__.objects.filter(**self.get_group_filter()).count()
 
     def get_max_by_group(self):
         """Gives the maximum index_by_group."""
-        return self.__class__.objects.filter(
-            **{self.group_id_keyword: self.group.id}).aggregate(
-            models.Max('index_by_group'))['index_by_group__max']
+        return self.__class__.objects.filter(**self.get_group_filter()) \
+            .aggregate(models.Max('index_by_group'))['index_by_group__max']
 
     def calc_index_by_group(self):
-        """Returns index_by_group and calculates it if non-existent"""
+        """Returns index_by_group and calculates it if non-existent. New
+        indexes follow the maximum of the group, so indexes of deleted objects
+        are not reused."""
         # calculate if this is a new instance
         if self.pk is None:
-            index_by_group = self.get_count_by_group()
+            max_index = self.get_max_by_group()
+            index_by_group = 0 if max_index is None else max_index + 1
             if hasattr(self, 'character_list') \
               and index_by_group >= len(self.character_list):
                 raise(Exception("Too many objects, only %i %s supported by "
@@ -370,9 +439,15 @@ class IndexByGroup(models.Model):
             except AttributeError:
                 raise(Exception("Object has pk but no index_by_group"))
 
+    def set_index_by_group(self):
+        """Sets index_by_group of a new object, for models that derive the uid
+        from it before saving. save then doesn't calculate it again."""
+        self.index_by_group = self.calc_index_by_group()
+        self._index_by_group_set = True
+
     def save(self):
         """Determine index_by_group on save"""
-        if self.pk is None:
+        if self.pk is None and not self.__dict__.pop('_index_by_group_set', False):
             self.index_by_group = self.calc_index_by_group()
         super(IndexByGroup, self).save()
 
@@ -410,6 +485,9 @@ class Collaborator(models.Model):
     notes = models.TextField(blank=True)
     date = models.DateTimeField(default=timezone.now, blank=True)
 
+    # Rarely changing, cached in memory by lims.refcache
+    reference_data = True
+
     def __unicode__(self):
         return unicode("%s %s" % (self.first_name, self.last_name))
 
@@ -424,6 +502,9 @@ class SampleType(models.Model):
     description = models.TextField(blank=True)
     date = models.DateTimeField(default=timezone.now, blank=True)
 
+    # Rarely changing, cached in memory by lims.refcache
+    reference_data = True
+
     def __unicode__(self):
         return unicode("%s" % (self.name))
 
@@ -438,6 +519,9 @@ class SampleLocation(models.Model):
     description = models.TextField(blank=True)
     date = models.DateTimeField(default=timezone.now, blank=True)
 
+    # Rarely changing, cached in memory by lims.refcache
+    reference_data = True
+
     def __unicode__(self):
         return unicode("%s" % (self.name))
 
@@ -451,9 +535,9 @@ class Sample(CreatedByUser, StorablePhysicalObject, models.Model):
     uid = models.CharField("UID", max_length=30, unique=True,
         help_text="UID should consist of five alphanumeric characters. Only capitals allowed.")
 
-    collaborator = models.ForeignKey(Collaborator)
-    sample_type = models.ForeignKey(SampleType)
-    sample_location = models.ForeignKey(SampleLocation)
+    collaborator = ReferenceForeignKey(Collaborator)
+    sample_type = ReferenceForeignKey(SampleType)
+    sample_location = ReferenceForeignKey(SampleLocation)
 
     temperature = models.DecimalField(u"Temperature \u00B0C", max_digits=10,
         decimal_places=2, blank=True, null=True)
@@ -494,7 +578,7 @@ class Sample(CreatedByUser, StorablePhysicalObject, models.Model):
         return unicode("%s" % (self.uid))
 
     def clean(self):
-        if re.match("^[A-Z0-9]{5}$", str(self.uid)) is None:
+        if SAMPLE_UID_RE.match(str(self.uid)) is None:
             error_msg = """UID should consist of five alphanumeric characters. Only capitals allowed."""
             raise(ValidationError({"uid": [error_msg, ]}))
         super(Sample, self).clean()
@@ -531,11 +615,100 @@ class Sample(CreatedByUser, StorablePhysicalObject, models.Model):
             'biosafety_level',
             'status',
             'notes',
-            'container',
+            'storage_path',
             'date',
         ]
 
 
+class LineageObject(models.Model):
+    """Object derived from a Sample. root_sample is a denormalized reference to
+    the Sample at the root of the lineage, so per sample queries don't have to
+    join all intermediate tables. It is maintained on save: lineage_parents
+    names the foreign keys to the possible parents and the first one that is
+    set determines root_sample. If an object moves to another Sample, the
+    root_sample of its descendants is updated with one UPDATE per model."""
+    root_sample = models.ForeignKey(Sample, null=True, editable=False,
+                                    related_name="+")
+
+    lineage_parents = ()
+
+    class Meta:
+        abstract = True
+
+    def get_root_sample_id(self):
+        """Determines the id of the root Sample from the parent"""
+        for name in self.lineage_parents:
+            field = self._meta.get_field(name)
+            if getattr(self, field.attname) is None:
+                continue
+            if field.rel.to is Sample:
+                return getattr(self, field.attname)
+            parent = getattr(self, name)
+            if parent.root_sample_id is not None:
+                return parent.root_sample_id
+            return parent.get_root_sample_id()
+        return None
+
+    def set_root_sample_id(self, root_sample_id):
+        """Sets root_sample_id, dropping a cached root_sample that differs"""
+        cache_name = self._meta.get_field('root_sample').get_cache_name()
+        cached = getattr(self, cache_name, None)
+        if cached is None or cached.pk != root_sample_id:
+            self.__dict__.pop(cache_name, None)
+        self.root_sample_id = root_sample_id
+
+    def get_root_sample(self):
+        """Returns the root Sample, the parents are only followed for new
+        objects or if root_sample is not stored yet"""
+        if self.pk is None or self.root_sample_id is None:
+            self.set_root_sample_id(self.get_root_sample_id())
+        return self.root_sample
+
+    def get_group_id(self):
+        """Objects grouped by root_sample only need the root sample id, not the
+        Sample"""
+        if self.group_field == "root_sample":
+            if self.pk is None or self.root_sample_id is None:
+                self.set_root_sample_id(self.get_root_sample_id())
+            return self.root_sample_id
+        return super(LineageObject, self).get_group_id()
+
+    def __init__(self, *args, **kwargs):
+        super(LineageObject, self).__init__(*args, **kwargs)
+        self._saved_lineage = self.get_lineage_state()
+
+    def get_lineage_state(self):
+        """Returns the ids of the lineage parents and the root_sample_id, None
+        if one of them is deferred"""
+        attnames = [self._meta.get_field(name).attname
+                    for name in self.lineage_parents] + ['root_sample_id']
+        if any(a not in self.__dict__ for a in attnames):
+            return None
+        return tuple(self.__dict__[a] for a in attnames)
+
+    def save(self):
+        """The root sample is only determined again if a parent changed since
+        the object was loaded or saved, then descendants are updated if it
+        differs from the root sample loaded with the object"""
+        saved = self._saved_lineage if self.pk is not None else None
+        state = self.get_lineage_state()
+        if saved is None or saved != state or state[-1] is None:
+            root_sample_id = self.get_root_sample_id()
+            moved = self.pk is not None and (
+                root_sample_id != saved[-1] if saved is not None else
+                type(self).objects.filter(pk=self.pk)
+                .exclude(root_sample=root_sample_id).exists())
+            self.set_root_sample_id(root_sample_id)
+        else:
+            moved = False
+        super(LineageObject, self).save()
+        if moved:
+            update_descendant_root_samples(type(self),
+                                           type(self).objects.filter(pk=self.pk),
+                                           self.root_sample_id)
+        self._saved_lineage = self.get_lineage_state()
+
+
 class Protocol(models.Model):
     name = models.CharField(max_length=30)
     revision = models.CharField(max_length=30)
@@ -543,19 +716,23 @@ class Protocol(models.Model):
     notes = models.TextField(blank=True)
     date = models.DateTimeField(default=timezone.now, blank=True)
 
+    # Rarely changing, cached in memory by lims.refcache
+    reference_data = True
+
     def __unicode__(self):
         return unicode("%s" % (self.name))
 
 
-class ExtractedCell(CreatedByUser, StorablePhysicalObject, IndexByGroup):
+class ExtractedCell(CreatedByUser, StorablePhysicalObject, LineageObject, IndexByGroup):
     sample = models.ForeignKey(Sample)
-    protocol = models.ForeignKey(Protocol)
+    protocol = ReferenceForeignKey(Protocol)
     notes = models.TextField(blank=True)
     date = models.DateTimeField(default=timezone.now, blank=True)
     uid = models.CharField("UID", max_length=30, unique=True, default="Automatically generated",
         help_text="UID consists of the sample UID followed by a count i.e. 10Y31_1")
 
-    group_id_keyword = "sample__id"
+    group_field = "sample"
+    lineage_parents = ('sample', )
 
     objects = UIDManager()
 
@@ -573,10 +750,13 @@ class ExtractedCell(CreatedByUser, StorablePhysicalObject, IndexByGroup):
     def save(self):
         """Stores UID on save"""
         if self.pk is None:
-            self.index_by_group = self.calc_index_by_group()
+            self.set_index_by_group()
             self.uid = "%s_%s" % (self.group.uid, self.index_by_group + 1)
         super(ExtractedCell, self).save()
 
+    class Meta:
+        index_together = [('sample', 'index_by_group')]
+
     def __unicode__(self):
         return unicode(self.uid)
 
@@ -586,14 +766,14 @@ class ExtractedCell(CreatedByUser, StorablePhysicalObject, IndexByGroup):
             'id',
             'sample',
             'protocol',
-            'container',
+            'storage_path',
             'notes',
         ]
 
 
-class ExtractedDNA(CreatedByUser, StorablePhysicalObject, IndexByGroup):
+class ExtractedDNA(CreatedByUser, StorablePhysicalObject, LineageObject, IndexByGroup):
     sample = models.ForeignKey(Sample, null=True, blank=True)
-    protocol = models.ForeignKey(Protocol)
+    protocol = ReferenceForeignKey(Protocol)
     notes = models.TextField(blank=True)
     extracted_cell = models.ForeignKey(ExtractedCell, null=True, blank=True)
     concentration = models.DecimalField(u"Concentration (mol L\u207B\u00B9)",
@@ -604,18 +784,17 @@ class ExtractedDNA(CreatedByUser, StorablePhysicalObject, IndexByGroup):
     uid = models.CharField("UID", max_length=30, unique=True, default="Automatically generated",
         help_text="UID consists of the sample UID followed by a count i.e. 10Y31_1")
 
+    group_field = "root_sample"
+    lineage_parents = ('sample', 'extracted_cell')
+
     objects = UIDManager()
 
     def natural_key(self):
         return (self.uid, )
 
-    @property
-    def group_id_keyword(self):
-        return "sample__id" if self.sample else "extracted_cell__sample__id"
-
     @property
     def group(self):
-        return self.sample if self.sample else self.extracted_cell.sample
+        return self.get_root_sample()
 
     @property
     def barcode(self):
@@ -626,9 +805,9 @@ class ExtractedDNA(CreatedByUser, StorablePhysicalObject, IndexByGroup):
         Not both, because this makes it easier to change the Sample on an
         ExtractedCell for example. Otherwise you would have to change both this
         object and the Extracted Cell."""
-        if bool(self.sample) != bool(self.extracted_cell):
+        if (self.sample_id is None) != (self.extracted_cell_id is None):
             if self.pk is None:
-                self.index_by_group = self.calc_index_by_group()
+                self.set_index_by_group()
                 self.uid = "%s_%s" % (self.group.uid, self.index_by_group + 1)
             super(ExtractedDNA, self).save()
         else:
@@ -636,7 +815,7 @@ class ExtractedDNA(CreatedByUser, StorablePhysicalObject, IndexByGroup):
                             " a Sample, but not both."))
 
     def clean(self):
-        if bool(self.sample) == bool(self.extracted_cell):
+        if (self.sample_id is None) == (self.extracted_cell_id is None):
             error_msg = """You have to specify either an Extracted cell or a
             Sample, but not both."""
             raise(ValidationError({"sample": [error_msg, ], "extracted_cell":
@@ -646,6 +825,7 @@ class ExtractedDNA(CreatedByUser, StorablePhysicalObject, IndexByGroup):
     class Meta:
         verbose_name = "Extracted DNA"
         verbose_name_plural = verbose_name
+        index_together = [('root_sample', 'index_by_group')]
 
     def __unicode__(self):
         return unicode(self.uid)
@@ -657,12 +837,11 @@ class ExtractedDNA(CreatedByUser, StorablePhysicalObject, IndexByGroup):
             'uid',
             'sample',
             'protocol',
-            'container',
+            'storage_path',
             'notes',
             'extracted_cell',
             'concentration',
             'buffer',
-            'container',
         ]
 
 
@@ -700,14 +879,14 @@ class RTMDA(models.Model):
         return [f.attname for f in self._meta.fields]
 
 
-class SAGPlate(CreatedByUser, IndexByGroup):
+class SAGPlate(CreatedByUser, LineageObject, IndexByGroup):
     """SAGPlate is not a Container because we want to enforce all the same
     samples on the child wells and in addition store information about the
     Plate itself. The storage location is a key to ApparatusSubDivision,
     similar to Container."""
     report = models.CharField(max_length=100)
-    protocol = models.ForeignKey(Protocol)
-    apparatus_subdivision = models.ForeignKey(ApparatusSubdivision)
+    protocol = ReferenceForeignKey(Protocol)
+    apparatus_subdivision = ReferenceForeignKey(ApparatusSubdivision)
     notes = models.TextField(blank=True)
     extracted_cell = models.ForeignKey(ExtractedCell)
     rt_mda = models.ForeignKey(RTMDA)
@@ -716,7 +895,8 @@ class SAGPlate(CreatedByUser, IndexByGroup):
     uid = models.CharField("UID", max_length=30, unique=True, default="Automatically generated",
         help_text="UID consists of the sample UID followed by a a character [A-Z] i.e. 10Y31A")
 
-    group_id_keyword = "extracted_cell__sample__id"
+    group_field = "root_sample"
+    lineage_parents = ('extracted_cell', )
     character_list = [chr(ord('A') + i) for i in range(26)]  # [A-Z]
 
     objects = UIDManager()
@@ -730,7 +910,7 @@ class SAGPlate(CreatedByUser, IndexByGroup):
 
     @property
     def group(self):
-        return self.extracted_cell.sample
+        return self.get_root_sample()
 
     @property
     def barcode(self):
@@ -739,13 +919,14 @@ class SAGPlate(CreatedByUser, IndexByGroup):
     def save(self):
         """Stores UID on save"""
         if self.pk is None:
-            self.index_by_group = self.calc_index_by_group()
+            self.set_index_by_group()
             self.uid = self.group.uid + self.index_to_naming_scheme()
         super(SAGPlate, self).save()
 
     class Meta:
         verbose_name = "SAG plate"
         verbose_name_plural = verbose_name + "s"
+        index_together = [('root_sample', 'index_by_group')]
 
     def __unicode__(self):
         return unicode(self.uid)
@@ -764,9 +945,9 @@ class SAGPlate(CreatedByUser, IndexByGroup):
                 'notes']
 
 
-class SAGPlateDilution(CreatedByUser, IndexByGroup):
+class SAGPlateDilution(CreatedByUser, LineageObject, IndexByGroup):
     sag_plate = models.ForeignKey(SAGPlate)
-    apparatus_subdivision = models.ForeignKey(ApparatusSubdivision)
+    apparatus_subdivision = ReferenceForeignKey(ApparatusSubdivision)
     dilution = models.CharField(max_length=100)
     qpcr = models.ForeignKey(QPCR)
     notes = models.TextField(blank=True)
@@ -774,7 +955,8 @@ class SAGPlateDilution(CreatedByUser, IndexByGroup):
     uid = models.CharField("UID", max_length=30, unique=True, default="Automatically generated",
         help_text="UID consists of the sample UID followed by a character or count [a-z0-9] i.e. 10Y31a")
 
-    group_id_keyword = "extracted_cell__sample__id"
+    group_field = "root_sample"
+    lineage_parents = ('sag_plate', )
     character_list = [chr(ord('a') + i) for i in range(26)] + range(10)  # [a-z0-9]
 
     objects = UIDManager()
@@ -788,7 +970,7 @@ class SAGPlateDilution(CreatedByUser, IndexByGroup):
 
     @property
     def group(self):
-        return self.sag_plate.extracted_cell.sample
+        return self.get_root_sample()
 
     @property
     def barcode(self):
@@ -797,13 +979,14 @@ class SAGPlateDilution(CreatedByUser, IndexByGroup):
     def save(self):
         """Stores UID on save"""
         if self.pk is None:
-            self.index_by_group = self.calc_index_by_group()
+            self.set_index_by_group()
             self.uid = self.group.uid + self.index_to_naming_scheme()
         super(SAGPlateDilution, self).save()
 
     class Meta:
         verbose_name = "SAG plate dilution"
         verbose_name_plural = verbose_name + "s"
+        index_together = [('root_sample', 'index_by_group')]
 
     def __unicode__(self):
         return unicode(self.uid)
@@ -819,14 +1002,15 @@ class SAGPlateDilution(CreatedByUser, IndexByGroup):
                 'notes']
 
 
-class Metagenome(IndexByGroup):
+class Metagenome(LineageObject, IndexByGroup):
     extracted_dna = models.ForeignKey(ExtractedDNA)
     diversity_report = models.CharField(max_length=100)
     date = models.DateTimeField(default=timezone.now, blank=True)
     uid = models.CharField("UID", max_length=30, unique=True, default="Automatically generated",
         help_text="UID consists of the sample UID followed by A_X and count [01-99] i.e. 10Y31A_X01")
 
-    group_id_keyword = "extracted_dna__sample__id"
+    group_field = "root_sample"
+    lineage_parents = ('extracted_dna', )
     character_list = ["%02d" % i for i in range(1, 100)]  # [01-99]
 
     objects = UIDManager()
@@ -840,7 +1024,10 @@ class Metagenome(IndexByGroup):
 
     @property
     def group(self):
-        return self.extracted_dna.sample
+        return self.get_root_sample()
+
+    class Meta:
+        index_together = [('root_sample', 'index_by_group')]
 
     def __unicode__(self):
         return unicode(self.uid)
@@ -848,7 +1035,7 @@ class Metagenome(IndexByGroup):
     def save(self):
         """Stores UID on save"""
         if self.pk is None:
-            self.index_by_group = self.calc_index_by_group()
+            self.set_index_by_group()
             self.uid = self.group.uid + "A_X" + self.index_to_naming_scheme()
         super(Metagenome, self).save()
 
@@ -880,7 +1067,7 @@ class Primer(CreatedByUser, StorablePhysicalObject):
         return [f.attname for f in self._meta.fields]
 
 
-class Amplicon(CreatedByUser, StorablePhysicalObject, IndexByGroup):
+class Amplicon(CreatedByUser, StorablePhysicalObject, LineageObject, IndexByGroup):
     extracted_dna = models.ForeignKey(ExtractedDNA)
     diversity_report = models.CharField(max_length=100)
     buffer = models.CharField(max_length=100)
@@ -890,7 +1077,8 @@ class Amplicon(CreatedByUser, StorablePhysicalObject, IndexByGroup):
     uid = models.CharField("UID", max_length=30, unique=True, default="Automatically generated",
         help_text="UID consists of the sample UID followed by A_Y and count [01-99] i.e. 10Y31A_Y01")
 
-    group_id_keyword = "extracted_dna__sample__id"
+    group_field = "root_sample"
+    lineage_parents = ('extracted_dna', )
     character_list = ["%02d" % i for i in range(1, 100)]  # [01-99]
 
     objects = UIDManager()
@@ -904,7 +1092,7 @@ class Amplicon(CreatedByUser, StorablePhysicalObject, IndexByGroup):
 
     @property
     def group(self):
-        return self.extracted_dna.sample
+        return self.get_root_sample()
 
     @property
     def barcode(self):
@@ -913,10 +1101,13 @@ class Amplicon(CreatedByUser, StorablePhysicalObject, IndexByGroup):
     def save(self):
         """Stores UID on save"""
         if self.pk is None:
-            self.index_by_group = self.calc_index_by_group()
+            self.set_index_by_group()
             self.uid = self.group.uid + "A_Y" + self.index_to_naming_scheme()
         super(Amplicon, self).save()
 
+    class Meta:
+        index_together = [('root_sample', 'index_by_group')]
+
     def __unicode__(self):
         return unicode(self.uid)
 
@@ -926,7 +1117,7 @@ class Amplicon(CreatedByUser, StorablePhysicalObject, IndexByGroup):
         return [f.attname for f in self._meta.fields]
 
 
-class SAG(models.Model):
+class SAG(LineageObject):
     sag_plate = models.ForeignKey(SAGPlate, blank=True, null=True)
     sag_plate_dilution = models.ForeignKey(SAGPlateDilution, blank=True, null=True)
     well = models.CharField(max_length=3)
@@ -937,29 +1128,30 @@ class SAG(models.Model):
     uid = models.CharField("UID", max_length=30, unique=True, default="Automatically generated",
         help_text="UID consists of the SAGPlate or SAGPlateDilution UID followed by the well i.e. 10Y31A_O10")
 
+    lineage_parents = ('sag_plate', 'sag_plate_dilution')
+
     objects = UIDManager()
 
     def natural_key(self):
         return (self.uid, )
 
     def save(self):
-        if sum((bool(self.sag_plate_dilution),
-                bool(self.sag_plate))) == 1:
+        if (self.sag_plate_id is None) != (self.sag_plate_dilution_id is None):
             if self.pk is None:
-                sag_plate_uid = self.sag_plate.uid if self.sag_plate else \
-                    self.sag_plate_dilution.uid
-                self.uid = "%s_%s" % (sag_uid, self.well)
+                source = self.sag_plate if self.sag_plate_id is not None else \
+                    self.sag_plate_dilution
+                self.uid = "%s_%s" % (source.uid, self.well)
             super(SAG, self).save()
         else:
             raise(Exception("You have to specify either a SAGPlate or a "
                             "SAGPlateDilution and not both"))
 
     def clean(self):
-        if bool(self.sag_plate_dilution) == bool(self.sag_plate):
-            error_msg = """You have to specify either an Extracted cell or a
-            Sample, but not both."""
+        if (self.sag_plate_id is None) == (self.sag_plate_dilution_id is None):
+            error_msg = """You have to specify either a SAG plate or a SAG plate
+            dilution, but not both."""
             raise(ValidationError({"sag_plate_dilution": [error_msg, ],
-                                   "extracted_cell": [error_msg, ]}))
+                                   "sag_plate": [error_msg, ]}))
         super(SAG, self).clean()
 
     class Meta:
@@ -971,13 +1163,10 @@ class SAG(models.Model):
 
     @property
     def sample(self):
-        if self.sag_plate:
-            return self.sag_plate.sample
-        elif self.sag_plate_dilution:
-            return self.sag_plate_dilution.sample
-        else:
+        if not (self.sag_plate_id or self.sag_plate_dilution_id):
             raise(Exception("Invalid object. Should belong to SAGPlate or "
                             "SAGPlateDilution"))
+        return self.get_root_sample()
 
     @property
     def preferred_ordering(self):
@@ -992,7 +1181,7 @@ class SAG(models.Model):
         ]
 
 
-class DNAFromPureCulture(IndexByGroup):
+class DNAFromPureCulture(LineageObject, IndexByGroup):
     extracted_dna = models.ForeignKey(ExtractedDNA)
     concentration = models.DecimalField(u"Concentration (mol L\u207B\u00B9)",
                                         max_length=100, max_digits=10,
@@ -1001,7 +1190,8 @@ class DNAFromPureCulture(IndexByGroup):
     uid = models.CharField("UID", max_length=30, unique=True, default="Automatically generated",
         help_text="UID consists of the sample UID followed by A_Z and count [01-99] i.e. 10Y31A_Z01")
 
-    group_id_keyword = "extracted_dna__sample__id"
+    group_field = "root_sample"
+    lineage_parents = ('extracted_dna', )
     character_list = ["%02d" % i for i in range(1, 100)]  # [01-99]
 
     objects = UIDManager()
@@ -1015,12 +1205,12 @@ class DNAFromPureCulture(IndexByGroup):
 
     @property
     def group(self):
-        return self.extracted_dna.sample
+        return self.get_root_sample()
 
     def save(self):
         """Stores UID on save"""
         if self.pk is None:
-            self.index_by_group = self.calc_index_by_group()
+            self.set_index_by_group()
             self.uid = self.group.uid + "A_Z" + self.index_to_naming_scheme()
         super(DNAFromPureCulture, self).save()
 
@@ -1039,9 +1229,10 @@ class DNAFromPureCulture(IndexByGroup):
 
     class Meta:
         verbose_name = "DNA from pure culture"
+        index_together = [('root_sample', 'index_by_group')]
 
 
-class DNALibrary(CreatedByUser, StorablePhysicalObject, IndexByGroup):
+class DNALibrary(CreatedByUser, StorablePhysicalObject, LineageObject, IndexByGroup):
     amplicon = models.ForeignKey(Amplicon, blank=True, null=True)
     metagenome = models.ForeignKey(Metagenome, blank=True, null=True)
     sag = models.ForeignKey(SAG, null=True, blank=True, verbose_name="SAG")
@@ -1055,57 +1246,61 @@ class DNALibrary(CreatedByUser, StorablePhysicalObject, IndexByGroup):
                                         max_length=100, max_digits=10,
                                         decimal_places=5)
 
-    protocol = models.ForeignKey(Protocol)
+    protocol = ReferenceForeignKey(Protocol)
     date = models.DateTimeField(default=timezone.now, blank=True)
     uid = models.CharField("UID", max_length=30, unique=True, default="Automatically generated",
         help_text="UID consists of the UID of the Amplicon, Metagenome, DNAFromPureCulture or SAG followed by a character [A-Z] i.e. AMZNGA_Y01A")
 
     character_list = [chr(ord('A') + i) for i in range(26)]  # [A-Z]
+    lineage_parents = ('amplicon', 'metagenome', 'sag', 'pure_culture')
+    # The foreign keys to the DNA sources with their dna_type, in order of
+    # precedence. Exactly one of them should be set.
+    dna_sources = (('amplicon', "Amplicon"),
+                   ('sag', "SAG"),
+                   ('pure_culture', "Pure DNA"),
+                   ('metagenome', "Metagenome"))
 
     objects = UIDManager()
 
     def natural_key(self):
         return (self.uid, )
 
+    def get_dna_source_fields(self):
+        """Returns the names of the DNA source foreign keys that are set"""
+        return [name for (name, dna_type) in self.dna_sources
+                if getattr(self, name + "_id") is not None]
+
     @property
     def dna_type(self):
-        if self.amplicon:
-            return "Amplicon"
-        elif self.sag:
-            return "SAG"
-        elif self.pure_culture:
-            return "Pure DNA"
-        elif self.metagenome:
-            return "Metagenome"
-        else:
+        fields = self.get_dna_source_fields()
+        if not fields:
             raise(Exception("No DNA source specified."))
+        return dict(self.dna_sources)[fields[0]]
 
     @property
-    def group_id_keyword(self):
-        return {"Amplicon"  : "amplicon__id",
-                "SAG"       : "sag__id",
-                "Pure DNA"  : "pure_culture__id",
-                "Metagenome": "metagenome__id"}[self.dna_type]
+    def group_field(self):
+        fields = self.get_dna_source_fields()
+        if not fields:
+            raise(Exception("No DNA source specified."))
+        return fields[0]
 
     @property
     def sample(self):
-        return self.group.sample
+        return self.get_root_sample()
 
     @property
     def group(self):
-        return self.amplicon or self.sag or self.pure_culture or self.metagenome
+        fields = self.get_dna_source_fields()
+        return getattr(self, fields[0]) if fields else None
 
     @property
     def barcode(self):
         return "DL:" + str(self.uid)
 
     def save(self):
-        if sum((bool(self.amplicon),
-                bool(self.metagenome),
-                bool(self.sag),
-                bool(self.pure_culture))) == 1:
+        if len(self.get_dna_source_fields()) == 1:
             if self.pk is None:
-                self.index_by_group = self.calc_index_by_group()
+                self.set_index_by_group()
                 self.uid = self.group.uid + self.index_to_naming_scheme()
             super(DNALibrary, self).save()
         else:
@@ -1114,10 +1309,7 @@ class DNALibrary(CreatedByUser, StorablePhysicalObject, IndexByGroup):
                             "more than one"))
 
     def clean(self):
-        if sum((bool(self.amplicon),
-                bool(self.metagenome),
-                bool(self.sag),
-                bool(self.pure_culture))) != 1:
+        if len(self.get_dna_source_fields()) != 1:
             error_msg = """You have to specify a DNA source from either
             Amplicon, Metagenome, SAG or Pure culture and not more than one."""
             raise(ValidationError({"amplicon": [error_msg, ],
@@ -1130,6 +1322,10 @@ class DNALibrary(CreatedByUser, StorablePhysicalObject, IndexByGroup):
     class Meta:
         verbose_name = "DNA library"
         verbose_name_plural = verbose_name[:-1] + "ies"
+        index_together = [('amplicon', 'index_by_group'),
+                          ('metagenome', 'index_by_group'),
+                          ('sag', 'index_by_group'),
+                          ('pure_culture', 'index_by_group')]
 
     def __unicode__(self):
         return unicode("%s") % (self.uid)
@@ -1145,7 +1341,7 @@ class DNALibrary(CreatedByUser, StorablePhysicalObject, IndexByGroup):
             'i5',
             'sample_name_on_platform',
             'protocol',
-            'container',
+            'storage_path',
             'dna_type',
             'group',
         ]
@@ -1159,7 +1355,7 @@ class SequencingRun(models.Model):
     folder = models.CharField(max_length=100)
     notes = models.TextField()
     dna_library = models.ManyToManyField(DNALibrary)
-    protocol = models.ForeignKey(Protocol)
+    protocol = ReferenceForeignKey(Protocol)
     date = models.DateTimeField(default=timezone.now, blank=True)
 
     objects = UIDManager()
@@ -1176,7 +1372,7 @@ class SequencingRun(models.Model):
         return [f.attname for f in self._meta.fields]
 
 
-class ReadFile(models.Model):
+class ReadFile(LineageObject):
     folder = models.CharField(max_length=100)
     filename = models.CharField(max_length=100)
     pair = models.PositiveIntegerField(choices=((1, 1), (2, 2)))
@@ -1186,11 +1382,111 @@ class ReadFile(models.Model):
     sequencing_run = models.ForeignKey(SequencingRun)
     date = models.DateTimeField(default=timezone.now, blank=True)
 
+    lineage_parents = ('dna_library', )
+
     @property
     def preferred_ordering(self):
         """Returns an ordered list of attribute names"""
         return [f.attname for f in self._meta.fields]
 
+    class Meta:
+        # Keyset pagination of the lineage export
+        index_together = [('date', 'id')]
+
+
+# Models derived from a Sample, parents before children
+LINEAGE_MODELS = [ExtractedCell, ExtractedDNA, SAGPlate, SAGPlateDilution,
+                  Metagenome, Amplicon, SAG, DNAFromPureCulture, DNALibrary,
+                  ReadFile]
+
+
+def update_descendant_root_samples(model, queryset, root_sample_id):
+    """Sets root_sample of all descendants of the objects in queryset of the
+    given model, with one UPDATE per descendant model"""
+    for child in LINEAGE_MODELS:
+        for name in child.lineage_parents:
+            if child._meta.get_field(name).rel.to is model:
+                children = child.objects.filter(**{name + "__in": queryset})
+                children.update(root_sample=root_sample_id)
+                update_descendant_root_samples(child, children, root_sample_id)
+
+
+def backfill_root_samples():
+    """Recomputes root_sample of all lineage objects with one UPDATE per
+    parent foreign key, parents before children. Returns the number of
+    updated rows."""
+    qn = connection.ops.quote_name
+    nr_updated = 0
+    with transaction.atomic():
+        cursor = connection.cursor()
+        for model in LINEAGE_MODELS:
+            table = qn(model._meta.db_table)
+            for name in model.lineage_parents:
+                field = model._meta.get_field(name)
+                if field.rel.to is Sample:
+                    value = qn(field.column)
+                else:
+                    parent_table = qn(field.rel.to._meta.db_table)
+                    value = "(SELECT %s.%s FROM %s WHERE %s.%s = %s.%s)" % (
+                        parent_table, qn('root_sample_id'), parent_table,
+                        parent_table, qn(field.rel.to._meta.pk.column), table,
+                        qn(field.column))
+                cursor.execute("UPDATE %s SET %s = %s WHERE %s IS NOT NULL" % (
+                    table, qn('root_sample_id'), value, qn(field.column)))
+                nr_updated += cursor.rowcount
+    return nr_updated
+
+
+# Prefix of the barcode property of each model
+BARCODE_PREFIXES = {
+    "AM": Amplicon,
+    "SA": Sample,
+    "CO": Container,
+    "EC": ExtractedCell,
+    "ED": ExtractedDNA,
+    "SP": SAGPlate,
+    "SD": SAGPlateDilution,
+    "DL": DNALibrary,
+}
+
+
+def parse_barcode(barcode):
+    """Returns (model, lookup) for a barcode such as SA:10Y31 or CO:000012,
+    where lookup are the keyword arguments of an exact query on an indexed
+    column. Returns None if barcode is not a valid barcode."""
+    prefix, sep, value = barcode.strip().partition(":")
+    model = BARCODE_PREFIXES.get(prefix.upper())
+    if not sep or not value or model is None:
+        return None
+    if model is Container:
+        return (model, {'pk': int(value)}) if value.isdigit() else None
+    return model, {'uid': value}
+
+
+def get_containers(barcodes):
+    """Returns the Containers with the given barcodes, e.g. CO:000012, in the
+    same order. Raises an Exception for an unknown barcode."""
+    containers = []
+    for barcode in barcodes:
+        parsed = parse_barcode(barcode)
+        if parsed is None or parsed[0] is not Container:
+            raise(Exception("%s is not a container barcode" % barcode))
+        try:
+            containers.append(Container.objects.get(**parsed[1]))
+        except Container.DoesNotExist:
+            raise(Exception("No container with barcode %s" % barcode))
+    return containers
+
+
+class ReferenceDataVersion(models.Model):
+    """Version of a reference table, incremented on every change so all
+    processes can drop their cached copy, see lims.refcache"""
+    model = models.CharField(max_length=100, unique=True)
+    version = models.PositiveIntegerField(default=0)
+
+    def __unicode__(self):
+        return unicode("%s %d" % (self.model, self.version))
+
 
 class UserProfile(AbstractUser):
     #username = models.CharField(max_length=30, unique=True)
@@ -1198,3 +1494,26 @@ class UserProfile(AbstractUser):
 
     #USERNAME_FIELD = 'username'
     #REQUIRED_FIELDS = ['']
+
+
+ADMIN_LOG_SQL = os.path.join(os.path.dirname(__file__), 'sql', 'django_admin_log.sql')
+
+
+def create_admin_log_indexes(sender, created_models, **kwargs):
+    """Creates the indexes of ADMIN_LOG_SQL after syncdb (or flush) when the
+    admin LogEntry table has no index on action_time yet"""
+    if LogEntry not in created_models:
+        return
+    cursor = connection.cursor()
+    if 'action_time' in connection.introspection.get_indexes(
+            cursor, LogEntry._meta.db_table):
+        return
+    with open(ADMIN_LOG_SQL) as f:
+        sql = "\n".join(l for l in f if not l.startswith("--"))
+    for statement in sql.split(";"):
+        if statement.strip():
+            cursor.execute(statement)
+
+
+post_syncdb.connect(create_admin_log_indexes, sender=admin_models,
+                    dispatch_uid="lims.models.create_admin_log_indexes")
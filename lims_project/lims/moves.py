@@ -0,0 +1,158 @@
+"""Moves of many Containers at once: a subtree to another
+ApparatusSubdivision, containers to another parent and the wells of plates
+between a 384 well plate and four 96 well plates. Each move checks the
+positions with a query or two and then runs set-based UPDATEs, one per
+IN_CHUNK_SIZE containers or per quadrant, in a transaction, instead of a
+Container.save per container. Only the root of a subtree refers to its
+location (see Container), so moving a subtree updates its root only, and the
+storage paths of lims.storage follow the new parents without further
+bookkeeping. save() is not called and no signals are sent."""
+from __future__ import print_function
+
+from django.db import transaction
+from django.db.models import F, Max
+
+from lims.bulk import bulk_update
+from lims.models import Container
+from lims.storage import IN_CHUNK_SIZE, fetch_ancestors, position_label
+
+# (row offset, column offset) of the wells of the four quadrants of a 384
+# well plate, in the order of lims.worklists.quadrants: A01, A02, B01, B02
+QUADRANT_OFFSETS = ((0, 0), (0, 1), (1, 0), (1, 1))
+PLATE_96 = (8, 12)
+PLATE_384 = (16, 24)
+
+
+def _ids(containers):
+    return sorted(set(getattr(c, 'pk', c) for c in containers))
+
+
+def _chunks(ids):
+    return [ids[i:i + IN_CHUNK_SIZE] for i in range(0, len(ids), IN_CHUNK_SIZE)]
+
+
+def move_to_subdivision(containers, subdivision):
+    """Moves the given Containers (or ids) with everything in them to the
+    ApparatusSubdivision subdivision. Containers in a parent become root
+    containers. Returns the number of moved containers."""
+    moved = 0
+    with transaction.atomic():
+        for ids in _chunks(_ids(containers)):
+            moved += Container.objects.filter(pk__in=ids).update(
+                parent=None, row=None, column=None,
+                apparatus_subdivision=subdivision)
+    return moved
+
+
+def _check_positions(positions, parent, moved_ids):
+    """Raises an Exception if two of the (row, column) by container id in
+    positions are equal or one is taken by a child of parent that is not
+    moved"""
+    taken = {}
+    for pk, row, column in Container.objects.filter(parent=parent) \
+            .exclude(row=None).exclude(column=None) \
+            .values_list('id', 'row', 'column'):
+        if pk not in moved_ids:
+            taken[(row, column)] = pk
+    for pk, (row, column) in sorted(positions.items()):
+        if row is None or column is None:
+            continue
+        if (row, column) in taken:
+            raise(Exception("Position %s of %s is taken by %s" % (
+                position_label(Container(row=row, column=column)), parent,
+                Container(pk=taken[(row, column)]).barcode)))
+        taken[(row, column)] = pk
+
+
+def reparent(containers, parent, positions=None):
+    """Moves the given Containers (or ids) with everything in them into the
+    Container parent. positions is a dictionary of the new (row, column) by
+    container id, containers that are not in it keep theirs. Raises an
+    Exception if a position is taken or parent is inside one of the
+    containers. Returns the number of moved containers."""
+    ids = _ids(containers)
+    positions = dict(positions or {})
+    with transaction.atomic():
+        if set(ids) & set(fetch_ancestors([parent.pk])):
+            raise(Exception("Can't move a container into itself"))
+        objs = []
+        for chunk in _chunks(ids):
+            objs += Container.objects.filter(pk__in=chunk).only('row', 'column')
+        for c in objs:
+            c.row, c.column = positions.get(c.pk, (c.row, c.column))
+            c.parent_id = parent.pk
+            c.apparatus_subdivision_id = None
+        _check_positions(dict((c.pk, (c.row, c.column)) for c in objs), parent,
+                         set(ids))
+        if positions:
+            return bulk_update(Container, objs, ['parent', 'apparatus_subdivision',
+                                                 'row', 'column'])
+        moved = 0
+        for chunk in _chunks(ids):
+            moved += Container.objects.filter(pk__in=chunk).update(
+                parent=parent, apparatus_subdivision=None)
+        return moved
+
+
+def _extent(plate):
+    """Returns the largest row and column of the wells of plate"""
+    extent = Container.objects.filter(parent=plate).aggregate(Max('row'),
+                                                              Max('column'))
+    return extent['row__max'] or 0, extent['column__max'] or 0
+
+
+def _check_empty(plate):
+    if Container.objects.filter(parent=plate).exists():
+        raise(Exception("%s already has wells" % plate))
+
+
+def consolidate_quadrants(plates, destination):
+    """Moves the wells of up to four 96 well plates into the quadrants of the
+    384 well plate destination, the first plate to the quadrant of A01, the
+    second to that of A02, the third to B01 and the fourth to B02. None skips
+    a quadrant. destination should have no wells. Returns the number of moved
+    wells."""
+    if len(plates) > len(QUADRANT_OFFSETS):
+        raise(Exception("A 384 well plate has four quadrants"))
+    moved = 0
+    with transaction.atomic():
+        _check_empty(destination)
+        for plate, (row_offset, column_offset) in zip(plates, QUADRANT_OFFSETS):
+            if plate is None:
+                continue
+            rows, columns = _extent(plate)
+            if rows > PLATE_96[0] or columns > PLATE_96[1]:
+                raise(Exception("%s has wells beyond H12" % plate))
+            moved += Container.objects.filter(parent=plate).update(
+                parent=destination, apparatus_subdivision=None,
+                row=F('row') * 2 - 1 + row_offset,
+                column=F('column') * 2 - 1 + column_offset)
+    return moved
+
+
+def split_quadrants(plate, destinations):
+    """Moves the wells of the quadrants of the 384 well plate plate into up to
+    four 96 well plates, the reverse of consolidate_quadrants. None skips a
+    quadrant, its wells stay on plate. The destinations should have no wells.
+    Returns the number of moved wells."""
+    if len(destinations) > len(QUADRANT_OFFSETS):
+        raise(Exception("A 384 well plate has four quadrants"))
+    moved = 0
+    with transaction.atomic():
+        rows, columns = _extent(plate)
+        if rows > PLATE_384[0] or columns > PLATE_384[1]:
+            raise(Exception("%s has wells beyond P24" % plate))
+        for destination, (row_offset, column_offset) in zip(destinations,
+                                                            QUADRANT_OFFSETS):
+            if destination is None:
+                continue
+            _check_empty(destination)
+            # (row + 1 - offset) is even, so the division is exact everywhere
+            moved += Container.objects.filter(
+                parent=plate,
+                row__in=range(1 + row_offset, PLATE_384[0] + 1, 2),
+                column__in=range(1 + column_offset, PLATE_384[1] + 1, 2)).update(
+                parent=destination, apparatus_subdivision=None,
+                row=(F('row') + 1 - row_offset) / 2,
+                column=(F('column') + 1 - column_offset) / 2)
+    return moved
@@ -0,0 +1,185 @@
+"""Equimolar pooling of DNA libraries, e.g. those of a SequencingRun. Every
+library contributes the same amount, target molarity * target volume / number
+of libraries, so its volume is that amount divided by its concentration.
+Concentrations and the target molarity are in the unit of
+DNALibrary.concentration, volumes in microliters. Volumes below the minimum
+volume a pipette can handle get an intermediate dilution of the library, made
+in a well of a dilution plate from the minimum volume of the library and
+buffer. The pool is completed with buffer to the target volume.
+
+The libraries and their well positions are fetched with a query per 500
+libraries, so thousands of libraries are pooled in one call."""
+from __future__ import print_function
+from collections import namedtuple
+
+from lims.metadata import model_metadata
+from lims.models import Container, DNALibrary, SequencingRun
+from lims.storage import IN_CHUNK_SIZE, position_label
+from lims.worklists import Transfer, well_position, format_volume
+
+# Microliters
+MIN_VOLUME = 0.5
+# Intermediate dilutions that are suggested, the smallest sufficient is used
+DILUTION_FACTORS = (2, 5, 10, 20, 50, 100, 200, 500, 1000)
+POOL_PLATE = "Pool"
+POOL_WELL = "A01"
+BUFFER_PLATE = "Buffer"
+BUFFER_WELL = "A01"
+# Intermediate dilutions are made in the wells of this 96 well plate, by
+# column: A01, B01, ..., H01, A02, ...
+DILUTION_PLATE = "Dilutions"
+DILUTION_WELLS = 96
+
+# A library in the pool. volume is the volume of the library after diluting it
+# dilution_factor times, None if the library can't be pooled, see error.
+PoolEntry = namedtuple('PoolEntry', ['library', 'concentration', 'volume',
+                                     'dilution_factor', 'source_plate',
+                                     'source_well', 'error'])
+Pool = namedtuple('Pool', ['entries', 'target_molarity', 'target_volume',
+                           'buffer_volume', 'min_volume'])
+
+
+def dilution_factor(volume, min_volume=MIN_VOLUME):
+    """Returns the smallest of DILUTION_FACTORS that makes volume at least
+    min_volume, 1 if volume is large enough and None if none suffices"""
+    if volume >= min_volume:
+        return 1
+    for factor in DILUTION_FACTORS:
+        if volume * factor >= min_volume:
+            return factor
+    return None
+
+
+def library_positions(libraries):
+    """Returns the (plate barcode, well) by pk of the DNALibraries that are
+    stored in a Container, the Container with the lowest id if there are
+    several"""
+    ids = sorted(library.pk for library in libraries)
+    positions = {}
+    for i in range(0, len(ids), IN_CHUNK_SIZE):
+        containers = Container.objects.filter(
+            content_type=model_metadata(DNALibrary).content_type_id,
+            object_id__in=ids[i:i + IN_CHUNK_SIZE]).select_related('parent') \
+            .order_by('-id')
+        for container in containers:
+            positions[container.object_id] = well_position(container)
+    return positions
+
+
+def pool_libraries(libraries, target_molarity, target_volume,
+                   min_volume=MIN_VOLUME):
+    """Returns the Pool of the given DNALibraries or of the libraries of a
+    SequencingRun"""
+    if isinstance(libraries, SequencingRun):
+        libraries = libraries.dna_library.all()
+    libraries = list(libraries.order_by('id') if hasattr(libraries, 'order_by')
+                     else libraries)
+    positions = library_positions(libraries) if libraries else {}
+    amount = float(target_molarity) * target_volume / len(libraries) \
+        if libraries else 0.0
+
+    entries = []
+    for library in libraries:
+        plate, well = positions.get(library.pk, (None, None))
+        concentration = float(library.concentration or 0)
+        volume = factor = error = None
+        if concentration <= 0:
+            error = "no concentration"
+        else:
+            factor = dilution_factor(amount / concentration, min_volume)
+            if factor is None:
+                error = "too concentrated, dilute more than %d times" % \
+                    DILUTION_FACTORS[-1]
+            else:
+                volume = amount / concentration * factor
+        if error is None and plate is None:
+            error = "not stored in a well"
+        entries.append(PoolEntry(library, concentration, volume, factor,
+                                 plate, well, error))
+
+    buffer_volume = target_volume - sum(e.volume for e in entries
+                                        if e.volume is not None)
+    return Pool(entries, target_molarity, target_volume, buffer_volume,
+                min_volume)
+
+
+def nr_dilutions(pool):
+    """Returns the number of intermediate dilutions of the worklist of pool"""
+    return sum(e.error is None and e.dilution_factor > 1 for e in pool.entries)
+
+
+def is_feasible(pool):
+    """Whether all libraries can be pooled, their volumes fit in the target
+    volume and their dilutions on the dilution plate"""
+    return pool.buffer_volume >= 0 and \
+        all(e.error is None for e in pool.entries) and \
+        nr_dilutions(pool) <= DILUTION_WELLS
+
+
+def format_report(pool):
+    """Returns the lines of the pooling report"""
+    lines = ["%-20s %14s %10s %10s %-12s %-5s %s" % (
+        "library", "concentration", "volume", "dilution", "plate", "well",
+        "problem")]
+    for e in pool.entries:
+        lines.append("%-20s %14.3f %10s %10s %-12s %-5s %s" % (
+            e.library.uid, e.concentration,
+            format_volume(e.volume) if e.volume is not None else "-",
+            "1:%d" % e.dilution_factor if e.dilution_factor else "-",
+            e.source_plate or "-", e.source_well or "-", e.error or ""))
+    lines.append("")
+    lines.append("%d libraries to %s in %s ul, buffer %s ul" % (
+        len(pool.entries), pool.target_molarity, format_volume(pool.target_volume),
+        format_volume(pool.buffer_volume)))
+    if pool.buffer_volume < 0:
+        lines.append("The libraries don't fit in the target volume, lower the "
+                     "target molarity or increase the target volume.")
+    dilutions = [e for e in pool.entries if (e.dilution_factor or 1) > 1]
+    if dilutions:
+        lines.append("Dilute %d libraries first as listed, 1:10 is e.g. %s ul "
+                     "library with %s ul buffer. Their volumes are those of "
+                     "the dilution." % (len(dilutions),
+                                        format_volume(pool.min_volume),
+                                        format_volume(pool.min_volume * 9)))
+    if nr_dilutions(pool) > DILUTION_WELLS:
+        lines.append("The %d dilutions don't fit on a %d well dilution plate, "
+                     "increase the target volume or dilute libraries beforehand."
+                     % (nr_dilutions(pool), DILUTION_WELLS))
+    return lines
+
+
+def dilution_well(number):
+    """Returns the well of the dilution plate of the dilution with the given
+    number, counted from 0 by column. Raises an Exception if the plate has no
+    such well."""
+    if not 0 <= number < DILUTION_WELLS:
+        raise(Exception("Dilution %d doesn't fit on a %d well plate" %
+                        (number + 1, DILUTION_WELLS)))
+    return position_label(Container(row=number % 8 + 1, column=number // 8 + 1))
+
+
+def pool_worklist(pool, destination_plate=POOL_PLATE, destination_well=POOL_WELL):
+    """Returns the Transfers of the libraries that can be pooled to the
+    destination well. Libraries that need a dilution are first diluted in a
+    well of DILUTION_PLATE, min_volume of the library with buffer from
+    BUFFER_PLATE, and pooled from there. The buffer that completes the pool
+    comes last."""
+    dilutions = []
+    transfers = []
+    for e in pool.entries:
+        if e.error is not None:
+            continue
+        plate, well = e.source_plate, e.source_well
+        if e.dilution_factor > 1:
+            plate, well = DILUTION_PLATE, dilution_well(len(dilutions) // 2)
+            dilutions += [
+                Transfer(e.source_plate, e.source_well, plate, well,
+                         pool.min_volume),
+                Transfer(BUFFER_PLATE, BUFFER_WELL, plate, well,
+                         pool.min_volume * (e.dilution_factor - 1))]
+        transfers.append(Transfer(plate, well, destination_plate,
+                                  destination_well, e.volume))
+    if transfers and pool.buffer_volume > 0:
+        transfers.append(Transfer(BUFFER_PLATE, BUFFER_WELL, destination_plate,
+                                  destination_well, pool.buffer_volume))
+    return dilutions + transfers
@@ -0,0 +1,230 @@
+"""Read statistics of FASTQ files: number of reads, number of bases and the
+MD5 checksum of the file as stored on disk. Files are streamed once in large
+blocks, in parallel over a pool of processes. Results are cached per file
+keyed by path, size and modification time so unchanged files are only read
+once. A file that can't be read, e.g. a missing or truncated one, is reported
+without stopping the others, and the statistics computed so far are always
+saved to the cache."""
+from __future__ import print_function
+import os
+import json
+import zlib
+import hashlib
+from collections import namedtuple
+from multiprocessing import Pool
+
+from django.conf import settings
+from django.db import connection
+
+from lims.bulk import bulk_update
+from lims.models import ReadFile
+
+
+ReadStats = namedtuple('ReadStats', ['read_count', 'base_count', 'md5'])
+
+# Read size used when streaming FASTQ files
+FASTQ_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class _GzipStream(object):
+    """Incremental decompressor for (multi-member) gzip data, e.g. as written
+    by bgzip or by concatenating gzipped FASTQ files."""
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        out = [self.decompressor.decompress(data)]
+        while self.decompressor.unused_data:
+            unused = self.decompressor.unused_data
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            out.append(self.decompressor.decompress(unused))
+        return b"".join(out)
+
+    def flush(self):
+        """Returns the remaining data, raises an IOError if the last member
+        is truncated"""
+        # Data after a complete member ends up in unused_data, a truncated
+        # member consumes it
+        probe = self.decompressor.copy()
+        probe.decompress(b"\0")
+        if not probe.unused_data:
+            raise(IOError("Truncated gzip file"))
+        return self.decompressor.flush()
+
+
+class _FastqCounter(object):
+    """Counts reads and bases over FASTQ data fed in arbitrary blocks. Every
+    fourth line starting at the second one is a sequence line."""
+    def __init__(self):
+        self.nr_lines = 0
+        self.base_count = 0
+        self.partial = b""
+
+    def feed(self, data):
+        lines = (self.partial + data).split(b"\n")
+        self.partial = lines.pop()
+        first_seq = (1 - self.nr_lines) % 4
+        self.base_count += sum(len(l.rstrip(b"\r")) for l in lines[first_seq::4])
+        self.nr_lines += len(lines)
+
+    def close(self):
+        if self.partial:
+            self.feed(b"\n")
+        return self.nr_lines // 4, self.base_count
+
+
+def fastq_stats(path):
+    """Returns the ReadStats of a plain or gzipped FASTQ file"""
+    md5 = hashlib.md5()
+    counter = _FastqCounter()
+    stream = _GzipStream() if path.endswith(".gz") else None
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(FASTQ_BUFFER_SIZE)
+            if not block:
+                break
+            md5.update(block)
+            counter.feed(stream.decompress(block) if stream else block)
+    if stream:
+        counter.feed(stream.flush())
+    read_count, base_count = counter.close()
+    return ReadStats(read_count, base_count, md5.hexdigest())
+
+
+class ReadStatsError(Exception):
+    """Raised when files can't be read, errors is the message by path"""
+    def __init__(self, errors):
+        self.errors = errors
+        super(ReadStatsError, self).__init__(
+            "Can't read %d file(s): %s" % (len(errors), "; ".join(
+                "%s: %s" % (p, e) for (p, e) in sorted(errors.items()))))
+
+
+def _path_stats(path):
+    """Returns (path, ReadStats, None), or (path, None, error message) if the
+    file can't be read"""
+    try:
+        return path, fastq_stats(path), None
+    except (IOError, OSError, zlib.error, EOFError) as e:
+        return path, None, str(e)
+
+
+class ReadStatsCache(object):
+    """JSON file with the ReadStats per file. Entries are keyed by absolute
+    path, size and modification time, so a changed file is never served from
+    the cache."""
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def key(path):
+        st = os.stat(path)
+        return "%s|%d|%d" % (os.path.abspath(path), st.st_size, int(st.st_mtime))
+
+    def get(self, path):
+        entry = self.entries.get(self.key(path))
+        return ReadStats(*entry) if entry is not None else None
+
+    def set(self, path, stats):
+        self.entries[self.key(path)] = list(stats)
+
+    def save(self):
+        """Write the cache atomically so an interrupted run can't corrupt it"""
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f)
+        os.rename(tmp, self.path)
+
+
+def default_cache():
+    """Returns the ReadStatsCache at settings.LIMS_READSTATS_CACHE, or None if
+    that setting is None."""
+    path = getattr(settings, 'LIMS_READSTATS_CACHE', None)
+    return ReadStatsCache(path) if path else None
+
+
+def compute_read_stats(paths, processes=None, cache=None, errors=None):
+    """Returns a dictionary with the ReadStats of each path. Files not in the
+    cache are read by a pool of processes and added to the cache, which is
+    saved even if the run is interrupted. The error messages of files that
+    can't be read are added by path to the errors dictionary if given, and
+    raised as a ReadStatsError otherwise, after all other files are read.
+    Reading in parallel closes the database connection, so it can't be done
+    inside a transaction."""
+    stats = {}
+    failed = {}
+    todo = []
+    for path in set(paths):
+        try:
+            cached = cache.get(path) if cache is not None else None
+        except OSError:
+            # Missing file, reported by _path_stats
+            cached = None
+        if cached is None:
+            todo.append(path)
+        else:
+            stats[path] = cached
+
+    pool = None
+    computed = 0
+    try:
+        if len(todo) <= 1 or processes == 1:
+            results = (_path_stats(p) for p in todo)
+        else:
+            # Forked workers should not share the database connection
+            if connection.in_atomic_block:
+                raise(Exception("Can't read files in parallel inside a "
+                                "transaction, use processes=1"))
+            connection.close()
+            pool = Pool(processes)
+            results = pool.imap_unordered(_path_stats, todo, chunksize=1)
+        for path, s, error in results:
+            if error is not None:
+                failed[path] = error
+                continue
+            stats[path] = s
+            computed += 1
+            if cache is not None:
+                cache.set(path, s)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if cache is not None and computed:
+            cache.save()
+
+    if failed:
+        if errors is None:
+            raise(ReadStatsError(failed))
+        errors.update(failed)
+    return stats
+
+
+def read_file_path(read_file):
+    return os.path.join(read_file.folder, read_file.filename)
+
+
+def update_read_counts(read_files, processes=None, cache=None, errors=None):
+    """Computes the ReadStats of the FASTQ file of each ReadFile and writes
+    changed read_counts to the database in bulk. Returns a list of
+    (ReadFile, ReadStats) pairs. Files that can't be read are handled as in
+    compute_read_stats, with errors the ReadFiles are left out."""
+    read_files = list(read_files)
+    stats = compute_read_stats([read_file_path(rf) for rf in read_files],
+                               processes, cache, errors)
+    changed = []
+    result = []
+    for rf in read_files:
+        s = stats.get(read_file_path(rf))
+        if s is None:
+            continue
+        result.append((rf, s))
+        if rf.read_count != s.read_count:
+            rf.read_count = s.read_count
+            changed.append(rf)
+    bulk_update(ReadFile, changed, ['read_count'])
+    return result
@@ -0,0 +1,145 @@
+"""In-process cache of the reference tables: small, rarely changing tables
+like Protocol, SampleType and Apparatus, marked with reference_data = True on
+the model. Each table is loaded with one query when first used and then
+serves foreign key lookups through ReferenceForeignKey, so rendering e.g. the
+sample type of many samples needs no queries.
+
+Every save or delete of a reference object bumps the version of its table in
+ReferenceDataVersion. Each process compares the versions of the tables it
+has loaded once per request (one query) and drops the tables that changed.
+Tables are not loaded inside a transaction (atomic block), as the cache
+could otherwise keep rows that are rolled back; lookups in a transaction
+query the database when the table is not loaded yet. Cached objects are
+shared, treat them as read-only."""
+from __future__ import print_function
+import threading
+
+from django.core.signals import request_started
+from django.db import connection, transaction, IntegrityError
+from django.db.models import F, ForeignKey
+from django.db.models.fields.related import ReverseSingleRelatedObjectDescriptor
+from django.db.models.signals import post_save, post_delete
+
+
+def is_reference_model(model):
+    return getattr(model, 'reference_data', False)
+
+
+def version_key(model):
+    return "%s.%s" % (model._meta.app_label, model._meta.model_name)
+
+
+class ReferenceCache(object):
+    """Thread safe cache of the rows of reference tables, see the module
+    documentation"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # model -> (version, {pk: object}, [objects in default ordering])
+            self.tables = {}
+
+    def invalidate(self, model):
+        with self.lock:
+            self.tables.pop(model, None)
+
+    def table(self, model):
+        """Returns the (version, by pk, objects) of model, loading it if
+        needed. Returns None inside a transaction if it isn't loaded."""
+        table = self.tables.get(model)
+        if table is not None or connection.in_atomic_block:
+            return table
+        from lims.models import ReferenceDataVersion
+        # The version is read first, a change in between only causes another
+        # reload on the next check
+        version = ReferenceDataVersion.objects.filter(
+            model=version_key(model)).values_list('version', flat=True).first() or 0
+        objects = list(model._default_manager.all())
+        table = (version, dict((o.pk, o) for o in objects), objects)
+        with self.lock:
+            self.tables[model] = table
+        return table
+
+    def get(self, model, pk):
+        """Returns the cached object of model with the given pk, None if it
+        is not cached"""
+        table = self.table(model)
+        return table[1].get(pk) if table is not None else None
+
+    def all(self, model):
+        """Returns all objects of model, from the cache if possible"""
+        table = self.table(model)
+        return list(table[2]) if table is not None else \
+            list(model._default_manager.all())
+
+    def check_versions(self):
+        """Drops the tables that changed in the database since they were
+        loaded, with one query"""
+        if not self.tables:
+            return
+        from lims.models import ReferenceDataVersion
+        versions = dict(ReferenceDataVersion.objects.values_list('model', 'version'))
+        with self.lock:
+            for model, table in self.tables.items():
+                if versions.get(version_key(model), 0) != table[0]:
+                    del self.tables[model]
+
+
+cache = ReferenceCache()
+
+
+def bump_version(model):
+    """Increments the version of the table of model in the database"""
+    from lims.models import ReferenceDataVersion
+    key = version_key(model)
+    with transaction.atomic():
+        if ReferenceDataVersion.objects.filter(model=key).update(
+                version=F('version') + 1):
+            return
+        try:
+            with transaction.atomic():
+                ReferenceDataVersion.objects.create(model=key, version=1)
+        except IntegrityError:
+            # Created concurrently
+            ReferenceDataVersion.objects.filter(model=key).update(
+                version=F('version') + 1)
+
+
+class ReferenceObjectDescriptor(ReverseSingleRelatedObjectDescriptor):
+    """Looks up the related object in the reference cache before querying
+    the database"""
+    def __get__(self, instance, instance_type=None):
+        if instance is not None:
+            cache_name = self.field.get_cache_name()
+            pk = getattr(instance, self.field.attname)
+            if pk is not None and not hasattr(instance, cache_name):
+                obj = cache.get(self.field.rel.to, pk)
+                if obj is not None:
+                    setattr(instance, cache_name, obj)
+        return super(ReferenceObjectDescriptor, self).__get__(instance, instance_type)
+
+
+class ReferenceForeignKey(ForeignKey):
+    """ForeignKey to a reference data model, resolved from the reference
+    cache. The database column is the same as that of a ForeignKey."""
+    def contribute_to_class(self, cls, name, *args, **kwargs):
+        super(ReferenceForeignKey, self).contribute_to_class(cls, name, *args, **kwargs)
+        setattr(cls, self.name, ReferenceObjectDescriptor(self))
+
+
+def reference_data_changed(sender, **kwargs):
+    if is_reference_model(sender):
+        cache.invalidate(sender)
+        bump_version(sender)
+
+
+def check_reference_versions(sender, **kwargs):
+    cache.check_versions()
+
+
+post_save.connect(reference_data_changed, dispatch_uid="lims.refcache.post_save")
+post_delete.connect(reference_data_changed, dispatch_uid="lims.refcache.post_delete")
+request_started.connect(check_reference_versions,
+                        dispatch_uid="lims.refcache.request_started")
@@ -0,0 +1,178 @@
+"""Illumina sample sheets of sequencing runs and the index collision check of
+their DNA libraries. Libraries are told apart by their i7 and i5 indexes when
+demultiplexing, which fails if the combined indexes of two libraries in a run
+differ in fewer than LIMS_MIN_INDEX_DISTANCE positions. The i7 and i5 indexes
+are padded separately to the longest of the run, so an i7 of another length
+does not shift the i5 positions. The Hamming distances
+of all pairs are computed with numpy if it is installed, as products of
+one-hot encoded indexes in blocks of rows, so runs of thousands of libraries
+are checked in a fraction of a second. run_index_collisions is the check of
+the libraries added to a run, used by the admin and ingest_run."""
+from __future__ import print_function
+import csv
+from collections import namedtuple
+
+from django.conf import settings
+from django.utils import timezone
+
+try:
+    import numpy
+    LIMS_NUMPY = True
+except ImportError:
+    LIMS_NUMPY = False
+
+# Default minimum number of differing positions between the combined indexes
+# of two libraries
+MIN_INDEX_DISTANCE = 3
+# Rows of the distance matrix computed at once
+BLOCK_SIZE = 256
+
+IndexCollision = namedtuple('IndexCollision', ['library1', 'library2', 'distance'])
+
+
+class IndexCollisionError(Exception):
+    """Raised when libraries with colliding indexes would be added to a
+    SequencingRun, collisions are the IndexCollisions"""
+    def __init__(self, run, collisions):
+        self.run = run
+        self.collisions = collisions
+        super(IndexCollisionError, self).__init__("; ".join(
+            "%s: %s" % (run, describe_collision(c)) for c in collisions))
+
+DATA_COLUMNS = ['Sample_ID', 'Sample_Name', 'index', 'index2',
+                'Sample_Project', 'Description']
+
+
+def min_index_distance():
+    return getattr(settings, 'LIMS_MIN_INDEX_DISTANCE', MIN_INDEX_DISTANCE)
+
+
+def combined_index(library, i7_length=0, i5_length=0):
+    """Returns the i7 and i5 index of library, each padded to the given
+    length"""
+    return library.i7.strip().upper().ljust(i7_length, "\0") + \
+        library.i5.strip().upper().ljust(i5_length, "\0")
+
+
+def encode_indexes(indexes):
+    """Returns the index strings as an uint8 array with a row per index,
+    shorter indexes are padded with zeros"""
+    length = max(len(i) for i in indexes)
+    codes = numpy.zeros((len(indexes), length), dtype=numpy.uint8)
+    for row, index in enumerate(indexes):
+        codes[row, :len(index)] = numpy.frombuffer(index.encode('ascii', 'replace'),
+                                                   dtype=numpy.uint8)
+    return codes
+
+
+def close_pairs(indexes, min_distance):
+    """Returns the (i, j, distance) of all pairs i < j of indexes that differ
+    in fewer than min_distance positions"""
+    if len(indexes) < 2:
+        return []
+    if not LIMS_NUMPY:
+        length = max(len(i) for i in indexes)
+        padded = [i.encode('ascii', 'replace').ljust(length, "\0")
+                  for i in indexes]
+        pairs = []
+        for i in range(len(padded)):
+            for j in range(i + 1, len(padded)):
+                distance = sum(a != b for (a, b) in zip(padded[i], padded[j]))
+                if distance < min_distance:
+                    pairs.append((i, j, distance))
+        return pairs
+
+    codes = encode_indexes(indexes)
+    length = codes.shape[1]
+    # One-hot encoded, the dot product of two rows is the number of equal
+    # positions, so a block of the distance matrix is a matrix product
+    onehot = (codes[:, :, None] == numpy.unique(codes)[None, None, :]) \
+        .reshape(len(codes), -1).astype(numpy.float32)
+    pairs = []
+    for start in range(0, len(codes), BLOCK_SIZE):
+        # Only the pairs with the columns from start on, i < j is checked below
+        matches = numpy.dot(onehot[start:start + BLOCK_SIZE], onehot[start:].T)
+        rows, columns = numpy.nonzero(matches > length - min_distance + 0.5)
+        for i, j in zip(rows, columns):
+            if i < j:
+                pairs.append((int(start + i), int(start + j),
+                              length - int(round(matches[i, j]))))
+    return sorted(pairs)
+
+
+def find_index_collisions(libraries, min_distance=None):
+    """Returns the IndexCollisions of the given DNALibraries whose combined
+    i7 and i5 indexes differ in fewer than min_distance positions (by default
+    the LIMS_MIN_INDEX_DISTANCE setting)"""
+    if min_distance is None:
+        min_distance = min_index_distance()
+    libraries = list(libraries)
+    if not libraries:
+        return []
+    i7_length = max(len(library.i7.strip()) for library in libraries)
+    i5_length = max(len(library.i5.strip()) for library in libraries)
+    return [IndexCollision(libraries[i], libraries[j], distance)
+            for (i, j, distance) in close_pairs(
+                [combined_index(library, i7_length, i5_length)
+                 for library in libraries], min_distance)]
+
+
+def new_index_collisions(libraries, new_libraries, min_distance=None):
+    """Returns the IndexCollisions among libraries and new_libraries in which
+    at least one of new_libraries is involved"""
+    new_libraries = list(new_libraries)
+    new_pks = set(library.pk for library in new_libraries)
+    libraries = [library for library in libraries
+                 if library.pk not in new_pks] + new_libraries
+    return [c for c in find_index_collisions(libraries, min_distance)
+            if c.library1.pk in new_pks or c.library2.pk in new_pks]
+
+
+def run_index_collisions(run, libraries, min_distance=None):
+    """Returns the IndexCollisions among libraries, the DNALibraries a
+    SequencingRun should have, in which a library the run doesn't have yet
+    is involved. Collisions among the libraries the run already has are
+    left to the check of the whole run, so an existing run can always be
+    edited."""
+    current = set(run.dna_library.values_list('pk', flat=True)) \
+        if run.pk is not None else set()
+    libraries = list(libraries)
+    return new_index_collisions(
+        libraries, [library for library in libraries if library.pk not in current],
+        min_distance)
+
+
+def describe_collision(collision):
+    return "%s (%s%s) and %s (%s%s) differ in %d position(s)" % (
+        collision.library1, collision.library1.i7, collision.library1.i5,
+        collision.library2, collision.library2.i7, collision.library2.i5,
+        collision.distance)
+
+
+def run_libraries(run):
+    """Returns the DNALibraries of a SequencingRun in sample sheet order"""
+    return run.dna_library.select_related('root_sample').order_by('id')
+
+
+def write_sample_sheet(out, run):
+    """Writes the Illumina sample sheet (CSV) of a SequencingRun to the file
+    like object out"""
+    writer = csv.writer(out)
+
+    def write(row):
+        # The csv module of python 2 writes bytes
+        writer.writerow([unicode(v).encode('utf-8') for v in row])
+
+    for row in [["[Header]"],
+                ["IEMFileVersion", "4"],
+                ["Experiment Name", run.uid],
+                ["Date", timezone.localtime(run.date).strftime("%Y-%m-%d")],
+                ["Workflow", "GenerateFASTQ"],
+                ["Description", run.machine],
+                [],
+                ["[Data]"],
+                DATA_COLUMNS]:
+        write(row)
+    for library in run_libraries(run):
+        write([library.uid, library.sample_name_on_platform, library.i7,
+               library.i5, library.root_sample.uid, library.dna_type])
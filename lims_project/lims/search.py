@@ -0,0 +1,114 @@
+"""Search over all objects with a UID, Container barcodes and Collaborator
+names. All tables are searched with a single UNION ALL query that ranks exact
+matches before prefix matches before other matches, so a page of results
+costs one round trip to the database. The lookups use the same SQL as
+Django's iexact/istartswith/icontains lookups so they are served by the
+trigram indexes in lims/sql/."""
+from __future__ import print_function
+from collections import namedtuple
+
+from django.db import connection
+from django.db.models import get_models
+
+import lims.models
+from lims.models import Collaborator, Container, UIDManager, parse_barcode
+
+
+SearchResult = namedtuple('SearchResult', ['model', 'pk', 'label', 'rank'])
+
+# Ranks of a match
+EXACT, PREFIX, CONTAINS = 0, 1, 2
+
+PAGE_SIZE = 25
+
+
+def uid_models():
+    """Returns all models with a UID, i.e. with a UIDManager"""
+    return [m for m in get_models(app_mod=lims.models)
+            if isinstance(m._default_manager, UIDManager)]
+
+
+def _lookup(column, lookup_type):
+    """Returns the SQL of a case insensitive lookup on column, with a single
+    parameter"""
+    return "%s %s" % (connection.ops.lookup_cast(lookup_type) % column,
+                      connection.operators[lookup_type])
+
+
+def _like_params(term):
+    """Returns the iexact, istartswith and icontains parameters for term"""
+    like = connection.ops.prep_for_like_query(term)
+    return [like, like + "%", "%" + like + "%"]
+
+
+def _rank_sql(columns):
+    """Returns the SQL of the rank of a row matching on any of the columns"""
+    return "CASE WHEN %s THEN %d WHEN %s THEN %d ELSE %d END" % (
+        " OR ".join(_lookup(c, 'iexact') for c in columns), EXACT,
+        " OR ".join(_lookup(c, 'istartswith') for c in columns), PREFIX,
+        CONTAINS)
+
+
+def _match_sql(model_nr, model, columns):
+    """Returns the SQL of the part of the UNION searching the given columns of
+    model, with the parameters as returned by _match_params."""
+    qn = connection.ops.quote_name
+    columns = ["%s.%s" % (qn(model._meta.db_table), qn(c)) for c in columns]
+    labels = (columns + ["''"])[:2]
+    return ("SELECT %d AS model_nr, %s AS pk, %s AS label, %s AS label2, "
+            "%s AS search_rank FROM %s WHERE %s" % (
+                model_nr, qn('id'), labels[0], labels[1], _rank_sql(columns),
+                qn(model._meta.db_table),
+                " OR ".join(_lookup(c, 'icontains') for c in columns)))
+
+
+def _match_params(columns, term):
+    exact, prefix, contains = _like_params(term)
+    n = len(columns)
+    return [exact] * n + [prefix] * n + [contains] * n
+
+
+def search(term, page=1, page_size=PAGE_SIZE):
+    """Returns the page (numbered from 1) of SearchResults for term and
+    whether there is a next page. A barcode like SA:10Y31 is searched by its
+    UID, a Container barcode like CO:000012 matches that Container exactly."""
+    term = term.strip()
+    if not term:
+        return [], False
+    searched = [(m, ['uid']) for m in uid_models()] + \
+        [(Collaborator, ['first_name', 'last_name'])]
+    models = [m for (m, columns) in searched] + [Container]
+
+    parsed = parse_barcode(term)
+    if parsed is not None and parsed[0] is Container:
+        qn = connection.ops.quote_name
+        parts = ["SELECT %d AS model_nr, %s AS pk, '' AS label, '' AS label2, "
+                 "%d AS search_rank FROM %s WHERE %s = %%s" % (
+                     models.index(Container), qn('id'), EXACT,
+                     qn(Container._meta.db_table), qn('id'))]
+        params = [parsed[1]['pk']]
+    else:
+        if parsed is not None:
+            term = parsed[1]['uid']
+        parts = [_match_sql(nr, m, columns) for (nr, (m, columns)) in
+                 enumerate(searched)]
+        params = [p for (m, columns) in searched
+                  for p in _match_params(columns, term)]
+
+    sql = ("SELECT * FROM (%s) results ORDER BY search_rank, label, label2, "
+           "model_nr, pk LIMIT %d OFFSET %d" % (" UNION ALL ".join(parts),
+                                               page_size + 1,
+                                               (page - 1) * page_size))
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+
+    results = []
+    for model_nr, pk, label, label2, rank in rows[:page_size]:
+        model = models[model_nr]
+        if model is Container:
+            label = "CO:%06d" % pk
+        elif model is Collaborator:
+            label = "%s %s" % (label, label2)
+        results.append(SearchResult(model, pk, label, rank))
+    return results, len(rows) > page_size
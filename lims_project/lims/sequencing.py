@@ -0,0 +1,118 @@
+"""Registration of sequencing output, i.e. the ReadFiles produced by a
+SequencingRun."""
+from __future__ import print_function
+import os
+import re
+from collections import defaultdict, namedtuple
+
+from django.db import transaction
+
+from lims.models import DNALibrary, ReadFile
+from lims.readstats import compute_read_stats, default_cache, read_file_path
+from lims.samplesheet import run_index_collisions, IndexCollisionError
+
+
+# Illumina bcl2fastq naming: <sample>_S<n>[_L<lane>]_R<pair>_001.fastq.gz. Older
+# CASAVA versions use the index sequence instead of S<n>. Index reads (I1/I2)
+# are not matched.
+ILLUMINA_FASTQ_RE = re.compile(r"^(?P<sample>.+?)_(?:S\d+|[ACGTN]+(?:-[ACGTN]+)?)"
+                               r"(?:_L(?P<lane>\d{3}))?_R(?P<pair>[12])_\d{3}"
+                               r"\.f(?:ast)?q(?:\.gz)?$")
+
+FastqName = namedtuple('FastqName', ['sample_name_on_platform', 'lane', 'pair'])
+
+
+def parse_fastq_filename(filename):
+    """Returns a FastqName for an Illumina style FASTQ filename or None if the
+    filename does not follow the naming scheme. Lane defaults to 1 if the run
+    was demultiplexed without lane splitting."""
+    m = ILLUMINA_FASTQ_RE.match(filename)
+    if m is None:
+        return None
+    return FastqName(m.group('sample'), int(m.group('lane') or 1),
+                     int(m.group('pair')))
+
+
+def find_fastq_files(directory):
+    """Yields (folder, filename, FastqName) for all Illumina FASTQ files below
+    directory."""
+    for folder, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            name = parse_fastq_filename(filename)
+            if name is not None:
+                yield folder, filename, name
+
+
+def match_libraries(libraries, run_ids):
+    """Returns the DNALibraries by sample_name_on_platform and the set of
+    ambiguous names: names of several libraries of which not exactly one has
+    its pk in run_ids. The names are unique in the database, this guards
+    against libraries imported before that constraint."""
+    by_name = defaultdict(list)
+    for library in libraries:
+        by_name[library.sample_name_on_platform].append(library)
+    matched = {}
+    ambiguous = set()
+    for name, candidates in by_name.items():
+        if len(candidates) > 1:
+            candidates = [l for l in candidates if l.pk in run_ids]
+        if len(candidates) == 1:
+            matched[name] = candidates[0]
+        else:
+            ambiguous.add(name)
+    return matched, ambiguous
+
+
+def ingest_run(run, directory, count_reads=False, processes=None, dry_run=False):
+    """Creates ReadFiles for all Illumina FASTQ files below directory for the
+    given SequencingRun. DNALibraries are matched on sample_name_on_platform
+    with a single query, files that are already registered for the run are
+    skipped. Matched libraries are added to the run. If several libraries
+    have the sample name of a file, the one of the run is used, otherwise the
+    name is ambiguous and its files are skipped. Returns the list of new
+    ReadFiles, a sorted list of sample names that did not match any
+    DNALibrary and a sorted list of ambiguous sample names. Raises an
+    IndexCollisionError before reads are counted if the indexes of the
+    libraries to add collide with those of the run."""
+    found = list(find_fastq_files(directory))
+    names = set(name.sample_name_on_platform for (folder, filename, name) in found)
+    run_libraries = list(run.dna_library.all())
+    run_ids = set(library.pk for library in run_libraries)
+    libraries, ambiguous = match_libraries(
+        DNALibrary.objects.filter(sample_name_on_platform__in=names), run_ids)
+    existing = set(ReadFile.objects.filter(sequencing_run=run)
+                   .values_list('folder', 'filename'))
+
+    read_files = []
+    unmatched = set()
+    for folder, filename, name in found:
+        library = libraries.get(name.sample_name_on_platform)
+        if library is None:
+            if name.sample_name_on_platform not in ambiguous:
+                unmatched.add(name.sample_name_on_platform)
+        elif (folder, filename) not in existing:
+            read_files.append(ReadFile(folder=folder, filename=filename,
+                                       pair=name.pair, lane=name.lane,
+                                       read_count=0, dna_library=library,
+                                       root_sample_id=library.root_sample_id,
+                                       sequencing_run=run))
+
+    collisions = run_index_collisions(
+        run, run_libraries + list(set(rf.dna_library for rf in read_files
+                                      if rf.dna_library.pk not in run_ids)))
+    if collisions:
+        raise(IndexCollisionError(run, collisions))
+
+    if count_reads:
+        stats = compute_read_stats([read_file_path(rf) for rf in read_files],
+                                   processes, default_cache())
+        for rf in read_files:
+            rf.read_count = stats[read_file_path(rf)].read_count
+
+    if not dry_run and read_files:
+        with transaction.atomic():
+            ReadFile.objects.bulk_create(read_files)
+            run.dna_library.add(*set(rf.dna_library for rf in read_files))
+
+    return read_files, sorted(unmatched), sorted(ambiguous)
@@ -0,0 +1,2 @@
+-- Partial index of the empty containers per parent, for finding free wells
+CREATE INDEX lims_container_empty_parent ON lims_container (parent_id, "row", "column") WHERE object_id IS NULL;
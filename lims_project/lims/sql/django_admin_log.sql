@@ -0,0 +1,5 @@
+-- Indexes of the admin LogEntry table (django_admin_log). The table belongs to
+-- django.contrib.admin, so this isn't custom SQL of a lims model: syncdb runs
+-- it through lims.models.create_admin_log_indexes.
+-- The admin LogEntry listing filters and orders on action_time
+CREATE INDEX lims_django_admin_log_action_time ON django_admin_log (action_time);
@@ -0,0 +1,4 @@
+-- Trigram indexes for the case insensitive substring search of the admin
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX lims_dnalibrary_uid_trgm ON lims_dnalibrary USING gin (UPPER(uid::text) gin_trgm_ops);
+CREATE INDEX lims_dnalibrary_sample_name_on_platform_trgm ON lims_dnalibrary USING gin (UPPER(sample_name_on_platform::text) gin_trgm_ops);
@@ -0,0 +1,3 @@
+-- Trigram indexes for the case insensitive substring search of the admin
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX lims_extracteddna_uid_trgm ON lims_extracteddna USING gin (UPPER(uid::text) gin_trgm_ops);
@@ -0,0 +1,114 @@
+"""Storage locations of physical objects. A StorablePhysicalObject is stored
+in Containers through its generic containers relation, and Containers are
+nested in parent Containers up to a root Container in an
+ApparatusSubdivision of an Apparatus. resolve_storage_paths resolves the
+locations of many objects at once, with a query for the Containers holding
+them and a recursive query for all their ancestors, instead of walking
+Container.parent per object."""
+from __future__ import print_function
+import string
+from collections import defaultdict
+
+from django.db import connection
+
+from lims.metadata import model_metadata
+from lims.models import Container
+
+PATH_SEPARATOR = " > "
+# Ids per IN (...) list, SQLite allows at most 999 parameters per query
+IN_CHUNK_SIZE = 500
+_CONTAINER_RELATED = ('type', 'apparatus_subdivision__apparatus')
+
+
+def _chunks(ids):
+    ids = sorted(ids)
+    return [ids[i:i + IN_CHUNK_SIZE] for i in range(0, len(ids), IN_CHUNK_SIZE)]
+
+
+def position_label(container):
+    """Returns the position of the container in its parent, e.g. B04, or the
+    container itself if it has no row and column"""
+    if container.row is not None and container.column is not None and \
+            1 <= container.row <= len(string.ascii_uppercase):
+        return "%s%02d" % (string.ascii_uppercase[container.row - 1],
+                           container.column)
+    return unicode(container)
+
+
+def fetch_ancestors(container_ids):
+    """Returns a dictionary by id of the Containers with the given ids and all
+    their ancestors, fetched with one recursive query per IN_CHUNK_SIZE ids"""
+    qn = connection.ops.quote_name
+    containers = {}
+    for ids in _chunks(container_ids):
+        where = ("%(table)s.%(id)s IN (WITH RECURSIVE ancestor(id, parent_id) AS "
+                 "(SELECT %(id)s, %(parent)s FROM %(table)s WHERE %(id)s IN (%(ids)s) "
+                 "UNION SELECT c.%(id)s, c.%(parent)s FROM %(table)s c, ancestor a "
+                 "WHERE c.%(id)s = a.parent_id) SELECT id FROM ancestor)" % {
+                     'table': qn(Container._meta.db_table), 'id': qn('id'),
+                     'parent': qn('parent_id'), 'ids': ", ".join(["%s"] * len(ids))})
+        containers.update((c.pk, c) for c in Container.objects.select_related(
+            *_CONTAINER_RELATED).extra(where=[where], params=ids))
+    return containers
+
+
+def in_apparatus(queryset, apparatus_id):
+    """Filters a Container queryset to the Containers in the Apparatus with id
+    apparatus_id and everything in them, with one recursive subquery. UNION
+    drops rows that were already found, so a cycle of parents ends."""
+    qn = connection.ops.quote_name
+    subdivision = Container._meta.get_field('apparatus_subdivision')
+    where = ("%(table)s.%(id)s IN (WITH RECURSIVE descendant(id) AS "
+             "(SELECT c.%(id)s FROM %(table)s c, %(subdivisions)s s "
+             "WHERE c.%(subdivision)s = s.%(id)s AND s.%(apparatus)s = %%s "
+             "UNION SELECT c.%(id)s FROM %(table)s c, descendant d "
+             "WHERE c.%(parent)s = d.id) SELECT id FROM descendant)" % {
+                 'table': qn(Container._meta.db_table), 'id': qn('id'),
+                 'parent': qn('parent_id'),
+                 'subdivision': qn(subdivision.column),
+                 'subdivisions': qn(subdivision.rel.to._meta.db_table),
+                 'apparatus': qn(subdivision.rel.to._meta
+                                 .get_field('apparatus').column)})
+    return queryset.extra(where=[where], params=[apparatus_id])
+
+
+def container_path(container, containers):
+    """Returns the storage path of a container, e.g.
+    Freezer A > Rack 2 > 96 well box-CO:000012 > B04. The ancestors of
+    container are looked up in the containers dictionary by id."""
+    labels = []
+    while container.parent_id is not None:
+        labels.append(position_label(container))
+        container = containers[container.parent_id]
+    labels.append(position_label(container))
+    subdivision = container.apparatus_subdivision
+    if subdivision is not None:
+        labels += [subdivision.name, subdivision.apparatus.name]
+    return PATH_SEPARATOR.join(reversed(labels))
+
+
+def resolve_storage_paths(objects):
+    """Sets the storage paths of the given StorablePhysicalObjects, e.g. the
+    objects on a page or a queryset, so their storage_path property needs no
+    queries. The objects may be of different models. Returns the objects as a
+    list."""
+    objects = list(objects)
+    by_model = defaultdict(lambda: defaultdict(list))
+    for obj in objects:
+        obj._storage_paths = []
+        by_model[type(obj)][obj.pk].append(obj)
+
+    held = []
+    for model, by_pk in by_model.items():
+        content_type_id = model_metadata(model).content_type_id
+        for ids in _chunks(by_pk):
+            held += [(by_pk[c.object_id], c) for c in Container.objects.filter(
+                content_type=content_type_id, object_id__in=ids).select_related(
+                    *_CONTAINER_RELATED).order_by('id')]
+    containers = fetch_ancestors(set(c.parent_id for (objs, c) in held
+                                     if c.parent_id is not None))
+    for objs, container in held:
+        path = container_path(container, containers)
+        for obj in objs:
+            obj._storage_paths.append(path)
+    return objects
@@ -5,6 +5,8 @@ import re
 from django import template
 from django.conf import settings
 
+from lims.metadata import model_metadata
+
 numeric_test = re.compile("^\d+$")
 register = template.Library()
 
@@ -22,3 +24,11 @@ def getattribute(value, arg):
         return settings.TEMPLATE_STRING_IF_INVALID
 
 register.filter('getattribute', getattribute)
+
+
+def attribute_rows(value):
+    """Gets the (attribute name, value) rows of an object in preferred
+    ordering, see views.get_attr_list"""
+    return model_metadata(value).attribute_rows(value)
+
+register.filter('attribute_rows', attribute_rows)
@@ -0,0 +1,105 @@
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from lims.admin import DNALibraryAdmin, unicode_select_related
+from lims.models import Apparatus, ApparatusSubdivision, BarcodeToModel, Container, ReadFile, \
+    DNALibrary, Sample, SequencingRun, parse_barcode
+
+
+class LIMSModelAdminTests(TestCase):
+    fixtures = ['example']
+
+    def setUp(self):
+        get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+
+    def test_unicode_select_related(self):
+        self.assertEqual(unicode_select_related(ApparatusSubdivision), ['apparatus'])
+        self.assertEqual(unicode_select_related(BarcodeToModel, "b__"),
+                         ['b__template', 'b__printer', 'b__content_type'])
+
+    def test_list_select_related(self):
+        model_admin = DNALibraryAdmin(DNALibrary, admin.site)
+        self.assertEqual(model_admin.list_select_related,
+                         ('amplicon', 'metagenome', 'sag', 'pure_culture'))
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_constant(self):
+        url = reverse("admin:lims_readfile_changelist")
+        nr_queries = self.changelist_queries(url)
+        for i in range(5):
+            rf = ReadFile.objects.get(pk=1)
+            rf.pk = None
+            rf.filename = "rerun%d.fastq.gz" % i
+            rf.save()
+        self.assertEqual(self.changelist_queries(url), nr_queries)
+
+    def test_container_filters(self):
+        url = reverse("admin:lims_container_changelist")
+        for apparatus in Apparatus.objects.all():
+            response = self.client.get(url, {'apparatus': apparatus.pk})
+            self.assertEqual(
+                sorted(c.pk for c in response.context['cl'].queryset),
+                sorted(c.pk for c in Container.objects.all()
+                       if c.root_apparatus == apparatus))
+        for value in (True, False):
+            response = self.client.get(url, {'is_empty': str(value)})
+            self.assertEqual(
+                sorted(c.pk for c in response.context['cl'].queryset),
+                sorted(c.pk for c in Container.objects.all()
+                       if c.is_empty == value))
+
+    def test_sequencing_run_lineage(self):
+        url = reverse("admin:lims_sequencingrun_changelist")
+        run = SequencingRun.objects.get(pk=1)
+        run.dna_library.add(*DNALibrary.objects.all())
+        response = self.client.get(url)
+        self.assertContains(response, "11A11, ABCDE, AMZNG")
+        nr_queries = self.changelist_queries(url)
+
+        # Independent of the number of runs and libraries
+        for i in range(3):
+            copy = SequencingRun.objects.get(pk=1)
+            copy.pk = None
+            copy.uid += str(i)
+            copy.save()
+            copy.dna_library.add(*DNALibrary.objects.all())
+        self.assertEqual(self.changelist_queries(url), nr_queries)
+
+
+class SearchTests(TestCase):
+    fixtures = ['example']
+
+    def setUp(self):
+        get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+
+    def test_parse_barcode(self):
+        self.assertEqual(parse_barcode("SA:ABCDE"), (Sample, {'uid': 'ABCDE'}))
+        self.assertEqual(parse_barcode(" co:000012"), (Container, {'pk': 12}))
+        self.assertEqual(parse_barcode("CO:12A"), None)
+        self.assertEqual(parse_barcode("XX:ABCDE"), None)
+        self.assertEqual(parse_barcode("ABCDE"), None)
+
+    def test_admin_barcode_search(self):
+        url = reverse("admin:lims_sample_changelist")
+        response = self.client.get(url, {'q': 'SA:ABCDE'})
+        self.assertEqual([s.uid for s in response.context['cl'].result_list], ['ABCDE'])
+
+        response = self.client.get(url, {'q': 'BCD'})
+        self.assertIn('ABCDE', [s.uid for s in response.context['cl'].result_list])
+
+    def test_barcode_view(self):
+        response = self.client.get(reverse("barcode_search", args=["SA:ABCDE"]))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("barcode_search", args=["SA:NOPE0"]))
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,68 @@
+import json
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from lims import benchmark
+from lims.labdata import generate_lab_data, sample_uid, plate_well
+from lims.models import Container, DNALibrary, ReadFile, SAG, Sample, \
+    SequencingRun, LINEAGE_MODELS, backfill_root_samples
+
+
+class LabDataTests(TestCase):
+    def setUp(self):
+        self.counts = generate_lab_data(5, sag_every=2, sags_per_plate=4,
+                                        chunk_size=3)
+
+    def test_names(self):
+        self.assertEqual(sample_uid(0), "00000")
+        self.assertEqual(sample_uid(36 + 11), "0001B")
+        self.assertEqual(plate_well(0), "A1")
+        self.assertEqual(plate_well(383), "P24")
+
+    def test_counts(self):
+        self.assertEqual(Sample.objects.count(), 5)
+        self.assertEqual(SAG.objects.count(), 3 * 4)
+        self.assertEqual(DNALibrary.objects.count(), 5 + 3 * 4)
+        self.assertEqual(ReadFile.objects.count(), 2 * DNALibrary.objects.count())
+        # A run per chunk of samples
+        self.assertEqual(sum(r.dna_library.count() for r in SequencingRun.objects.all()),
+                         DNALibrary.objects.count())
+        # One box with all wells, five of them filled
+        self.assertEqual(Container.objects.count(), 1 + 96)
+        self.assertEqual(Container.objects.filter(object_id__isnull=False).count(), 5)
+        self.assertEqual(self.counts['Sample'], 5)
+        self.assertEqual(self.counts['Container'], 97)
+
+    def test_lineage(self):
+        roots = dict((m, list(m.objects.values_list('pk', 'root_sample')))
+                     for m in LINEAGE_MODELS)
+        backfill_root_samples()
+        for m in LINEAGE_MODELS:
+            self.assertEqual(list(m.objects.values_list('pk', 'root_sample')),
+                             roots[m])
+        sag = SAG.objects.get(uid="00002A_A2")
+        self.assertEqual(sag.sample.uid, "00002")
+
+
+class BenchmarkTests(TestCase):
+    def test_run(self):
+        generate_lab_data(3, sag_every=2, sags_per_plate=4)
+        results = benchmark.run_benchmarks(repeat=1)
+        self.assertIn('sample_tree', results['cases'])
+        self.assertIn('render_labels', results['cases'])
+        self.assertGreater(results['cases']['browse_sample']['queries'], 0)
+        self.assertEqual(results['counts']['Sample'], 3)
+        # Everything is rolled back
+        self.assertEqual(Sample.objects.count(), 3)
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = benchmark.save_results(results, directory)
+            with open(path) as f:
+                self.assertEqual(sorted(json.load(f)['cases']), sorted(results['cases']))
+            self.assertEqual(len(benchmark.compare_results(results, results)),
+                             len(results['cases']))
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,62 @@
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import skipUnless
+
+from django.test import TestCase
+from django.utils import timezone
+
+from lims import exports
+from lims.metadata import model_metadata
+from lims.models import DNALibrary, ReadFile
+
+
+class LineageExportTests(TestCase):
+    fixtures = ['example']
+
+    def test_lineage_row(self):
+        model_metadata(DNALibrary).content_type_id
+        # The ReadFiles, their lineage one level at a time (the library,
+        # metagenome, extracted DNA and sample), the containers of the
+        # libraries and the ancestors of those
+        with self.assertNumQueries(7):
+            rows = [r for batch in exports.iter_lineage_batches() for r in batch]
+        self.assertEqual(len(rows), ReadFile.objects.count())
+        row = rows[0]
+        self.assertEqual(row['dna_library_uid'], 'ABCDEA_X01A')
+        self.assertEqual(row['dna_source_type'], 'Metagenome')
+        self.assertEqual(row['extracted_dna_uid'], 'ABCDE_1')
+        self.assertEqual(row['sample_uid'], 'ABCDE')
+        self.assertEqual(row['dna_library_storage_path'],
+                         DNALibrary.objects.get(uid='ABCDEA_X01A').storage_path)
+
+    @skipUnless(exports.LIMS_PYARROW, "pyarrow is not installed")
+    def test_write_lineage_parquet(self):
+        out = BytesIO()
+        last_row, nr_rows = exports.write_lineage_parquet(out, batch_size=1)
+        self.assertEqual(nr_rows, ReadFile.objects.count())
+
+        table = exports.pyarrow.parquet.read_table(BytesIO(out.getvalue()))
+        self.assertEqual(table.num_rows, nr_rows)
+        self.assertEqual(table.schema.names,
+                         [name for (name, t) in exports.LINEAGE_COLUMNS])
+
+    @skipUnless(exports.LIMS_PYARROW, "pyarrow is not installed")
+    def test_export_lineage_incremental(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path, nr_rows = exports.export_lineage_incremental(directory)
+            self.assertEqual(nr_rows, ReadFile.objects.count())
+
+            # Nothing new since the previous export
+            self.assertEqual(exports.export_lineage_incremental(directory), (None, 0))
+
+            rf = ReadFile.objects.get(pk=1)
+            rf.pk = None
+            rf.filename = "pair1_rerun.fastq.gz"
+            rf.date = timezone.now()
+            rf.save()
+            path, nr_rows = exports.export_lineage_incremental(directory)
+            self.assertEqual(nr_rows, 1)
+        finally:
+            shutil.rmtree(directory)
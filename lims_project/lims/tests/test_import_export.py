@@ -0,0 +1,112 @@
+import tablib
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from lims.import_export_resources import SampleResource, ContainerResource
+from lims.models import Sample, Container
+
+
+def sample_example_dataset():
+    headers = ['id', 'uid', 'collaborator', 'sample_type', 'sample_location',
+               'temperature', 'ph', 'salinity', 'depth', 'latitude',
+               'longitude', 'shipping_method', 'date_received', 'date',
+               'biosafety_level', 'status', 'notes', 'extra_columns_json',
+               'extra1']
+    dataset = tablib.Dataset(headers=headers)
+    for uid in ["ALOHA", "ALOHB"]:
+        dataset.append(["", uid, 1, 1, 1, "", "7.5", "", "", "", "", "",
+                        "2014-02-01 00:00:00", "2014-03-01 00:00:00", "", "",
+                        "", "", "extra"])
+    return dataset
+
+
+class SampleUpsertTests(TestCase):
+    fixtures = ['example']
+
+    def test_reimport(self):
+        nr_samples = Sample.objects.count()
+        result = SampleResource().import_data(sample_example_dataset())
+        self.assertFalse(result.has_errors())
+        self.assertEqual(Sample.objects.count(), nr_samples + 2)
+
+        dataset = sample_example_dataset()
+        row = list(dataset[0])
+        row[dataset.headers.index('shipping_method')] = "dry ice"
+        dataset[0] = row
+        with CaptureQueriesContext(connection) as queries:
+            result = SampleResource().import_data(dataset)
+        # One query for the existing samples, one per foreign key column to
+        # check the ids and one for the update
+        self.assertEqual(len([q for q in queries.captured_queries
+                              if "SAVEPOINT" not in q['sql']]), 5)
+        self.assertFalse(result.has_errors())
+        self.assertEqual([r.import_type for r in result.rows], ['update', 'skip'])
+        self.assertEqual(Sample.objects.count(), nr_samples + 2)
+        self.assertEqual(Sample.objects.get(uid="ALOHA").shipping_method, "dry ice")
+        self.assertEqual(Sample.objects.get(uid="ALOHB").shipping_method, "")
+
+    def test_unknown_foreign_key(self):
+        dataset = sample_example_dataset()
+        row = list(dataset[1])
+        row[dataset.headers.index('collaborator')] = 9999
+        dataset[1] = row
+        nr_samples = Sample.objects.count()
+        result = SampleResource().import_data(dataset)
+        self.assertTrue(result.has_errors())
+        self.assertFalse(result.rows[0].errors)
+        self.assertIn("collaborator", result.rows[1].errors[0].error)
+        self.assertEqual(Sample.objects.count(), nr_samples)
+
+    def test_invalid_uid(self):
+        dataset = sample_example_dataset()
+        row = list(dataset[0])
+        row[dataset.headers.index('uid')] = "aloha"
+        dataset[0] = row
+        nr_samples = Sample.objects.count()
+        result = SampleResource().import_data(dataset)
+        self.assertTrue(result.has_errors())
+        self.assertEqual(Sample.objects.count(), nr_samples)
+
+
+class ContainerUpsertTests(TestCase):
+    fixtures = ['example']
+
+    def test_barcode_key(self):
+        dataset = tablib.Dataset(headers=['barcode', 'type', 'row', 'column',
+                                          'parent', 'apparatus_subdivision'])
+        dataset.append(["CO:000004", 4, 2, 3, 3, ""])
+        dataset.append(["", 4, 9, 9, 3, ""])
+        result = ContainerResource().import_data(dataset)
+        self.assertFalse(result.has_errors())
+        self.assertEqual([r.import_type for r in result.rows], ['update', 'new'])
+        self.assertEqual((Container.objects.get(pk=4).row,
+                          Container.objects.get(pk=4).column), (2, 3))
+        self.assertTrue(Container.objects.filter(parent=3, row=9, column=9).exists())
+
+    def test_invalid_barcode(self):
+        dataset = tablib.Dataset(headers=['barcode', 'notes'])
+        dataset.append(["CO:000004", "moved"])
+        dataset.append(["SA:ALOHA", "moved"])
+        dataset.append(["CO:4x", "moved"])
+        result = ContainerResource().import_data(dataset)
+        self.assertTrue(result.has_errors())
+        self.assertEqual([len(r.errors) for r in result.rows], [0, 1, 1])
+        self.assertIn("not a container barcode", result.rows[1].errors[0].error)
+        self.assertNotEqual(Container.objects.get(pk=4).notes, "moved")
+
+    def test_fetch_existing_chunks(self):
+        resource = ContainerResource()
+        existing = resource.fetch_existing(resource.get_upsert_key_field(),
+                                           set(range(1, 1200)))
+        self.assertEqual(sorted(existing),
+                         list(Container.objects.order_by('pk')
+                              .values_list('pk', flat=True)))
+
+    def test_changed_columns_only(self):
+        dataset = tablib.Dataset(headers=['id', 'notes'])
+        dataset.append([4, "moved"])
+        result = ContainerResource().import_data(dataset)
+        self.assertFalse(result.has_errors())
+        self.assertEqual(Container.objects.get(pk=4).notes, "moved")
+        self.assertEqual(Container.objects.get(pk=4).parent_id, 3)
@@ -0,0 +1,42 @@
+from unittest import skipIf
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+
+from lims import index_advisor
+from lims.index_advisor import TableStats, StatementStats
+
+
+class IndexAdvisorTests(TestCase):
+    tables = [
+        TableStats('lims_container', 500, 10 ** 8, 20, 200000),
+        TableStats('lims_sample', 900, 10 ** 6, 10, 5000),
+        TableStats('lims_dnalibrary', 10, 10 ** 5, 10 ** 6, 400000),
+        TableStats('lims_protocol', 10 ** 6, 10 ** 7, 0, 10),
+    ]
+
+    def test_hotspots(self):
+        self.assertEqual([t.table for t in index_advisor.hotspots(self.tables)],
+                         ['lims_container', 'lims_sample'])
+        self.assertAlmostEqual(index_advisor.seq_scan_ratio(self.tables[1]),
+                               900 / 910.0)
+
+    def test_format_report(self):
+        hotspots = index_advisor.hotspots(self.tables)
+        lines = index_advisor.format_report(hotspots)
+        self.assertTrue(lines[1].startswith("lims_container"))
+        self.assertIn("pg_stat_statements", lines[-1])
+
+        lines = index_advisor.format_report(hotspots, [StatementStats(
+            'SELECT *\n  FROM "lims_container" WHERE "object_id" = $1',
+            1000, 2500.0, 2.5, 1000)])
+        self.assertEqual(lines[-1], '    SELECT * FROM "lims_container" '
+                         'WHERE "object_id" = $1')
+        self.assertEqual(index_advisor.format_report([], None)[0],
+                         "No sequential scan hotspots in the lims tables.")
+
+    @skipIf(connection.vendor == 'postgresql', "runs on PostgreSQL")
+    def test_requires_postgresql(self):
+        self.assertRaises(CommandError, call_command, 'index_advisor')
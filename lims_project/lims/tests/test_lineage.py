@@ -0,0 +1,58 @@
+from django.test import TestCase
+
+from lims.lineage import resolve_ancestry
+from lims.models import DNALibrary, ReadFile, SAG, SAGPlateDilution
+
+
+class ResolveAncestryTests(TestCase):
+    fixtures = ['example']
+
+    def add_dilution_library(self):
+        sag = SAG(sag_plate_dilution=SAGPlateDilution.objects.get(pk=1),
+                  well="A01", concentration=1)
+        sag.save()
+        library = DNALibrary.objects.get(pk=2)
+        library.pk = None
+        library.sag = sag
+        library.sample_name_on_platform = "dilution"
+        library.save()
+        return library
+
+    def test_all_dna_sources(self):
+        self.add_dilution_library()
+        libraries = list(DNALibrary.objects.all())
+        # A query per DNA source model, the SAG plate dilutions, SAG plates,
+        # extracted DNA, extracted cells and samples
+        with self.assertNumQueries(9):
+            ancestry = resolve_ancestry(libraries)
+        with self.assertNumQueries(0):
+            for library in libraries:
+                self.assertEqual(ancestry[library.pk].dna_source, library.group)
+
+        for library in DNALibrary.objects.all():
+            a = ancestry[library.pk]
+            self.assertEqual(a.sample, library.sample)
+            self.assertEqual(a.collaborator, library.sample.collaborator)
+            self.assertEqual(a.biosafety_level, library.sample.biosafety_level)
+            if library.sag_id is not None:
+                self.assertEqual(a.extracted_cell, a.sag_plate.extracted_cell)
+                self.assertIsNone(a.extracted_dna)
+            else:
+                self.assertEqual(a.extracted_dna, library.group.extracted_dna)
+                self.assertIsNone(a.sag_plate)
+
+        dilution_library = DNALibrary.objects.get(sample_name_on_platform="dilution")
+        self.assertEqual(ancestry[dilution_library.pk].sag_plate.uid, "AHYEHA")
+
+    def test_read_files(self):
+        read_files = list(ReadFile.objects.all())
+        ancestry = resolve_ancestry(read_files)
+        self.assertEqual(sorted(ancestry), sorted(rf.pk for rf in read_files))
+        with self.assertNumQueries(0):
+            self.assertEqual(set(a.sample.uid for a in ancestry.values()),
+                             set(["ABCDE"]))
+            self.assertEqual(read_files[0].dna_library.uid, "ABCDEA_X01A")
+
+    def test_empty(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_ancestry(DNALibrary.objects.none()), {})
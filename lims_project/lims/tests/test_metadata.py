@@ -0,0 +1,50 @@
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+
+from lims.metadata import build_registry, model_metadata
+from lims.models import Container, DNALibrary, ExtractedCell, Protocol, \
+    Sample, BarcodeToModel
+
+
+class ModelMetadataTests(TestCase):
+    def test_registry(self):
+        metas = build_registry()
+        self.assertIn(model_metadata(Sample), metas)
+        self.assertIs(model_metadata(Sample()), model_metadata(Sample))
+
+    def test_names(self):
+        meta = model_metadata(DNALibrary)
+        self.assertEqual(meta.slug, "dnalibrary")
+        self.assertEqual(meta.view_name, "lims.views.browse.dnalibrary")
+        self.assertEqual(meta.verbose_name, "DNA library")
+        self.assertEqual(meta.verbose_name_plural, "DNA libraries")
+        self.assertEqual(meta.barcode_prefix, "DL")
+        self.assertEqual(model_metadata(Container).unicode_select_related,
+                         ('type', ))
+
+    def test_preferred_ordering(self):
+        self.assertEqual(model_metadata(Container).preferred_ordering,
+                         tuple(Container().preferred_ordering))
+        self.assertTrue(model_metadata(Sample).has_object_view)
+        self.assertFalse(model_metadata(Protocol).has_object_view)
+        self.assertIsNone(model_metadata(Protocol).preferred_ordering)
+
+    def test_related_objects(self):
+        related = model_metadata(Sample).related_objects
+        self.assertIn((ExtractedCell, 'sample', 'sample_id'),
+                      [tuple(r) for r in related])
+
+    def test_content_type_id(self):
+        meta = model_metadata(BarcodeToModel)
+        self.assertEqual(meta.content_type_id,
+                         ContentType.objects.get_for_model(BarcodeToModel).id)
+        with self.assertNumQueries(0):
+            meta.content_type_id
+
+    def test_attribute_rows(self):
+        container = Container(pk=12, row=1, column=2)
+        rows = model_metadata(Container).attribute_rows(container)
+        self.assertEqual([name for (name, value) in rows],
+                         list(Container().preferred_ordering))
+        self.assertEqual(rows[0], ('id', 12))
+        self.assertEqual(dict(rows)['column'], 2)
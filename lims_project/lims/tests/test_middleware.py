@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from lims import middleware
+
+
+@override_settings(MIDDLEWARE_CLASSES=settings.MIDDLEWARE_CLASSES +
+                   ('lims.middleware.QueryStatsMiddleware', ))
+class QueryStatsMiddlewareTests(TestCase):
+    fixtures = ['example']
+
+    def setUp(self):
+        middleware.histogram.reset()
+
+    def test_normalize_sql(self):
+        self.assertEqual(middleware.normalize_sql(
+            "SELECT a FROM t WHERE id = 12 AND uid = 'it''s' AND t2.x = 1.5"),
+            "SELECT a FROM t WHERE id = ? AND uid = ? AND t2.x = ?")
+
+    def test_headers_and_histogram(self):
+        url = reverse("lims.views.browse.sample")
+        response = self.client.get(url)
+        self.assertGreater(int(response['X-LIMS-Query-Count']), 0)
+        for header in ['X-LIMS-Query-Time', 'X-LIMS-View-Time',
+                       'X-LIMS-Duplicate-Queries']:
+            self.assertIn(header, response)
+        self.client.get(url)
+
+        entries = dict(middleware.histogram.summary())
+        entry = entries['lims.views.browse.sample']
+        self.assertEqual(entry['count'], 2)
+        self.assertEqual(sum(entry['buckets']), 2)
+
+    def test_repeated_queries(self):
+        stats = middleware.QueryStats([
+            {'sql': "SELECT * FROM t WHERE id = %d" % i, 'time': "0.001"}
+            for i in range(5)] + [{'sql': "SELECT 1", 'time': "0.002"}])
+        self.assertEqual(stats.nr_queries, 6)
+        self.assertEqual(stats.nr_duplicates, 4)
+        self.assertEqual(stats.most_repeated_count, 5)
+
+    def test_staff_only(self):
+        url = reverse("request_stats")
+        self.client.get(reverse("lims.views.browse.sample"))
+        response = self.client.get(url)
+        self.assertNotContains(response, "lims.views.browse.sample")
+
+        get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        self.assertContains(self.client.get(url), "lims.views.browse.sample")
@@ -1,7 +1,12 @@
+from django.core.exceptions import ValidationError
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.core.urlresolvers import reverse
 
-from lims.models import Apparatus
+from lims.models import Apparatus, Container, Sample, ExtractedCell, ExtractedDNA, SAGPlate, \
+    SAGPlateDilution, SAG, Metagenome, Amplicon, DNAFromPureCulture, \
+    DNALibrary, ReadFile, LINEAGE_MODELS, backfill_root_samples
 
 
 class ApparatusTests(TestCase):
@@ -14,3 +19,157 @@ class ApparatusTests(TestCase):
         response = self.client.get(self.create_read_url)
 
         self.assertContains(response, "apparatus1")
+
+
+class RootSampleTests(TestCase):
+    fixtures = ['example']
+
+    def test_new_object(self):
+        plate = SAGPlate.objects.get(pk=1)
+        plate.pk = None
+        plate.uid = None
+        plate.root_sample = None
+        plate.save()
+        self.assertEqual(plate.uid, "11A11B")
+        self.assertEqual(plate.root_sample.uid, "11A11")
+        # No hops through the ExtractedCell
+        with self.assertNumQueries(2):
+            self.assertEqual(SAGPlate.objects.get(pk=plate.pk).sample.uid, "11A11")
+
+    def test_reparent(self):
+        cell = ExtractedCell.objects.get(pk=1)
+        cell.sample = Sample.objects.get(uid="22B22")
+        cell.save()
+        self.assertEqual(SAGPlate.objects.get(pk=1).root_sample.uid, "22B22")
+        self.assertEqual(SAG.objects.get(pk=1).root_sample.uid, "22B22")
+        self.assertEqual(DNALibrary.objects.get(sag=1).root_sample.uid, "22B22")
+
+        dna = ExtractedDNA.objects.get(uid="ABCDE_1")
+        dna.sample = Sample.objects.get(uid="BCDEF")
+        dna.save()
+        self.assertEqual(set(ReadFile.objects.filter(dna_library__uid="ABCDEA_X01A")
+                             .values_list('root_sample__uid', flat=True)),
+                         set(["BCDEF"]))
+
+    def test_plain_edit(self):
+        # Only the UPDATE, the parents are not followed
+        sag = SAG.objects.get(pk=1)
+        sag.well = "O11"
+        with self.assertNumQueries(1):
+            sag.save()
+        # Deferred parents are compared with the stored root sample
+        sag = SAG.objects.only('well').get(pk=1)
+        sag.save()
+        self.assertEqual(SAG.objects.get(pk=1).root_sample.uid, "11A11")
+
+    def test_backfill(self):
+        expected = dict((m, list(m.objects.values_list('pk', 'root_sample')))
+                        for m in LINEAGE_MODELS)
+        for m in LINEAGE_MODELS:
+            m.objects.update(root_sample=None)
+        backfill_root_samples()
+        for m in LINEAGE_MODELS:
+            self.assertEqual(list(m.objects.values_list('pk', 'root_sample')),
+                             expected[m])
+
+
+class IndexByGroupTests(TestCase):
+    fixtures = ['example']
+
+    def copy_plate(self):
+        plate = SAGPlate.objects.get(pk=1)
+        plate.pk = None
+        plate.save()
+        return plate
+
+    def test_no_reuse_after_delete(self):
+        first = self.copy_plate()
+        second = self.copy_plate()
+        self.assertEqual((first.uid, second.uid), ("11A11B", "11A11C"))
+        first.delete()
+        self.assertEqual(self.copy_plate().uid, "11A11D")
+
+    def test_single_table_max(self):
+        plate = SAGPlate.objects.get(pk=1)
+        plate.pk = None
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(plate.calc_index_by_group(), 1)
+        max_queries = [q['sql'] for q in queries if "MAX" in q['sql']]
+        self.assertEqual(len(max_queries), 1)
+        self.assertNotIn("JOIN", max_queries[0])
+
+    def test_dilution(self):
+        dilution = SAGPlateDilution.objects.get(pk=1)
+        dilution.pk = None
+        dilution.save()
+        self.assertEqual(dilution.uid, "AHYEHc")
+
+
+class CreateQueryCountTests(TestCase):
+    """Creating an object only fetches the parent its UID is derived from"""
+    fixtures = ['example']
+
+    def new_object(self, model, pk, **fields):
+        """Returns an unsaved copy of an object with only the foreign key ids
+        set, like a form or an import would"""
+        obj = model.objects.get(pk=pk)
+        values = dict((f.attname, getattr(obj, f.attname))
+                      for f in model._meta.fields
+                      if f.attname not in ('id', 'uid', 'index_by_group',
+                                           'root_sample_id'))
+        values.update(fields)
+        return model(**values)
+
+    def assertCreateQueries(self, num, obj, uid):
+        with self.assertNumQueries(num):
+            obj.save()
+        self.assertEqual(obj.uid, uid)
+
+    def test_container(self):
+        container = self.new_object(Container, 1, content_type_id=None,
+                                    object_id=None)
+        with self.assertNumQueries(0):
+            container.clean()
+        with self.assertNumQueries(1):
+            container.save()
+        container.parent_id = 1
+        with self.assertRaises(ValidationError):
+            container.clean()
+
+    def test_extracted_cell(self):
+        self.assertCreateQueries(3, self.new_object(ExtractedCell, 1), "11A11_2")
+
+    def test_extracted_dna(self):
+        self.assertCreateQueries(3, self.new_object(ExtractedDNA, 1), "ABCDE_2")
+        # The root sample is looked up through the extracted cell
+        dna = self.new_object(ExtractedDNA, 1, sample_id=None, extracted_cell_id=1)
+        self.assertCreateQueries(4, dna, "11A11_1")
+
+    def test_sag_plate(self):
+        self.assertCreateQueries(4, self.new_object(SAGPlate, 1), "11A11B")
+
+    def test_sag_plate_dilution(self):
+        self.assertCreateQueries(4, self.new_object(SAGPlateDilution, 1), "AHYEHc")
+
+    def test_sag(self):
+        sag = self.new_object(SAG, 1, well="A01")
+        with self.assertNumQueries(0):
+            sag.clean()
+        self.assertCreateQueries(2, sag, "11A11A_A01")
+
+    def test_index_by_root_sample(self):
+        for model, uid in ((Metagenome, "ABCDEA_X02"), (Amplicon, "AMZNGA_Y02"),
+                           (DNAFromPureCulture, "ABCDEA_Z02")):
+            self.assertCreateQueries(4, self.new_object(model, 1), uid)
+
+    def test_dna_library(self):
+        library = self.new_object(DNALibrary, 1, sample_name_on_platform="1b")
+        with self.assertNumQueries(0):
+            self.assertEqual(library.dna_type, "Metagenome")
+            self.assertEqual(library.group_field, "metagenome")
+        # Only the Metagenome the UID is derived from is fetched
+        self.assertCreateQueries(3, library, "ABCDEA_X01B")
+        library.sag_id = 1
+        with self.assertNumQueries(0):
+            with self.assertRaises(ValidationError):
+                library.clean()
@@ -0,0 +1,100 @@
+from io import BytesIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from lims import moves
+from lims.models import Container, ApparatusSubdivision, Sample
+from lims.storage import resolve_storage_paths
+from lims.tests.utils import make_plate
+
+
+def positions(plate):
+    return sorted(Container.objects.filter(parent=plate)
+                  .values_list('row', 'column'))
+
+
+class MoveTests(TestCase):
+    fixtures = ['example']
+
+    def test_move_to_subdivision(self):
+        rack = Container(type_id=3, apparatus_subdivision_id=1)
+        rack.save()
+        Container.objects.filter(pk=3).update(parent=rack, row=1, column=1,
+                                              apparatus_subdivision=None)
+        # The box with its wells and a petri dish
+        box = Container.objects.get(pk=3)
+        # The UPDATE and a savepoint around it
+        with self.assertNumQueries(3):
+            self.assertEqual(moves.move_to_subdivision(
+                [box, 1], ApparatusSubdivision(pk=4)), 2)
+        box = Container.objects.get(pk=3)
+        self.assertEqual((box.parent_id, box.row, box.apparatus_subdivision_id),
+                         (None, None, 4))
+        self.assertEqual(Container.objects.get(pk=1).apparatus_subdivision_id, 4)
+        # The samples in the wells follow the box
+        sample = resolve_storage_paths([Sample.objects.get(pk=4)])[0]
+        self.assertTrue(sample.storage_path.startswith("Gustav Closet > Shelf 2"))
+
+    def test_reparent(self):
+        rack = Container(type_id=3, apparatus_subdivision_id=1)
+        rack.save()
+        Container.objects.bulk_create([Container(type_id=1, parent=rack, row=1,
+                                                 column=1)])
+        plates = [make_plate(1, 1) for i in range(3)]
+        self.assertRaises(Exception, moves.reparent, [plates[0]], plates[0])
+        Container.objects.filter(pk=plates[0].pk).update(row=1, column=1)
+        # Position A01 of the rack is taken
+        self.assertRaises(Exception, moves.reparent, plates[:1], rack)
+        # Two plates would end up in A02
+        self.assertRaises(Exception, moves.reparent, plates[:2], rack,
+                          {plates[0].pk: (1, 2), plates[1].pk: (1, 2)})
+
+        with self.assertNumQueries(6):
+            self.assertEqual(moves.reparent(plates, rack, {plates[0].pk: (1, 2),
+                                                           plates[1].pk: (1, 3)}), 3)
+        self.assertEqual(positions(rack), [(None, None), (1, 1), (1, 2), (1, 3)])
+        self.assertFalse(Container.objects.filter(pk__in=[p.pk for p in plates],
+                                                  apparatus_subdivision__isnull=False))
+        # The rack is in one of the plates now
+        self.assertRaises(Exception, moves.reparent, [rack], plates[0])
+
+    def test_consolidate_and_split(self):
+        plates = [make_plate(8, 12) for i in range(4)]
+        Container.objects.filter(parent=plates[3], row=8, column=12) \
+            .update(notes="H12 of plate 4")
+        plate_384 = make_plate(0, 0)
+        with self.assertNumQueries(11):
+            self.assertEqual(moves.consolidate_quadrants(plates, plate_384), 384)
+        self.assertEqual(positions(plate_384),
+                         [(r, c) for r in range(1, 17) for c in range(1, 25)])
+        self.assertEqual(Container.objects.get(notes="H12 of plate 4").row, 16)
+        self.assertFalse(Container.objects.filter(parent__in=plates).exists())
+        self.assertRaises(Exception, moves.consolidate_quadrants, plates, plate_384)
+
+        self.assertEqual(moves.split_quadrants(plate_384, [None, None, None,
+                                                           plates[3]]), 96)
+        self.assertEqual(positions(plates[3]),
+                         [(r, c) for r in range(1, 9) for c in range(1, 13)])
+        well = Container.objects.get(notes="H12 of plate 4")
+        self.assertEqual((well.parent_id, well.row, well.column),
+                         (plates[3].pk, 8, 12))
+        self.assertEqual(moves.split_quadrants(plate_384, plates[:3]), 288)
+        self.assertFalse(Container.objects.filter(parent=plate_384).exists())
+
+    def test_command(self):
+        plates = [make_plate(8, 12) for i in range(2)]
+        plate_384 = make_plate(0, 0)
+        barcodes = [p.barcode for p in plates]
+        call_command('move_containers', *barcodes, consolidate=plate_384.barcode,
+                     stdout=BytesIO())
+        self.assertEqual(len(positions(plate_384)), 192)
+        call_command('move_containers', plate_384.barcode, split=",".join(barcodes),
+                     stdout=BytesIO())
+        self.assertEqual(len(positions(plates[1])), 96)
+        call_command('move_containers', *barcodes, subdivision=5, stdout=BytesIO())
+        self.assertEqual(Container.objects.filter(apparatus_subdivision=5).count(), 2)
+        self.assertRaises(CommandError, call_command, 'move_containers', *barcodes)
+        self.assertRaises(CommandError, call_command, 'move_containers', "CO:999999",
+                          subdivision=5)
@@ -0,0 +1,111 @@
+import csv
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from lims import pooling, worklists
+from lims.metadata import model_metadata
+from lims.models import Container, DNALibrary, SequencingRun
+
+
+class PoolingTests(TestCase):
+    fixtures = ['example']
+
+    def setUp(self):
+        # The wells of the libraries are A01-A05 of plate CO:000003
+        for column, pk in enumerate(range(25, 30), 1):
+            Container.objects.filter(pk=pk).update(row=1, column=column)
+        concentrations = {1: 10, 2: 5, 3: 2.5, 4: 1000, 5: 10}
+        for pk, concentration in concentrations.items():
+            DNALibrary.objects.filter(pk=pk).update(concentration=concentration)
+
+    def test_dilution_factor(self):
+        self.assertEqual(pooling.dilution_factor(1.0), 1)
+        self.assertEqual(pooling.dilution_factor(0.2), 5)
+        self.assertEqual(pooling.dilution_factor(0.0001), None)
+
+    def test_pool_libraries(self):
+        libraries = DNALibrary.objects.all()
+        model_metadata(DNALibrary).content_type_id
+        # The libraries and the wells they are stored in
+        with self.assertNumQueries(2):
+            pool = pooling.pool_libraries(libraries, 4, 50)
+        # 4 * 50 / 5 = 40 per library
+        volumes = [(e.library.pk, e.volume, e.dilution_factor) for e in pool.entries]
+        self.assertEqual(volumes, [(1, 4.0, 1), (2, 8.0, 1), (3, 16.0, 1),
+                                   (4, 0.04 * 20, 20), (5, 4.0, 1)])
+        self.assertAlmostEqual(pool.buffer_volume, 50 - 32.8)
+        self.assertTrue(pooling.is_feasible(pool))
+        self.assertEqual(pool.entries[0].source_plate, "CO:000003")
+        self.assertEqual([e.source_well for e in pool.entries],
+                         ["A01", "A02", "A03", "A04", "A05"])
+
+        transfers = pooling.pool_worklist(pool)
+        # Library 4 is diluted 1:20 in a well of the dilution plate first
+        self.assertEqual(transfers[:2], [
+            worklists.Transfer("CO:000003", "A04", pooling.DILUTION_PLATE, "A01",
+                               pooling.MIN_VOLUME),
+            worklists.Transfer(pooling.BUFFER_PLATE, pooling.BUFFER_WELL,
+                               pooling.DILUTION_PLATE, "A01",
+                               pooling.MIN_VOLUME * 19)])
+        self.assertEqual(transfers[3], worklists.Transfer(
+            "CO:000003", "A02", pooling.POOL_PLATE, pooling.POOL_WELL, 8.0))
+        self.assertEqual(transfers[5], worklists.Transfer(
+            pooling.DILUTION_PLATE, "A01", pooling.POOL_PLATE, pooling.POOL_WELL,
+            0.04 * 20))
+        self.assertEqual(transfers[-1][:2], (pooling.BUFFER_PLATE,
+                                             pooling.BUFFER_WELL))
+        self.assertAlmostEqual(transfers[-1].volume, 50 - 32.8)
+        out = BytesIO()
+        worklists.write_csv(out, transfers)
+        rows = list(csv.reader(BytesIO(out.getvalue())))
+        self.assertEqual(rows[0], worklists.CSV_COLUMNS)
+        self.assertEqual(rows[4], ["CO:000003", "A02", "Pool", "A01", "8.00"])
+
+    def test_infeasible(self):
+        Container.objects.filter(pk=29).update(object_id=None, content_type=None)
+        pool = pooling.pool_libraries(DNALibrary.objects.all(), 20, 50)
+        self.assertLess(pool.buffer_volume, 0)
+        self.assertEqual(pool.entries[4].error, "not stored in a well")
+        self.assertFalse(pooling.is_feasible(pool))
+        # Four libraries and the dilution of one, no buffer as the pool is
+        # overfull
+        self.assertEqual(len(pooling.pool_worklist(pool)), 6)
+        self.assertIn("don't fit", pooling.format_report(pool)[-2])
+
+    def test_too_many_dilutions(self):
+        library = DNALibrary.objects.get(pk=4)
+        entries = [pooling.PoolEntry(library, 1000.0, 0.5, 2, "CO:000003", "A04",
+                                     None)] * (pooling.DILUTION_WELLS + 1)
+        pool = pooling.Pool(entries, 4, 50, 1.5, pooling.MIN_VOLUME)
+        self.assertFalse(pooling.is_feasible(pool))
+        self.assertIn("dilution plate", pooling.format_report(pool)[-1])
+        self.assertEqual(pooling.dilution_well(pooling.DILUTION_WELLS - 1), "H12")
+        with self.assertRaises(Exception):
+            pooling.pool_worklist(pool)
+
+    def test_command(self):
+        run = SequencingRun.objects.get(pk=1)
+        run.dna_library.add(DNALibrary.objects.get(pk=2))
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "worklist.csv")
+            out = BytesIO()
+            call_command('pool_libraries', run.uid, molarity=2, volume=20,
+                         worklist=path, stdout=out)
+            self.assertIn("ABCDEA_X01A", out.getvalue())
+            with open(path) as f:
+                # Header, two libraries and the buffer
+                self.assertEqual(len(list(csv.reader(f))), 4)
+            os.remove(path)
+            with self.assertRaises(CommandError):
+                call_command('pool_libraries', run.uid, molarity=2000, volume=20,
+                             worklist=path, stdout=BytesIO())
+            self.assertFalse(os.path.exists(path))
+        finally:
+            shutil.rmtree(directory)
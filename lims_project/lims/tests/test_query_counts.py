@@ -0,0 +1,94 @@
+"""Query count regression tests. Every browse view, the sample tree, the
+barcode search and every admin changelist is requested on a small and on a
+larger dataset. The number of queries should not depend on the number of
+rows, so N+1 query patterns fail here instead of in production."""
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from lims.labdata import generate_lab_data
+from lims.metadata import build_registry
+from lims.models import Apparatus, Sample, SAGPlate
+
+try:
+    import pytz
+    HAS_PYTZ = True
+except ImportError:
+    HAS_PYTZ = False
+
+
+class QueryCountTests(TestCase):
+    fixtures = ['example']
+
+    def setUp(self):
+        get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        # Show all rows on one page, so the rows on a page grow with the data
+        admin.autodiscover()
+        self.list_per_page = {}
+        for model_admin in admin.site._registry.values():
+            self.list_per_page[model_admin] = model_admin.list_per_page
+            model_admin.list_per_page = 1000
+
+    def tearDown(self):
+        for model_admin, list_per_page in self.list_per_page.items():
+            model_admin.list_per_page = list_per_page
+
+    def get_urls(self):
+        """Returns the (name, url, GET parameters) to test. Object views show
+        the newest object of each model, which belongs to the largest sample
+        after generating the larger dataset."""
+        urls = []
+        for meta in build_registry():
+            name = meta.view_name
+            urls.append((name, reverse(name), {}))
+            newest = meta.model.objects.order_by('-id').first()
+            if meta.has_object_view and newest is not None:
+                urls.append((name + " object", reverse(name, args=[newest.pk]), {}))
+
+        sample = Sample.objects.order_by('-id').first()
+        urls.append(('sample_tree', reverse('sample_tree', args=[sample.pk]), {}))
+        plate = SAGPlate.objects.order_by('-id').first()
+        urls.append(('tree_children', reverse('tree_children',
+                                              args=['sagplate', plate.pk]), {}))
+        urls.append(('barcode_search', reverse('barcode_search',
+                                               args=[sample.barcode]), {}))
+
+        for model, model_admin in admin.site._registry.items():
+            if model_admin.date_hierarchy and not HAS_PYTZ:
+                # Date truncation needs pytz on SQLite
+                continue
+            name = 'admin:%s_%s_changelist' % (model._meta.app_label,
+                                               model._meta.model_name)
+            urls.append((name, reverse(name), {}))
+        name = 'admin:lims_container_changelist'
+        apparatus = Apparatus.objects.order_by('-id').first()
+        urls.append((name + " apparatus", reverse(name), {'apparatus': apparatus.pk}))
+        urls.append((name + " empty", reverse(name), {'is_empty': "True"}))
+        urls.append((name + " not empty", reverse(name), {'is_empty': "False"}))
+        return urls
+
+    def query_counts(self):
+        counts = {}
+        for name, url, params in self.get_urls():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200, "%s returned %d" %
+                             (name, response.status_code))
+            counts[name] = len(queries)
+        return counts
+
+    def test_query_counts_do_not_grow(self):
+        generate_lab_data(1, sag_every=1, sags_per_plate=2)
+        small = self.query_counts()
+        # Starts in a new box, so there are more containers as well
+        generate_lab_data(3, start=96, sag_every=1, sags_per_plate=6)
+        large = self.query_counts()
+
+        grown = ["%s: %d -> %d queries" % (name, small[name], large[name])
+                 for name in sorted(small) if large[name] > small[name]]
+        self.assertEqual(grown, [], "Query counts grow with the number of "
+                         "rows:\n" + "\n".join(grown))
@@ -0,0 +1,77 @@
+import os
+import gzip
+import shutil
+import hashlib
+import tempfile
+
+from django.test import TestCase
+
+from lims.models import ReadFile
+from lims import readstats
+
+
+class ReadStatsTests(TestCase):
+    fixtures = ['example']
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "pair1.fastq.gz")
+        with gzip.open(self.path, 'wb') as f:
+            f.write(b"@r1\nACGTA\n+\nFFFFF\n" * 3)
+        # A second gzip member, as produced by concatenating files
+        with open(self.path, 'ab') as f:
+            g = gzip.GzipFile(fileobj=f, mode='wb')
+            g.write(b"@r4\nACG\n+\nFFF")
+            g.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fastq_stats(self):
+        with open(self.path, 'rb') as f:
+            md5 = hashlib.md5(f.read()).hexdigest()
+        self.assertEqual(readstats.fastq_stats(self.path), (4, 18, md5))
+
+    def test_update_read_counts(self):
+        ReadFile.objects.update(folder=self.directory)
+        cache = readstats.ReadStatsCache(os.path.join(self.directory, "cache.json"))
+        result = readstats.update_read_counts(ReadFile.objects.filter(pk=1),
+                                              cache=cache)
+        self.assertEqual([s.read_count for (rf, s) in result], [4])
+        self.assertEqual(ReadFile.objects.get(pk=1).read_count, 4)
+        self.assertEqual(ReadFile.objects.get(pk=2).read_count, 25)
+
+        # Unchanged files are served from the cache
+        cache = readstats.ReadStatsCache(cache.path)
+        self.assertEqual(cache.get(self.path).read_count, 4)
+
+    def test_unreadable_files(self):
+        truncated = os.path.join(self.directory, "truncated.fastq.gz")
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        with open(truncated, 'wb') as f:
+            f.write(data[:-10])
+        missing = os.path.join(self.directory, "missing.fastq.gz")
+        cache = readstats.ReadStatsCache(os.path.join(self.directory, "cache.json"))
+        paths = [self.path, truncated, missing]
+
+        errors = {}
+        stats = readstats.compute_read_stats(paths, processes=1, cache=cache,
+                                             errors=errors)
+        self.assertEqual(stats.keys(), [self.path])
+        self.assertEqual(sorted(errors.keys()), sorted([truncated, missing]))
+        self.assertIn("Truncated", errors[truncated])
+        # The readable file is cached despite the errors
+        self.assertEqual(readstats.ReadStatsCache(cache.path).get(self.path)
+                         .read_count, 4)
+
+        with self.assertRaises(readstats.ReadStatsError) as cm:
+            readstats.compute_read_stats(paths, processes=1)
+        self.assertEqual(sorted(cm.exception.errors.keys()),
+                         sorted([truncated, missing]))
+
+        # The test runs in a transaction, which closing the connection for
+        # the worker processes would break
+        with self.assertRaises(Exception) as cm:
+            readstats.compute_read_stats(paths, processes=2)
+        self.assertIn("transaction", str(cm.exception))
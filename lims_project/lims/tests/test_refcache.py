@@ -0,0 +1,77 @@
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from lims import refcache
+from lims.models import Collaborator, ReferenceDataVersion, Sample, \
+    SampleLocation, SampleType
+
+
+class ReferenceCacheTests(TransactionTestCase):
+    """Runs outside a transaction, as the cache isn't loaded in one"""
+    def setUp(self):
+        refcache.cache.clear()
+        collaborator = Collaborator.objects.create(
+            first_name="A", last_name="B", institution="C", address="", email="")
+        location = SampleLocation.objects.create(name="Baltic Sea")
+        self.types = [SampleType.objects.create(name=n) for n in ["Soil", "Seawater"]]
+        for i, uid in enumerate(["AAAAA", "BBBBB", "CCCCC"]):
+            Sample.objects.create(uid=uid, collaborator=collaborator,
+                                  sample_location=location,
+                                  sample_type=self.types[i % 2],
+                                  biosafety_level=1, status="new")
+
+    def tearDown(self):
+        refcache.cache.clear()
+
+    def test_foreign_keys_from_cache(self):
+        samples = list(Sample.objects.order_by('uid'))
+        # The version and the rows of each table
+        with self.assertNumQueries(6):
+            names = [(s.sample_type.name, s.sample_location.name,
+                      s.collaborator.last_name) for s in samples]
+        self.assertEqual(names[1], ("Seawater", "Baltic Sea", "B"))
+        with self.assertNumQueries(1):
+            sample = Sample.objects.get(uid="CCCCC")
+            self.assertEqual(sample.sample_type.name, "Soil")
+        # Cached objects are shared
+        self.assertIs(sample.sample_type, samples[0].sample_type)
+
+    def test_save_invalidates(self):
+        self.assertEqual(refcache.cache.get(SampleType, self.types[0].pk).name, "Soil")
+        version = ReferenceDataVersion.objects.get(model="lims.sampletype").version
+        self.types[0].name = "Sand"
+        self.types[0].save()
+        self.assertEqual(ReferenceDataVersion.objects.get(
+            model="lims.sampletype").version, version + 1)
+        self.assertEqual(refcache.cache.get(SampleType, self.types[0].pk).name, "Sand")
+
+        self.types[1].delete()
+        self.assertEqual([t.name for t in refcache.cache.all(SampleType)], ["Sand"])
+
+    def test_other_process_change(self):
+        refcache.cache.all(SampleType)
+        with self.assertNumQueries(1):
+            refcache.cache.check_versions()
+        self.assertIn(SampleType, refcache.cache.tables)
+
+        # Changed by another process, which bypasses the signals
+        SampleType.objects.filter(pk=self.types[0].pk).update(name="Sand")
+        ReferenceDataVersion.objects.filter(model="lims.sampletype").update(version=100)
+        refcache.cache.check_versions()
+        self.assertNotIn(SampleType, refcache.cache.tables)
+        self.assertEqual(refcache.cache.get(SampleType, self.types[0].pk).name, "Sand")
+
+    def test_request_checks_versions(self):
+        refcache.cache.all(SampleType)
+        ReferenceDataVersion.objects.filter(model="lims.sampletype").update(version=100)
+        self.client.get("/")
+        self.assertNotIn(SampleType, refcache.cache.tables)
+
+    def test_not_loaded_in_transaction(self):
+        with transaction.atomic():
+            self.assertEqual(len(refcache.cache.all(SampleType)), 2)
+            self.assertIsNone(refcache.cache.get(SampleType, self.types[0].pk))
+            sample = Sample.objects.get(uid="AAAAA")
+            with self.assertNumQueries(1):
+                self.assertEqual(sample.sample_type.name, "Soil")
+        self.assertEqual(refcache.cache.tables, {})
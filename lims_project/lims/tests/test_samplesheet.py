@@ -0,0 +1,125 @@
+import csv
+import random
+from io import BytesIO
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from lims import samplesheet
+from lims.admin import SequencingRunForm
+from lims.models import DNALibrary, SequencingRun
+
+
+class IndexCollisionTests(TestCase):
+    fixtures = ['example']
+
+    def random_indexes(self, n):
+        r = random.Random(1)
+        return ["".join(r.choice("ACGT") for _ in range(16)) for i in range(n)]
+
+    def test_close_pairs(self):
+        indexes = ["AAAAAAAA", "AAAAAAAT", "AAAAAATT", "CCCCCCCC", "AAAAAA"]
+        self.assertEqual(samplesheet.close_pairs(indexes, 2), [(0, 1, 1), (1, 2, 1)])
+        # Missing positions of shorter indexes differ
+        self.assertEqual(samplesheet.close_pairs(indexes, 3),
+                         [(0, 1, 1), (0, 2, 2), (0, 4, 2), (1, 2, 1), (1, 4, 2),
+                          (2, 4, 2)])
+        self.assertEqual(samplesheet.close_pairs(indexes[:1], 3), [])
+
+    @skipUnless(samplesheet.LIMS_NUMPY, "numpy is not installed")
+    def test_numpy_matches_python(self):
+        indexes = self.random_indexes(600)
+        indexes += [indexes[5][:-1] + "N", indexes[300]]
+        pairs = samplesheet.close_pairs(indexes, 5)
+        self.assertIn((300, 601, 0), pairs)
+        samplesheet.LIMS_NUMPY = False
+        try:
+            self.assertEqual(samplesheet.close_pairs(indexes, 5), pairs)
+        finally:
+            samplesheet.LIMS_NUMPY = True
+
+    def test_index_lengths(self):
+        libraries = [DNALibrary(i7="ACGTAC", i5="TTGGCCAA"),
+                     DNALibrary(i7="ACGTACGG", i5="TTGGCCAA"),
+                     DNALibrary(i7="CATGCA", i5="TTGGCCAA")]
+        # The i5 indexes are compared position by position despite the
+        # different i7 lengths
+        self.assertEqual([(c.library1.i7, c.library2.i7, c.distance) for c in
+                          samplesheet.find_index_collisions(libraries, 3)],
+                         [("ACGTAC", "ACGTACGG", 2)])
+
+    def test_run_index_collisions(self):
+        run = SequencingRun.objects.get(pk=1)
+        library = DNALibrary.objects.get(pk=2)
+        library.i7, library.i5 = "TAAGGCGA", "TAGATCGG"
+        library.save()
+        libraries = list(run.dna_library.all())
+        collisions = samplesheet.run_index_collisions(run, libraries + [library])
+        self.assertEqual([(c.library1.pk, c.library2.pk) for c in collisions],
+                         [(1, 2)])
+        self.assertEqual(samplesheet.run_index_collisions(
+            run, libraries + [DNALibrary.objects.get(pk=3)]), [])
+        self.assertEqual(samplesheet.run_index_collisions(
+            run, libraries + [library], min_distance=1), [])
+        # Libraries the run already has are not checked against each other
+        run.dna_library.add(library)
+        self.assertEqual(samplesheet.run_index_collisions(
+            run, run.dna_library.all()), [])
+
+
+class SampleSheetTests(TestCase):
+    fixtures = ['example']
+
+    def setUp(self):
+        get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+
+    def test_write_sample_sheet(self):
+        run = SequencingRun.objects.get(pk=1)
+        run.dna_library.add(DNALibrary.objects.get(pk=5))
+        out = BytesIO()
+        samplesheet.write_sample_sheet(out, run)
+        rows = list(csv.reader(BytesIO(out.getvalue())))
+        self.assertEqual(rows[0], ["[Header]"])
+        data = rows[rows.index(["[Data]"]) + 1:]
+        self.assertEqual(data[0], samplesheet.DATA_COLUMNS)
+        self.assertEqual(data[1:], [
+            ["ABCDEA_X01A", "1a", "TAAGGCGA", "TAGATCGC", "ABCDE", "Metagenome"],
+            ["AMZNGA_Y01A", DNALibrary.objects.get(pk=5).sample_name_on_platform,
+             "GGACTCCT", "TAGATCGC", "AMZNG", "Amplicon"]])
+
+    def test_admin(self):
+        url = reverse("admin:lims_sequencingrun_changelist")
+        response = self.client.post(url, {'action': 'download_sample_sheet',
+                                          '_selected_action': [1]})
+        self.assertEqual(response['Content-Type'], "text/csv")
+        self.assertIn("ABCDEA_X01A", response.content)
+
+        response = self.client.post(url, {'action': 'check_index_collisions',
+                                          '_selected_action': [1]}, follow=True)
+        self.assertContains(response, "no index collisions")
+
+        run = SequencingRun.objects.get(pk=1)
+        form = SequencingRunForm(instance=run, data={
+            'uid': run.uid, 'sequencing_center': "c", 'machine': "m",
+            'report': "r", 'folder': "f", 'notes': "n",
+            'protocol': run.protocol_id, 'date': "2014-01-01 00:00:00",
+            'dna_library': [1, 2]})
+        self.assertTrue(form.is_valid())
+        library = DNALibrary.objects.get(pk=2)
+        library.i7 = "TAAGGCGA"
+        library.save()
+        form = SequencingRunForm(instance=run, data=form.data)
+        self.assertFalse(form.is_valid())
+        self.assertIn('dna_library', form.errors)
+
+        # A run that already has colliding libraries can still be edited
+        SequencingRun.dna_library.through.objects.create(sequencingrun=run,
+                                                         dnalibrary=library)
+        form = SequencingRunForm(instance=run, data=form.data)
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.assertEqual(SequencingRun.objects.get(pk=1).notes, "n")
+        self.assertEqual(run.dna_library.count(), 2)
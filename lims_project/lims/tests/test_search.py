@@ -0,0 +1,55 @@
+import json
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from lims import search
+from lims.models import Collaborator, Container, Sample, ExtractedDNA
+
+
+class GlobalSearchTests(TestCase):
+    fixtures = ['example']
+
+    def test_uid_models(self):
+        models = search.uid_models()
+        self.assertIn(Sample, models)
+        self.assertIn(ExtractedDNA, models)
+        self.assertNotIn(Container, models)
+
+    def test_rank(self):
+        with self.assertNumQueries(1):
+            results, has_next = search.search("abcde")
+        self.assertFalse(has_next)
+        self.assertEqual(results[0], search.SearchResult(
+            Sample, Sample.objects.get(uid="ABCDE").pk, "ABCDE", search.EXACT))
+        self.assertEqual(results[1].rank, search.PREFIX)
+        self.assertEqual([r.rank for r in results], sorted(r.rank for r in results))
+
+        self.assertEqual(search.search("BCDE_1")[0][0].rank, search.CONTAINS)
+        self.assertEqual(search.search("no such thing"), ([], False))
+
+    def test_barcodes_and_collaborators(self):
+        results, has_next = search.search("CO:000003")
+        self.assertEqual(results, [search.SearchResult(Container, 3, "CO:000003",
+                                                       search.EXACT)])
+        results, has_next = search.search("SA:ABCDE")
+        self.assertEqual(results[0].model, Sample)
+
+        collaborator = Collaborator.objects.get(pk=1)
+        results, has_next = search.search(collaborator.last_name)
+        self.assertIn((Collaborator, 1), [(r.model, r.pk) for r in results])
+
+    def test_pagination(self):
+        results, has_next = search.search("ABCDE", page_size=2)
+        self.assertEqual(len(results), 2)
+        self.assertTrue(has_next)
+        second_page, has_next = search.search("ABCDE", page=2, page_size=2)
+        self.assertFalse(set(results) & set(second_page))
+
+    def test_view(self):
+        response = self.client.get(reverse("global_search"), {'q': 'ABCDE'})
+        data = json.loads(response.content)
+        self.assertEqual(data['page'], 1)
+        self.assertEqual(data['results'][0]['label'], 'ABCDE')
+        self.assertEqual(data['results'][0]['url'],
+                         reverse("admin:lims_sample_change", args=[data['results'][0]['id']]))
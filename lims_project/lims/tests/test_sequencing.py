@@ -0,0 +1,86 @@
+import os
+import gzip
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase
+
+from lims.models import DNALibrary, ReadFile, SequencingRun
+from lims.sequencing import parse_fastq_filename, ingest_run, match_libraries
+
+
+class ParseFastqFilenameTests(TestCase):
+    def test_parse_fastq_filename(self):
+        self.assertEqual(parse_fastq_filename("AB_12_S3_L002_R2_001.fastq.gz"),
+                         ("AB_12", 2, 2))
+        self.assertEqual(parse_fastq_filename("O10_S1_R1_001.fastq.gz"),
+                         ("O10", 1, 1))
+        self.assertEqual(parse_fastq_filename("N21_ACGTAC-GGTTAA_L001_R1_001.fq"),
+                         ("N21", 1, 1))
+        self.assertIsNone(parse_fastq_filename("O10_S1_L001_I1_001.fastq.gz"))
+        self.assertIsNone(parse_fastq_filename("report.txt"))
+
+
+class IngestRunTests(TransactionTestCase):
+    # Counting reads in parallel can't be done inside a transaction
+    fixtures = ['example']
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        read = "@r\nACGT\n+\nFFFF\n"
+        for filename, nr_reads in [("O10_S1_L001_R1_001.fastq.gz", 3),
+                                   ("O10_S1_L001_R2_001.fastq.gz", 3),
+                                   ("N21_S2_L001_R1_001.fastq.gz", 5),
+                                   ("unknown_S3_L001_R1_001.fastq.gz", 1)]:
+            with gzip.open(os.path.join(self.directory, filename), 'wb') as f:
+                f.write(read * nr_reads)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_ingest_run(self):
+        run = SequencingRun.objects.get(pk=1)
+        nr_read_files = ReadFile.objects.count()
+
+        read_files, unmatched, ambiguous = ingest_run(run, self.directory,
+                                                      count_reads=True,
+                                                      processes=2)
+        self.assertEqual(unmatched, ["unknown"])
+        self.assertEqual(ambiguous, [])
+        self.assertEqual(ReadFile.objects.count(), nr_read_files + 3)
+        self.assertEqual(
+            sorted(ReadFile.objects.filter(sequencing_run=run, folder=self.directory)
+                   .values_list('filename', 'pair', 'read_count')),
+            [("N21_S2_L001_R1_001.fastq.gz", 1, 5),
+             ("O10_S1_L001_R1_001.fastq.gz", 1, 3),
+             ("O10_S1_L001_R2_001.fastq.gz", 2, 3)])
+        self.assertTrue(run.dna_library.filter(sample_name_on_platform="N21").exists())
+
+        # Files that are already registered are skipped
+        read_files, unmatched, ambiguous = ingest_run(run, self.directory)
+        self.assertEqual(read_files, [])
+
+    def test_match_libraries(self):
+        libraries = [DNALibrary(pk=1, sample_name_on_platform="N21"),
+                     DNALibrary(pk=2, sample_name_on_platform="N21"),
+                     DNALibrary(pk=3, sample_name_on_platform="O10")]
+        matched, ambiguous = match_libraries(libraries, set())
+        self.assertEqual(ambiguous, set(["N21"]))
+        self.assertEqual(matched.keys(), ["O10"])
+        # The library of the run is preferred
+        matched, ambiguous = match_libraries(libraries, set([2]))
+        self.assertEqual(ambiguous, set())
+        self.assertEqual(matched["N21"].pk, 2)
+
+    def test_index_collision(self):
+        run = SequencingRun.objects.get(pk=1)
+        library = DNALibrary.objects.get(sample_name_on_platform="N21")
+        library.i7 = run.dna_library.all()[0].i7
+        library.i5 = run.dna_library.all()[0].i5
+        library.save()
+        nr_read_files = ReadFile.objects.count()
+        self.assertRaises(CommandError, call_command, 'ingest_run', run.uid,
+                          self.directory, count_reads=True)
+        self.assertEqual(ReadFile.objects.count(), nr_read_files)
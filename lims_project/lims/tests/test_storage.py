@@ -0,0 +1,68 @@
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+
+from lims.labdata import generate_lab_data
+from lims.models import Container, ContainerType, ExtractedDNA, Sample
+from lims.storage import in_apparatus, resolve_storage_paths, position_label
+
+
+class StoragePathTests(TestCase):
+    def setUp(self):
+        generate_lab_data(3, sag_every=0)
+        self.box = Container.objects.get(notes="Box 0")
+        self.box_label = unicode(self.box)
+
+    def test_position_label(self):
+        self.assertEqual(position_label(Container(row=2, column=4)), "B04")
+        self.assertEqual(position_label(self.box), self.box_label)
+
+    def test_resolve(self):
+        samples = Sample.objects.order_by('uid')
+        with self.assertNumQueries(3):
+            samples = resolve_storage_paths(samples)
+        with self.assertNumQueries(0):
+            paths = [s.storage_path for s in samples]
+        self.assertEqual(paths, ["Generated freezer 0 > Rack 1 > %s > A%02d" %
+                                 (self.box_label, i + 1) for i in range(3)])
+
+    def test_nested_and_multiple(self):
+        """A rack container between the box and the rack subdivision, and a
+        DNA stored in two places"""
+        rack = Container(
+            type=ContainerType.objects.create(name="Rack", divisible=True),
+            apparatus_subdivision=self.box.apparatus_subdivision)
+        rack.save()
+        self.box.apparatus_subdivision = None
+        self.box.parent = rack
+        self.box.row, self.box.column = 1, 3
+        self.box.save()
+
+        dna = ExtractedDNA.objects.order_by('id')[0]
+        content_type = ContentType.objects.get_for_model(ExtractedDNA)
+        for well in self.box.child.filter(row=8, column__in=[11, 12]):
+            well.content_type, well.object_id = content_type, dna.pk
+            well.save()
+        sample = Sample.objects.order_by('uid')[0]
+
+        objects = resolve_storage_paths([sample, dna])
+        prefix = "Generated freezer 0 > Rack 1 > %s > A03 > " % unicode(rack)
+        self.assertEqual(objects[0].storage_path, prefix + "A01")
+        self.assertEqual(objects[1].storage_path, "%sH11; %sH12" % (prefix, prefix))
+
+    def test_property(self):
+        sample = Sample.objects.order_by('uid')[1]
+        self.assertTrue(sample.storage_path.endswith(" > A02"))
+        self.assertEqual(ExtractedDNA.objects.all()[0].storage_path, "")
+
+    def test_in_apparatus(self):
+        apparatus = self.box.apparatus_subdivision.apparatus
+        wells = set(self.box.child.values_list('pk', flat=True))
+        with self.assertNumQueries(1):
+            found = set(in_apparatus(Container.objects.all(), apparatus.pk)
+                        .values_list('pk', flat=True))
+        self.assertEqual(found, wells | set([self.box.pk]))
+        # A cycle of parents ends
+        well = self.box.child.order_by('pk')[0]
+        Container.objects.filter(pk=self.box.pk).update(parent=well)
+        self.assertEqual(set(in_apparatus(Container.objects.all(), apparatus.pk)
+                             .values_list('pk', flat=True)), found)
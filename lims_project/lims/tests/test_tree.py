@@ -0,0 +1,71 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from lims.models import Sample, ExtractedDNA
+
+
+class SampleTreeTests(TestCase):
+    fixtures = ['example']
+
+    def setUp(self):
+        get_user_model().objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+
+    def get_children(self, model_slug, pk):
+        response = self.client.get(reverse('tree_children', args=[model_slug, pk]))
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)['children']
+
+    def test_page_has_direct_children_only(self):
+        sample = Sample.objects.get(uid="ABCDE")
+        response = self.client.get(reverse('sample_tree', args=[sample.pk]))
+        self.assertContains(response, '"ABCDE_1"')
+        self.assertContains(response, reverse('tree_children',
+                                              args=['extracteddna', 1]))
+        self.assertNotContains(response, "ABCDEA_X01")
+
+    def test_children(self):
+        dna = ExtractedDNA.objects.get(uid="ABCDE_1")
+        children = self.get_children('sample', dna.sample_id)
+        self.assertEqual([g['model'] for g in children], ['extracteddna'])
+        node = children[0]['nodes'][0]
+        self.assertEqual((node['id'], node['label'], node['child_count']),
+                         (dna.pk, "ABCDE_1", 2))
+        self.assertEqual(node['url'], reverse('lims.views.browse.extracteddna',
+                                              args=[dna.pk]))
+
+        children = self.get_children('extracteddna', dna.pk)
+        self.assertEqual(set((g['model'], n['label']) for g in children
+                             for n in g['nodes']),
+                         set([('metagenome', "ABCDEA_X01"),
+                              ('dnafrompureculture', "ABCDEA_Z01")]))
+        self.assertEqual(self.get_children('readfile', 1), [])
+
+    def test_query_count(self):
+        # The session and user, the ExtractedDNA, its children per model and
+        # their child counts per relation, not per object
+        dna = ExtractedDNA.objects.get(uid="ABCDE_1")
+        url = reverse('tree_children', args=['extracteddna', dna.pk])
+        with self.assertNumQueries(8):
+            self.client.get(url)
+
+    def test_not_found(self):
+        response = self.client.get(reverse('tree_children', args=['nosuchmodel', 1]))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('tree_children', args=['sample', 9999]))
+        self.assertEqual(response.status_code, 404)
+        # Only nodes of the sample tree
+        response = self.client.get(reverse('tree_children', args=['userprofile', 1]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_login_required(self):
+        self.client.logout()
+        dna = ExtractedDNA.objects.get(uid="ABCDE_1")
+        response = self.client.get(reverse('tree_children',
+                                           args=['extracteddna', dna.pk]))
+        # The admin login page instead of the JSON
+        self.assertNotEqual(response['Content-Type'], "application/json")
+        self.assertContains(response, "login")
@@ -0,0 +1,78 @@
+import tablib
+from django.test import TestCase
+
+from lims.models import Container, DNALibrary
+from lims.validation import BatchValidator, SampleValidator, ContainerValidator
+
+
+class DNALibraryValidator(BatchValidator):
+    model = DNALibrary
+    exclusive_columns = ((('amplicon', 'metagenome', 'sag', 'pure_culture'),
+                          "One DNA source"), )
+    unique_columns = ('sample_name_on_platform', )
+
+
+class BatchValidatorTests(TestCase):
+    fixtures = ['example']
+
+    def test_sample_validator(self):
+        dataset = tablib.Dataset(headers=['uid', 'collaborator'])
+        dataset.append(["ALOHA", 1])
+        dataset.append(["aloha", 1])
+        dataset.append(["ALOHA", 1])
+        dataset.append(["ABCDE", 1])
+        with self.assertNumQueries(0):
+            errors = SampleValidator('uid').validate(dataset)
+        self.assertEqual([(e.row, e.columns) for e in errors],
+                         [(0, ('uid', )), (1, ('uid', )), (2, ('uid', ))])
+        # An existing uid is an error when not matching on uid
+        self.assertEqual([e.row for e in SampleValidator().validate(dataset)],
+                         [0, 1, 2, 3])
+
+    def test_container_validator(self):
+        dataset = tablib.Dataset(headers=['id', 'type', 'row', 'column',
+                                          'parent', 'apparatus_subdivision',
+                                          'content_type', 'object_id'])
+        dataset.append(["", 4, 1, 1, 3, 1, "", ""])
+        dataset.append(["", 4, 1, 2, "", "", "", ""])
+        dataset.append(["", 4, 1, 3, 3, "", 15, ""])
+        dataset.append(["", 4, 1, 4, 3, "", "", ""])
+        dataset.append(["", 4, 1, 4, 3, "", "", ""])
+        errors = ContainerValidator().validate(dataset)
+        self.assertEqual([e.row for e in errors], [0, 1, 2, 3, 4])
+
+    def test_missing_columns(self):
+        # Only the changed columns of existing containers
+        dataset = tablib.Dataset(headers=['id', 'notes'])
+        dataset.append([4, "moved"])
+        self.assertEqual(ContainerValidator().validate(dataset), [])
+        # The other columns are taken from the existing containers
+        dataset = tablib.Dataset(headers=['id', 'apparatus_subdivision'])
+        dataset.append([4, 1])
+        dataset.append([5, ""])
+        existing = Container.objects.in_bulk([4, 5])
+        errors = ContainerValidator(existing=existing).validate(dataset)
+        self.assertEqual([(e.row, e.columns) for e in errors],
+                         [(0, ('parent', 'apparatus_subdivision'))])
+
+    def test_dna_library_validator(self):
+        dataset = tablib.Dataset(headers=['id', 'amplicon', 'sag',
+                                          'sample_name_on_platform'])
+        dataset.append(["", 1, 1, "new1"])
+        dataset.append(["", "", 1, "O10"])
+        dataset.append([2, "", 1, "O10"])
+        errors = DNALibraryValidator().validate(dataset)
+        self.assertEqual([(e.row, e.columns) for e in errors],
+                         [(0, ('amplicon', 'metagenome', 'sag', 'pure_culture')),
+                          (1, ('sample_name_on_platform', )),
+                          (1, ('sample_name_on_platform', )),
+                          (2, ('sample_name_on_platform', ))])
+
+    def test_unique_chunks(self):
+        dataset = tablib.Dataset(headers=['id', 'sample_name_on_platform'])
+        for i in range(1200):
+            dataset.append(["", "new%d" % i])
+        dataset.append(["", "O10"])
+        with self.assertNumQueries(3):
+            errors = DNALibraryValidator().validate(dataset)
+        self.assertEqual([e.row for e in errors], [1200])
@@ -0,0 +1,143 @@
+import csv
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from lims import worklists
+from lims.models import Container, Sample
+from lims.tests.utils import make_plate
+
+
+class WorklistTests(TestCase):
+    fixtures = ['example']
+
+    def setUp(self):
+        self.source = make_plate(16, 24)
+        self.destinations = [make_plate(8, 12) for i in range(4)]
+        # Samples in A01, A02, B01, B02 and P24
+        self.wells = [(1, 1), (1, 2), (2, 1), (2, 2), (16, 24)]
+        for pk, (row, column) in enumerate(self.wells, 1):
+            Container.objects.filter(parent=self.source, row=row, column=column) \
+                .update(content_type=ContentType.objects.get_for_model(Sample),
+                        object_id=pk)
+
+    def test_parse_well(self):
+        self.assertEqual(worklists.parse_well("B04"), (2, 4))
+        self.assertEqual(worklists.parse_well("p24"), (16, 24))
+        self.assertRaises(ValueError, worklists.parse_well, "4B")
+
+    def test_quadrants(self):
+        self.assertEqual([worklists.quadrants(r, c) for (r, c) in self.wells],
+                         [(0, 1, 1), (1, 1, 1), (2, 1, 1), (3, 1, 1), (3, 8, 12)])
+
+    def test_plan_transfers(self):
+        with self.assertNumQueries(1):
+            pairs = worklists.plan_transfers(self.source, self.destinations,
+                                             worklists.quadrants)
+            transfers = worklists.transfers(pairs, 2.5)
+        self.assertEqual([(t.source_well, t.destination_plate, t.destination_well)
+                          for t in transfers],
+                         [("A01", self.destinations[0].barcode, "A01"),
+                          ("A02", self.destinations[1].barcode, "A01"),
+                          ("B01", self.destinations[2].barcode, "A01"),
+                          ("B02", self.destinations[3].barcode, "A01"),
+                          ("P24", self.destinations[3].barcode, "H12")])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(worklists.apply_moves(pairs), 5)
+        well = Container.objects.get(parent=self.destinations[3], row=8, column=12)
+        self.assertEqual(well.content_object, Sample.objects.get(pk=5))
+        # The source wells are emptied
+        self.assertFalse(Container.objects.filter(
+            parent=self.source, object_id__isnull=False).exists())
+        # Nothing left to move
+        self.assertEqual(worklists.plan_transfers(self.source, self.destinations,
+                                                  worklists.quadrants), [])
+
+    def test_one_to_one_and_cherry_pick(self):
+        # P24 has no well on a 96 well plate
+        self.assertRaises(Exception, worklists.plan_transfers, self.source,
+                          self.destinations[:1])
+        # Two source wells into C03
+        rule = worklists.cherry_pick([("A02", "C03"), ("B01", "C03")])
+        self.assertRaises(Exception, worklists.plan_transfers, self.source,
+                          self.destinations[:1], rule)
+        self.assertRaises(ValueError, worklists.cherry_pick, [("A02", "C03", -1)])
+        rule = worklists.cherry_pick([("A02", "C03"), ("P24", "H12", 1)])
+        pairs = worklists.plan_transfers(self.source, self.destinations[:2], rule)
+        self.assertEqual([(d.parent_id, worklists.position_label(d))
+                          for (s, d) in pairs],
+                         [(self.destinations[0].pk, "C03"),
+                          (self.destinations[1].pk, "H12")])
+
+    def test_formats(self):
+        transfers = [worklists.Transfer(self.source.barcode, "B01",
+                                        self.destinations[0].barcode, "A02", 2.5)]
+        rows = worklists.plate_rows([self.source] + self.destinations)
+        self.assertEqual(rows[self.source.barcode], 16)
+        self.assertEqual(rows[self.destinations[0].barcode], 8)
+
+        out = BytesIO()
+        worklists.write_echo(out, transfers)
+        self.assertEqual(list(csv.reader(BytesIO(out.getvalue())))[1],
+                         [self.source.barcode, "B01", self.destinations[0].barcode,
+                          "A02", "2500"])
+        out = BytesIO()
+        worklists.write_hamilton(out, transfers, rows)
+        self.assertEqual(list(csv.reader(BytesIO(out.getvalue())))[1],
+                         [self.source.barcode, "2", self.destinations[0].barcode,
+                          "9", "2.50"])
+        out = BytesIO()
+        worklists.write_tecan(out, transfers, rows)
+        self.assertEqual(out.getvalue().splitlines(),
+                         ["A;%s;;;2;;2.50" % self.source.barcode,
+                          "D;%s;;;9;;2.50" % self.destinations[0].barcode, "W;"])
+
+    def test_command(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "worklist.csv")
+            barcodes = [p.barcode for p in [self.source] + self.destinations]
+            call_command('worklist', *barcodes, rule='quadrants', volume=1.0,
+                         format='echo', output=path, apply=True,
+                         stderr=BytesIO())
+            with open(path, 'rb') as f:
+                rows = list(csv.reader(f))
+            self.assertEqual(len(rows), 6)
+            self.assertEqual(rows[5], [barcodes[0], "P24", barcodes[4], "H12", "1000"])
+            self.assertEqual(Container.objects.filter(
+                parent__in=self.destinations, object_id__isnull=False).count(), 5)
+            self.assertFalse(Container.objects.filter(
+                parent=self.source, object_id__isnull=False).exists())
+            # Applied already, the destination wells are taken
+            Container.objects.filter(parent=self.source, row=1, column=1).update(
+                content_type=ContentType.objects.get_for_model(Sample),
+                object_id=1)
+            self.assertRaises(CommandError, call_command, 'worklist', *barcodes,
+                              rule='quadrants', volume=1.0, output=path)
+            self.assertRaises(CommandError, call_command, 'worklist', barcodes[0],
+                              "SA:1", volume=1.0)
+            # Plates of the picks file are numbered from 1
+            picks = os.path.join(directory, "picks.csv")
+            with open(picks, 'wb') as f:
+                f.write("A01,A01,0\n")
+            self.assertRaises(CommandError, call_command, 'worklist', *barcodes,
+                              rule='cherry_pick', picks=picks, volume=1.0)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_command_write_failure(self):
+        barcodes = [p.barcode for p in [self.source] + self.destinations]
+        self.assertRaises(IOError, call_command, 'worklist', *barcodes,
+                          rule='quadrants', volume=1.0, apply=True,
+                          output=os.path.join(tempfile.gettempdir(), "missing",
+                                              "worklist.csv"))
+        # Nothing is moved
+        self.assertEqual(Container.objects.filter(
+            parent=self.source, object_id__isnull=False).count(), 5)
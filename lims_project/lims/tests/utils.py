@@ -0,0 +1,12 @@
+"""Helpers shared by the tests"""
+from lims.models import Container
+
+
+def make_plate(rows, columns, subdivision_id=3):
+    """Returns a new plate with an empty well Container per row and column"""
+    plate = Container(type_id=2, apparatus_subdivision_id=subdivision_id)
+    plate.save()
+    Container.objects.bulk_create([
+        Container(type_id=4, parent=plate, row=row, column=column)
+        for row in range(1, rows + 1) for column in range(1, columns + 1)])
+    return plate
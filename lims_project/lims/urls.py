@@ -2,11 +2,8 @@ from __future__ import print_function
 
 from django.conf.urls import patterns, url
 from django.core.urlresolvers import reverse
-from django.db.models import get_models
-from django.template.defaultfilters import slugify
 
-import lims
-from lims import views
+from lims import metadata, views
 
 
 def default_model_views():
@@ -20,16 +17,15 @@ def default_model_views():
 
     # Create urls for all models in lims if they have a preffered_ordering
     # attribute
-    for model in get_models(app_mod=lims.models):
-        #print(model.__name__, file=sys.stderr)
-        if hasattr(model, 'preferred_ordering'):
-            urls += [url(r'^browse/' + slugify(model.__name__) + r'/(\d+)/$',
-                         views.default_object_table(model), name='lims.views.browse.'
-                         + slugify(model.__name__))]
-            model.get_absolute_url = gen_absolute_url(slugify(model.__name__))
-        urls += [url(r'^browse/%s$' % slugify(model.__name__),
-                     views.default_object_list(model),
-                     name='lims.views.browse.' + slugify(model.__name__))]
+    for meta in metadata.build_registry():
+        #print(meta.name, file=sys.stderr)
+        if meta.has_object_view:
+            urls += [url(r'^browse/' + meta.slug + r'/(\d+)/$',
+                         views.default_object_table(meta.model), name=meta.view_name)]
+            meta.model.get_absolute_url = gen_absolute_url(meta.slug)
+        urls += [url(r'^browse/%s$' % meta.slug,
+                     views.default_object_list(meta.model),
+                     name=meta.view_name)]
 
     return urls
 
@@ -39,7 +35,11 @@ urlpatterns = patterns(*['lims.views'] +
     [
     url(r'^$', views.index, name='index'),
     url(r'^browse/$', views.browse, name='browse'),
-    url(r'^tree/sample/(\d+)/$', views.sample_tree_json, name='sample_tree'),
+    url(r'^tree/sample/(\d+)/$', views.sample_tree, name='sample_tree'),
+    url(r'^tree/(\w+)/(\d+)/children/$', views.tree_children_json,
+        name='tree_children'),
     url(r'^barcode/$', views.barcode_index, name='barcode_index'),
-    url(r'^barcode/(.*)/$', views.barcode_search, name='barcode_search')]
+    url(r'^barcode/(.*)/$', views.barcode_search, name='barcode_search'),
+    url(r'^search/$', views.global_search, name='global_search'),
+    url(r'^stats/requests/$', views.request_stats, name='request_stats')]
 )
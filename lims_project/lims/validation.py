@@ -0,0 +1,169 @@
+"""Batch validation of import datasets. The rules of the clean() methods of
+the models are applied column by column over a whole tablib Dataset before
+anything is written, and uniqueness is checked against the database with one
+query per unique column and IN_CHUNK_SIZE values, so all errors in a file are
+reported in one pass."""
+from __future__ import print_function
+from collections import namedtuple, Counter
+
+from django.core.exceptions import ValidationError
+
+from lims.models import Sample, Container, SAMPLE_UID_RE
+from lims.storage import IN_CHUNK_SIZE
+
+
+RowError = namedtuple('RowError', ['row', 'columns', 'message'])
+
+
+def is_null(value):
+    return value is None or value == ""
+
+
+def to_python(field, value):
+    """Converts an imported value for the given model field, None for empty
+    values. Foreign keys are converted to the type of the related pk."""
+    if is_null(value):
+        return None
+    if field.rel is not None:
+        field = field.rel.get_related_field()
+    return field.to_python(value)
+
+
+class BatchValidator(object):
+    """Validates the rows of a Dataset for model. Subclasses declare:
+
+    * ``regex_columns`` - (column, compiled regex, message) triples
+    * ``exclusive_columns`` - (columns, message) pairs of which exactly one
+      column should be set
+    * ``unique_columns`` - columns that should be unique in the file and in
+      the database
+    * ``unique_together`` - tuples of columns that should be unique together
+      in the file and in the database
+
+    Rows are matched to existing objects on key_column (the pk by default),
+    so a row may keep its own unique values when it updates an object.
+    existing is an optional dictionary of those objects by key, the columns
+    missing from the dataset are taken from them. Rules of which none of the
+    columns are in the dataset are skipped."""
+    model = None
+    regex_columns = ()
+    exclusive_columns = ()
+    unique_columns = ()
+    unique_together = ()
+
+    def __init__(self, key_column=None, existing=None):
+        self.key_column = key_column or self.model._meta.pk.name
+        self.existing = existing or {}
+
+    def column(self, dataset, name):
+        """Returns the cleaned values of a column. If the column is not in
+        the dataset, the values of the existing objects of the rows, None for
+        new rows."""
+        field = self.model._meta.get_field(name)
+        if name in dataset.headers:
+            return [to_python(field, v) for v in dataset[name]]
+        if not self.existing or name == self.key_column:
+            return [None] * dataset.height
+        return [getattr(self.existing[k], field.attname) if k in self.existing
+                else None for k in self.column(dataset, self.key_column)]
+
+    def validate(self, dataset):
+        """Returns a list of RowErrors, sorted by row"""
+        errors = []
+        for name, regex, message in self.regex_columns:
+            if name in dataset.headers:
+                errors += [RowError(i, (name, ), message) for (i, v) in
+                           enumerate(dataset[name]) if regex.match(str(v)) is None]
+
+        for names, message in self.exclusive_columns:
+            if not any(n in dataset.headers for n in names):
+                continue
+            nr_set = [sum(not is_null(v) for v in values) for values in
+                      zip(*[self.column(dataset, n) for n in names])]
+            errors += [RowError(i, names, message) for (i, n) in
+                       enumerate(nr_set) if n != 1]
+
+        keys = self.column(dataset, self.key_column)
+        for name in self.unique_columns:
+            errors += self.check_unique(dataset, (name, ), keys)
+        for names in self.unique_together:
+            errors += self.check_unique(dataset, names, keys)
+
+        errors.extend(self.validate_extra(dataset))
+        return sorted(errors)
+
+    def validate_extra(self, dataset):
+        """Override to add model specific checks"""
+        return []
+
+    def check_unique(self, dataset, names, keys):
+        """Checks that the combination of values in the given columns is unique
+        within the dataset and does not belong to another object in the
+        database. Rows with a null value in any of the columns are not
+        checked, like SQL does."""
+        values = zip(*[self.column(dataset, n) for n in names])
+        rows = [(i, v) for (i, v) in enumerate(values)
+                if not any(x is None for x in v)]
+        if not rows:
+            return []
+        message = "%s should be unique" % ", ".join(names)
+        errors = []
+
+        counts = Counter(v for (i, v) in rows)
+        errors += [RowError(i, names, message + " within the file") for (i, v)
+                   in rows if counts[v] > 1]
+        if names == (self.key_column, ):
+            # Rows with an existing key update that object
+            return errors
+
+        attnames = [self.model._meta.get_field(n).attname for n in names]
+        key_attname = self.model._meta.get_field(self.key_column).attname
+        # Each combination adds a value per column to the query
+        values = sorted(counts)
+        chunk_size = IN_CHUNK_SIZE // len(names)
+        existing = {}
+        for k in range(0, len(values), chunk_size):
+            chunk = values[k:k + chunk_size]
+            existing.update(
+                (tuple(r[:-1]), r[-1]) for r in self.model.objects.filter(
+                    **dict((a + '__in', set(v[j] for v in chunk))
+                           for (j, a) in enumerate(attnames)))
+                .values_list(*(attnames + [key_attname])))
+        errors += [RowError(i, names, message) for (i, v) in rows
+                   if v in existing and existing[v] != keys[i]]
+        return errors
+
+    def raise_errors(self, dataset):
+        """Raises a ValidationError with all errors in dataset"""
+        errors = self.validate(dataset)
+        if errors:
+            raise ValidationError(["Line %d (%s): %s" % (e.row + 1,
+                                                          ", ".join(e.columns),
+                                                          e.message)
+                                   for e in errors])
+
+
+class SampleValidator(BatchValidator):
+    model = Sample
+    regex_columns = (('uid', SAMPLE_UID_RE, "UID should consist of five "
+                      "alphanumeric characters. Only capitals allowed."), )
+    unique_columns = ('uid', )
+
+
+class ContainerValidator(BatchValidator):
+    model = Container
+    exclusive_columns = ((('parent', 'apparatus_subdivision'), "A container "
+                          "should have either a parent or an "
+                          "apparatus_subdivision, not both."), )
+    unique_together = (('row', 'column', 'parent'), )
+
+    def validate_extra(self, dataset):
+        if 'content_type' not in dataset.headers and \
+                'object_id' not in dataset.headers:
+            return []
+        return [RowError(i, ('content_type', 'object_id'), "If content_type is "
+                         "set an object_id should also be set.")
+                for (i, (ct, oid)) in enumerate(zip(
+                    self.column(dataset, 'content_type'),
+                    self.column(dataset, 'object_id')))
+                if ct is not None and oid is None]
@@ -3,14 +3,17 @@ from __future__ import print_function
 import sys
 
 import json
+from collections import defaultdict
 
-from django.shortcuts import render
-from django.http import Http404
+from django.contrib.admin.views.decorators import staff_member_required
+from django.shortcuts import render, get_object_or_404
+from django.http import Http404, HttpResponse
 from django.core.urlresolvers import reverse
-from django.template.defaultfilters import slugify
-from django.utils.text import capfirst
+from django.db.models import Count
 
-from lims.models import Amplicon, Container, DNALibrary, Sample, SAGPlate, SAGPlateDilution, ExtractedCell, ExtractedDNA
+from lims.models import Sample, LINEAGE_MODELS, parse_barcode
+from lims.metadata import model_metadata, metadata_by_slug
+from lims import search, middleware
 
 
 def index(request):
@@ -25,52 +28,113 @@ def get_attr_list(obj):
     """Returns a [(key, value), ...] list for given object. The object should
     implement a preffered_ordering function that returns a list of attribute
     names."""
-    return [(k, getattr(obj, k)) for k in obj.preferred_ordering()]
+    return model_metadata(obj).attribute_rows(obj)
 
 
 def default_object_table(obj):
+    meta = model_metadata(obj)
+
     def func(request, obj_id):
         o = obj.objects.get(pk=obj_id)
-        verbose_name = unicode(capfirst(obj._meta.verbose_name))
-        verbose_name_plural = unicode(capfirst(obj._meta.verbose_name_plural))
         return render(request, 'lims/object.html',
-                      {'objectname': obj.__name__, 'verbose_name':
-                       verbose_name, 'verbose_name_plural':
-                       verbose_name_plural, 'object': o})
+                      {'objectname': meta.name, 'verbose_name':
+                       meta.verbose_name, 'verbose_name_plural':
+                       meta.verbose_name_plural, 'object': o,
+                       'rows': meta.attribute_rows(o)})
     return func
 
 
 def default_object_list(obj):
+    meta = model_metadata(obj)
+
     def func(request):
-        verbose_name = unicode(capfirst(obj._meta.verbose_name))
-        verbose_name_plural = unicode(capfirst(obj._meta.verbose_name_plural))
+        objects = obj.objects.all()
+        if meta.unicode_select_related:
+            objects = objects.select_related(*meta.unicode_select_related)
         return render(request, 'lims/object_list.html',
-                      {'objectname': obj.__name__, 'verbose_name':
-                       verbose_name, 'verbose_name_plural':
-                       verbose_name_plural, 'objects':
-                       list(obj.objects.all())})
+                      {'objectname': meta.name, 'verbose_name':
+                       meta.verbose_name, 'verbose_name_plural':
+                       meta.verbose_name_plural, 'objects': list(objects),
+                       'has_object_view': meta.has_object_view})
     return func
 
 
-def generate_related_objects_tree(obj):
-    rv = {"url": reverse('lims.views.browse.' + slugify(type(obj).__name__),
-                                                 args=[obj.id])}
-
-    for ro in obj._meta.get_all_related_objects():
-        for o in getattr(obj, ro.get_accessor_name()).all():
-            rv.setdefault(type(o).__name__, {})[str(o)] = generate_related_objects_tree(o)
-
-    return rv
-
-
-def sample_tree_json(request, sample_id):
-    sample = Sample.objects.get(pk=sample_id)
+def object_url(obj):
+    return reverse(model_metadata(obj).view_name, args=[obj.id])
+
+
+def json_for_script(data):
+    """Returns data as JSON that can be put inside a <script> element"""
+    return json.dumps(data).replace("<", "\\u003c").replace(">", "\\u003e") \
+        .replace("&", "\\u0026")
+
+
+def count_children(model, queryset):
+    """Returns a dictionary with the number of objects referring with a
+    foreign key to each object of model in queryset. Uses one query per
+    relation."""
+    counts = defaultdict(int)
+    for ro in model_metadata(model).related_objects:
+        for pk, count in ro.model.objects.filter(**{ro.field_name + '__in':
+                                                    queryset.values('pk')}) \
+                .order_by().values_list(ro.field_name).annotate(Count('pk')):
+            counts[pk] += count
+    return counts
+
+
+def tree_node(obj, child_count):
+    """Returns the node of obj in the sample tree"""
+    meta = model_metadata(obj)
+    return {"model": meta.slug,
+            "id": obj.pk,
+            "label": unicode(obj),
+            "url": object_url(obj) if meta.has_object_view else None,
+            "children_url": reverse('tree_children', args=[meta.slug, obj.pk]),
+            "child_count": child_count}
+
+
+def tree_children(obj):
+    """Returns the objects that refer to obj with a foreign key as tree nodes,
+    grouped by model, with the number of children of each node. Uses one
+    query per relation of obj and of the models referring to it, whatever the
+    number of objects."""
+    groups = []
+    for ro in model_metadata(obj).related_objects:
+        meta = model_metadata(ro.model)
+        queryset = ro.model.objects.filter(**{ro.field_name: obj.pk}) \
+            .select_related(*meta.unicode_select_related).order_by('pk')
+        children = list(queryset)
+        if not children:
+            continue
+        counts = count_children(ro.model, queryset)
+        groups.append({"model": meta.slug,
+                       "verbose_name_plural": meta.verbose_name_plural,
+                       "nodes": [tree_node(o, counts[o.pk]) for o in children]})
+    return groups
+
+
+def sample_tree(request, sample_id):
+    """Shows the sample and its direct children, the other levels of the tree
+    are fetched from tree_children_json when expanded"""
+    sample = get_object_or_404(Sample, pk=sample_id)
+    root = tree_node(sample, count_children(
+        Sample, Sample.objects.filter(pk=sample.pk))[sample.pk])
+    root["children"] = tree_children(sample)
+    return render(request, 'lims/sampletree.html',
+                  {'sample': sample, 'json': json_for_script(root)})
 
-    response_data = {'Sample': {}}
-    response_data['Sample'][str(sample)] = generate_related_objects_tree(sample)
 
-    return render(request, 'lims/sampletree.html',
-                  {'json': json.dumps(response_data)})
+@staff_member_required
+def tree_children_json(request, model_slug, object_id):
+    """Returns the children of a node in the sample tree as JSON, nodes are
+    Samples or objects of the LINEAGE_MODELS"""
+    meta = metadata_by_slug(model_slug)
+    if meta is None or meta.model not in [Sample] + LINEAGE_MODELS:
+        raise Http404
+    obj = get_object_or_404(meta.model, pk=object_id)
+    response_data = {"model": meta.slug, "id": obj.pk,
+                     "children": tree_children(obj)}
+    return HttpResponse(json.dumps(response_data), content_type="application/json")
 
 
 def barcode_index(request):
@@ -78,23 +142,43 @@ def barcode_index(request):
 
 
 def barcode_search(request, barcode):
-    #try:
-    barcode_model = {
-        "AM": Amplicon,
-        "SA": Sample,
-        "CO": Container,
-        "EC": ExtractedCell,
-        "ED": ExtractedDNA,
-        "SP": SAGPlate,
-        "SD": SAGPlateDilution,
-        "DL": DNALibrary,
-    }[barcode[:2]]
-    #except KeyError:
-    #    raise Http404
-
-    if barcode.startswith("CO:"):
-        c = Container.objects.get(pk=int(barcode[3:]))
-        return default_object_table(barcode_model)(request, c.id)
-    else:
-        o = barcode_model.objects.get(uid=barcode[3:])
-        return default_object_table(barcode_model)(request, o.id)
+    parsed = parse_barcode(barcode)
+    if parsed is None:
+        raise Http404
+    barcode_model, lookup = parsed
+    o = get_object_or_404(barcode_model, **lookup)
+    return default_object_table(barcode_model)(request, o.id)
+
+
+def global_search(request):
+    """Returns a page of search results over all objects with a UID,
+    Container barcodes and Collaborator names as JSON. GET parameters are q
+    and page."""
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        raise Http404
+    results, has_next = search.search(request.GET.get('q', ''), page)
+    response_data = {
+        'page': page,
+        'has_next': has_next,
+        'results': [{'model': r.model.__name__,
+                     'verbose_name': model_metadata(r.model).verbose_name,
+                     'id': r.pk,
+                     'label': r.label,
+                     'rank': r.rank,
+                     'url': reverse('admin:lims_%s_change' % r.model._meta.model_name,
+                                    args=[r.pk])} for r in results],
+    }
+    return HttpResponse(json.dumps(response_data), content_type="application/json")
+
+
+@staff_member_required
+def request_stats(request):
+    """Shows the request statistics per URL name collected by
+    QueryStatsMiddleware in this process"""
+    bounds = middleware.HISTOGRAM_BUCKETS
+    buckets = ["<= %d ms" % b for b in bounds] + ["> %d ms" % bounds[-1]]
+    return render(request, 'lims/request_stats.html',
+                  {'entries': middleware.histogram.summary(),
+                   'buckets': buckets})
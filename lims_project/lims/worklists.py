@@ -0,0 +1,226 @@
+"""Worklists for liquid handlers: the transfers of a volume from a well of a
+source plate to a well of a destination plate, written in the CSV format of
+the liquid handler that executes them. Plates are Containers whose children
+are the well Containers, identified by the barcode of the plate and the
+position of the well, e.g. B04.
+
+plan_transfers maps the wells of a source plate to the wells of destination
+plates with a mapping rule: one_to_one, quadrants (a 384 well plate to four
+96 well plates) or a cherry_pick list. All wells are fetched with one query
+and mapped in one pass over their rows and columns. apply_moves moves the
+transferred objects from the source to the destination wells with one bulk
+UPDATE."""
+from __future__ import print_function
+import csv
+import string
+from collections import namedtuple
+
+from django.db.models import Max
+
+from lims.bulk import bulk_update
+from lims.models import Container
+from lims.storage import position_label
+
+Transfer = namedtuple('Transfer', ['source_plate', 'source_well',
+                                   'destination_plate', 'destination_well',
+                                   'volume'])
+
+CSV_COLUMNS = ['Source Plate', 'Source Well', 'Destination Plate',
+               'Destination Well', 'Volume']
+
+
+def well_position(container):
+    """Returns the (plate barcode, well) of a well Container, the plate is
+    the parent Container. The parent should be selected with the
+    container."""
+    plate = container.parent
+    return (plate.barcode if plate is not None else None,
+            position_label(container))
+
+
+def format_volume(volume):
+    return "%.2f" % volume
+
+
+def write_csv(out, transfers):
+    """Writes the transfers as CSV to the file like object out"""
+    writer = csv.writer(out)
+    writer.writerow(CSV_COLUMNS)
+    for t in transfers:
+        writer.writerow([t.source_plate, t.source_well, t.destination_plate,
+                         t.destination_well, format_volume(t.volume)])
+
+
+def parse_well(well):
+    """Returns the (row, column) of a well position such as B04"""
+    well = well.strip().upper()
+    if len(well) < 2 or well[0] not in string.ascii_uppercase or \
+            not well[1:].isdigit():
+        raise(ValueError("Invalid well position %s" % well))
+    return string.ascii_uppercase.index(well[0]) + 1, int(well[1:])
+
+
+def one_to_one(row, column):
+    """Mapping rule that transfers every well to the same well of the first
+    destination plate"""
+    return 0, row, column
+
+
+def quadrants(row, column):
+    """Mapping rule that splits a 384 well plate over four 96 well plates.
+    Quadrant 1 (A01, A03, ..., C01, ...) goes to the first destination plate,
+    quadrant 2 (A02, ...) to the second, quadrant 3 (B01, ...) to the third
+    and quadrant 4 (B02, ...) to the fourth."""
+    return ((row - 1) % 2) * 2 + (column - 1) % 2, (row + 1) // 2, (column + 1) // 2
+
+
+def cherry_pick(picks):
+    """Returns a mapping rule that transfers the source wells of picks, pairs
+    of well positions (source well, destination well) or (source well,
+    destination well, destination plate index), and skips other wells"""
+    mapping = {}
+    for pick in picks:
+        index = int(pick[2]) if len(pick) > 2 else 0
+        if index < 0:
+            raise(ValueError("Invalid destination plate index %d" % index))
+        mapping[parse_well(pick[0])] = (index, ) + parse_well(pick[1])
+
+    def rule(row, column):
+        return mapping.get((row, column))
+    return rule
+
+
+def plan_transfers(source, destinations, rule=one_to_one):
+    """Returns the (source well, destination well) Container pairs of the
+    wells of the source plate that hold an object, mapped to the destination
+    plates by rule. rule is called with the row and column of every source
+    well and returns the (destination plate index, row, column) or None to
+    skip the well. Raises an Exception if a destination well does not exist,
+    is not empty or is the destination of two source wells."""
+    plates = [source] + list(destinations)
+    wells = dict(((w.parent_id, w.row, w.column), w) for w in
+                 Container.objects.filter(parent__in=plates).select_related('parent'))
+    pairs = []
+    used = set()
+    for (plate_id, row, column), well in sorted(wells.items()):
+        if plate_id != source.pk or well.object_id is None:
+            continue
+        target = rule(row, column)
+        if target is None:
+            continue
+        index, destination_row, destination_column = target
+        destination = plates[index + 1]
+        destination_well = wells.get((destination.pk, destination_row,
+                                      destination_column))
+        if destination_well is None:
+            raise(Exception("Plate %s has no well %s" % (destination.barcode,
+                            position_label(Container(row=destination_row,
+                                                     column=destination_column)))))
+        if destination_well.object_id is not None:
+            raise(Exception("Well %s of plate %s is not empty" % (
+                position_label(destination_well), destination.barcode)))
+        if destination_well.pk in used:
+            raise(Exception("Well %s of plate %s is the destination of more "
+                            "than one well" % (position_label(destination_well),
+                                               destination.barcode)))
+        used.add(destination_well.pk)
+        pairs.append((well, destination_well))
+    return pairs
+
+
+def transfers(pairs, volume):
+    """Returns the Transfers of volume ul of the (source well, destination
+    well) pairs"""
+    return [Transfer(source.parent.barcode, position_label(source),
+                     destination.parent.barcode, position_label(destination),
+                     volume) for (source, destination) in pairs]
+
+
+def apply_moves(pairs):
+    """Moves the objects of the source wells to the destination wells, the
+    source wells are emptied, with one UPDATE per 250 pairs. Returns the
+    number of moved objects."""
+    wells = []
+    for source, destination in pairs:
+        destination.content_type_id = source.content_type_id
+        destination.object_id = source.object_id
+        source.content_type_id = source.object_id = None
+        wells += [source, destination]
+    bulk_update(Container, wells, ['content_type', 'object_id'])
+    return len(pairs)
+
+
+def plate_rows(plates):
+    """Returns the number of rows by barcode of the plates, 16 for plates
+    with wells beyond H12 (384 well plates) and 8 otherwise"""
+    rows = dict((p.barcode, 8) for p in plates)
+    for plate in Container.objects.filter(parent__in=plates).order_by() \
+            .values('parent').annotate(max_row=Max('row'),
+                                       max_column=Max('column')):
+        if plate['max_row'] > 8 or plate['max_column'] > 12:
+            rows[Container(pk=plate['parent']).barcode] = 16
+    return rows
+
+
+def well_number(well, rows):
+    """Returns the number of a well position, counting down the columns of a
+    plate with the given number of rows, e.g. B01 is 2 and A02 9 on a 96 well
+    plate"""
+    row, column = parse_well(well)
+    return (column - 1) * rows + row
+
+
+def write_echo(out, transfers):
+    """Writes the transfers in the Labcyte Echo format, volumes in nl"""
+    writer = csv.writer(out)
+    writer.writerow(['Source Plate Barcode', 'Source Well',
+                     'Destination Plate Barcode', 'Destination Well',
+                     'Transfer Volume'])
+    for t in transfers:
+        writer.writerow([t.source_plate, t.source_well, t.destination_plate,
+                         t.destination_well, int(round(t.volume * 1000))])
+
+
+def write_hamilton(out, transfers, rows=None):
+    """Writes the transfers in a Hamilton worklist, with well numbers as
+    positions. rows is the number of rows by plate barcode, 8 by default."""
+    rows = rows or {}
+    writer = csv.writer(out)
+    writer.writerow(['SourceLabware', 'SourcePosition', 'DestinationLabware',
+                     'DestinationPosition', 'Volume'])
+    for t in transfers:
+        writer.writerow([t.source_plate,
+                         well_number(t.source_well, rows.get(t.source_plate, 8)),
+                         t.destination_plate,
+                         well_number(t.destination_well,
+                                     rows.get(t.destination_plate, 8)),
+                         format_volume(t.volume)])
+
+
+def write_tecan(out, transfers, rows=None):
+    """Writes the transfers as a Tecan Freedom EVOware worklist (gwl), an
+    aspirate, dispense and wash line per transfer. rows is the number of rows
+    by plate barcode, 8 by default."""
+    rows = rows or {}
+    for t in transfers:
+        volume = format_volume(t.volume)
+        out.write("A;%s;;;%d;;%s\r\n" % (
+            t.source_plate, well_number(t.source_well, rows.get(t.source_plate, 8)),
+            volume))
+        out.write("D;%s;;;%d;;%s\r\n" % (
+            t.destination_plate,
+            well_number(t.destination_well, rows.get(t.destination_plate, 8)),
+            volume))
+        out.write("W;\r\n")
+
+
+# Formats whose writers take the rows by plate barcode
+POSITION_FORMATS = ('hamilton', 'tecan')
+# Writers by format name, all take the file like object and the transfers,
+# hamilton and tecan also the rows by plate barcode (see plate_rows)
+FORMATS = {
+    'csv': write_csv,
+    'echo': write_echo,
+    'hamilton': write_hamilton,
+    'tecan': write_tecan,
+}
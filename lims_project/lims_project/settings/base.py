@@ -112,3 +112,6 @@ TEMPLATE_CONTEXT_PROCESSORS = (
 
 # Change user model
 AUTH_USER_MODEL = "lims.UserProfile"
+
+# Cache of the read statistics of FASTQ files, see lims.readstats
+LIMS_READSTATS_CACHE = join(DJANGO_ROOT, 'readstats_cache.json')
@@ -14,3 +14,6 @@ DATABASES = {
         "PORT": "",
     },
 }
+
+# Don't cache read statistics between test runs
+LIMS_READSTATS_CACHE = None